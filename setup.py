@@ -24,7 +24,8 @@ setup(name="quartic-python",
           "click==6.7",
           "networkx==1.11",
           "gitpython==2.1.5",
-          "pyaml==17.8.0"
+          "pyaml==17.8.0",
+          "contextvars==2.4;python_version<'3.7'"
       ],
       extras_require={
           "graphviz":["pygraphviz==1.3.1"],
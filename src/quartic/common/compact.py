@@ -0,0 +1,61 @@
+# Shrinking DataFrames after reading.  Strings stay as Python objects and numbers as 64-bit by default, which is
+# typically several times more memory than the data actually needs.
+
+# String columns with at most this fraction of distinct values become categoricals
+DEFAULT_MAX_CATEGORY_FRACTION = 0.5
+
+
+def compact(df, max_category_fraction=DEFAULT_MAX_CATEGORY_FRACTION):
+    """Convert low-cardinality string columns of df to categoricals, and downcast numeric columns to the narrowest
+    type that represents every value exactly.  This is done in place, a column at a time, so that there's never
+    more than one extra column in memory.  Returns a report of the memory saved."""
+    before = memory_usage(df)
+    changes = {}
+    for name in df.columns:
+        col = df[name]
+        compacted = _compact_column(col, max_category_fraction)
+        if compacted.dtype != col.dtype:
+            df[name] = compacted
+            changes[str(name)] = {"from": str(col.dtype), "to": str(compacted.dtype)}
+
+    return {
+        "before_bytes": before,
+        "after_bytes": memory_usage(df),
+        "columns": changes
+    }
+
+
+def memory_usage(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def format_report(report):
+    before, after = report["before_bytes"], report["after_bytes"]
+    return "Compacted {} columns: {:.1f} MiB -> {:.1f} MiB ({:.0%} saved)".format(
+        len(report["columns"]), before / 2**20, after / 2**20, 1 - after / before if before else 0)
+
+
+def _compact_column(col, max_category_fraction):
+    import pandas
+    from pandas.api import types
+
+    if col.empty or types.is_bool_dtype(col) or str(col.dtype) == "category":
+        return col
+    elif types.is_integer_dtype(col):
+        return pandas.to_numeric(col, downcast="unsigned" if col.min() >= 0 else "integer")
+    elif types.is_float_dtype(col):
+        return _downcast_float(col)
+    elif types.is_object_dtype(col) or types.is_string_dtype(col):
+        # Only if every value is a string, not for mixed types, bytes, etc. (which may not even be hashable)
+        if types.infer_dtype(col.dropna()) == "string" and col.nunique() <= max_category_fraction * len(col):
+            return col.astype("category")
+    return col
+
+
+def _downcast_float(col):
+    import numpy
+    narrow = col.astype(numpy.float32)
+    # Only if it round-trips exactly, so we never silently lose precision
+    if ((narrow.astype(col.dtype) == col) | col.isnull()).all():
+        return narrow
+    return col
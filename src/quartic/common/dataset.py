@@ -63,20 +63,25 @@ class Writer:
         self._description = description
         self._exec = lambda f: None
 
-    def parquet(self, df):
-        self._exec = lambda f: f.parquet(df)
+    def parquet(self, df, **kwargs):
+        self._exec = lambda f: f.parquet(df, **kwargs)
+        return self
+
+    def arrow_ipc(self, df, **kwargs):
+        self._exec = lambda f: f.arrow_ipc(df, **kwargs)
         return self
 
     def json(self, df):
         self._exec = lambda f: f.json(df)
         return self
 
-    def csv(self, df):
-        self._exec = lambda f: f.csv(df)
+    def csv(self, df, **kwargs):
+        self._exec = lambda f: f.csv(df, **kwargs)
         return self
 
-    def apply(self, dataset):
-        with dataset.writer(self._name, self._description) as f:
+    def apply(self, dataset, extensions=None):
+        kwargs = {"extensions": extensions} if extensions else {}
+        with dataset.writer(self._name, self._description, **kwargs) as f:
             self._exec(f)
 
 def writer(name, description=None):
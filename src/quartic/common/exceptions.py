@@ -1,3 +1,4 @@
+import json
 import traceback
 
 class RunnerException(Exception):
@@ -21,6 +22,12 @@ class NoMatchingStepsException(RunnerException):
         self.step_id = step_id
         self.steps = steps
 
+class StepIdCollisionException(RunnerException):
+    def __init__(self, step_id, steps):
+        super(StepIdCollisionException, self).__init__("Multiple steps with the same id")
+        self.step_id = step_id
+        self.steps = steps
+
 class UserCodeExecutionException(RunnerException):
     def __init__(self, exception, tb):
         super(UserCodeExecutionException, self).__init__("Exception while executing user code")
@@ -36,6 +43,23 @@ class UserCodeExecutionException(RunnerException):
     def exception(self):
         return self._exception
 
+class BatchExecutionException(RunnerException):
+    def __init__(self, failures):
+        super(BatchExecutionException, self).__init__("{} steps failed or were skipped".format(len(failures)))
+        self.failures = failures
+
+def exception_details(exception):
+    """The public attributes of an exception, in JSON-serialisable form."""
+    output = {}
+    for k, v in exception.__dict__.items():
+        if not k.startswith("_"):
+            try:
+                json.dumps(v)
+                output[k] = v
+            except TypeError:
+                output[k] = str(v)
+    return output
+
 class QuarticException(Exception):
     pass
     
\ No newline at end of file
@@ -1,10 +1,45 @@
+import hashlib
+import io
+import os
 import re
 import tempfile
+import urllib.parse
 import warnings
 import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from .compact import compact as compact_dataframe, format_report
+from .exceptions import QuarticException
+from .stats import STATS_EXTENSION, dataframe_stats, merge_stats, table_stats
 from .log import logger
 log = logger(__name__)
 
+CSV_MIME_TYPE = "text/csv"
+JSON_MIME_TYPE = "application/json"
+JSONL_MIME_TYPE = "application/x-ndjson"
+PARQUET_MIME_TYPE = "application/vnd.apache.parquet"
+ARROW_IPC_MIME_TYPE = "application/vnd.apache.arrow.file"
+
+# An Arrow IPC file is this (padded) magic string, followed by record batches, followed by a footer
+ARROW_IPC_MAGIC = b"ARROW1\x00\x00"
+PARQUET_MAGIC = b"PAR1"
+
+# Rows per parquet row group, which is also how many rows are converted to Arrow at a time when writing
+DEFAULT_PARQUET_ROW_GROUP_SIZE = 256 * 1024
+
+# Parallel CSV parsing doesn't split files into chunks smaller than this
+PARALLEL_CSV_MIN_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Rows read before parsing a CSV in parallel, to find out the columns and which of them hold strings
+PARALLEL_CSV_SAMPLE_ROWS = 10000
+
+# Parser options which depend on the position within the whole file, so can't be applied to chunks independently
+_POSITIONAL_CSV_KWARGS = {"skiprows", "skipfooter", "nrows", "chunksize", "iterator", "index_col"}
+
+# Name of the sidecar object holding a preview of the first few rows of a dataset
+PREVIEW_NAME = "_preview"
+
 
 # Adapted from:
 # http://stackoverflow.com/questions/28682562/pandas-read-csv-converting-mixed-types-columns-as-string
@@ -30,8 +65,9 @@ def _read_csv(*args, coerce_mixed_types=True, target_type=str, **kwargs):
 
 
 def _warn_if_any_all_nan_columns(df):
-    nan_columns = df.columns.drop(df.dropna(how="all", axis=1).columns).values
-    if nan_columns.any():
+    # Column by column (by position, in case of duplicate names), as dropna would copy the whole frame
+    nan_columns = [c for i, c in enumerate(df.columns) if df.iloc[:, i].isnull().all()]
+    if nan_columns:
         log.warning("Columns with all-NaN values: %s", nan_columns)
 
 
@@ -41,7 +77,7 @@ def _raise_if_any_mixed_type_columns(df):
         raise ValueError("Cannot write columns with mixed types: {}".format(bad_columns))
 
 
-def _write_parquet(df, f):
+def _write_parquet(df, f, row_group_size=DEFAULT_PARQUET_ROW_GROUP_SIZE):
     import pyarrow.parquet as pq
     import pyarrow as pa
 
@@ -49,76 +85,598 @@ def _write_parquet(df, f):
     _warn_if_any_all_nan_columns(df)
     _raise_if_any_mixed_type_columns(df)
 
-    # we have to coerce timestamps to millisecond resolution as
-    # nanoseconds are not yet supported by Arrow/Parquet
-    tbl = pa.Table.from_pandas(df, timestamps_to_ms=True)
-    pq.write_table(tbl, pa.PythonFile(f))
+    # A default index is implied on read, so needn't be stored, but anything else has to be stored as a column
+    # since the pandas metadata of each slice would only describe that slice's part of it
+    preserve_index = not _has_default_index(df)
+
+    # Convert and write a slice at a time (each becoming a row group), so that we never hold an Arrow copy of the
+    # entire DataFrame
+    schema = None
+    writer = None
+    for start in range(0, max(len(df), 1), row_group_size):
+        df_slice = df.iloc[start:start + row_group_size]
+        # we have to coerce timestamps to millisecond resolution as
+        # nanoseconds are not yet supported by Arrow/Parquet
+        if schema is None:
+            tbl = pa.Table.from_pandas(df_slice, timestamps_to_ms=True, preserve_index=preserve_index)
+            widened = _widen_null_fields(tbl.schema, df)
+            if widened is not None:
+                tbl = pa.Table.from_pandas(df_slice, timestamps_to_ms=True, preserve_index=preserve_index,
+                                           schema=widened)
+            schema = tbl.schema     # Including the pandas metadata
+            writer = pq.ParquetWriter(pa.PythonFile(f), schema)
+        else:
+            tbl = pa.Table.from_pandas(df_slice, timestamps_to_ms=True, preserve_index=preserve_index, schema=schema)
+        writer.write_table(tbl)
+    writer.close()
+    return dataframe_stats(df, schema)
+
+
+def _has_default_index(df):
+    import pandas
+    return isinstance(df.index, pandas.RangeIndex) and df.index.equals(pandas.RangeIndex(len(df)))
+
+
+def _widen_null_fields(schema, df):
+    """Schema with the types of any all-null columns (in the first slice) inferred from the whole column instead,
+    or None if there aren't any."""
+    import pyarrow as pa
+    null_fields = [field.name for field in schema if str(field.type) == "null" and field.name in df.columns]
+    if not null_fields:
+        return None
+    # Mixed types have already been ruled out, so the first non-null value gives the type of the whole column
+    return pa.schema([
+        pa.field(field.name, pa.Array.from_pandas(df[field.name].dropna().iloc[:1]).type)
+        if field.name in null_fields else field
+        for field in schema
+    ])
+
+
+def _csv_chunk_offsets(f, size, num_chunks, data_start):
+    """Byte offsets splitting a CSV file into (roughly equal) chunks of whole lines, the first of which includes
+    everything before data_start (i.e. the header line)."""
+    offsets = [0]
+    for i in range(1, num_chunks):
+        f.seek(max(size * i // num_chunks, offsets[-1], data_start))
+        if f.tell() > data_start:
+            f.readline()    # Skip to the start of the next line
+        if f.tell() >= size:
+            break
+        if f.tell() > offsets[-1]:
+            offsets.append(f.tell())
+    return offsets + [size]
+
+
+def _parse_csv_chunk(path, start, end, kwargs):
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _read_csv(io.BytesIO(data), **kwargs)
+
+
+def _csv_dtypes(sample, dtype=None):
+    """The dtype to parse every chunk with: strings for any column the sample has strings in (so that e.g. a chunk in
+    which they're all empty isn't parsed as numbers), and whatever the caller asked for."""
+    from pandas.api import types
+    if dtype is not None and not isinstance(dtype, dict):
+        return dtype
+    dtypes = {name: str for name in sample.columns if types.is_object_dtype(sample[name])}
+    dtypes.update(dtype or {})
+    return dtypes
+
+
+def _mismatched_csv_columns(chunks):
+    """Columns that were parsed as different types in different chunks, and which pandas can't reconcile."""
+    from pandas.api import types
+    mismatched = []
+    for name in chunks[0].columns:
+        cols = [chunk[name] for chunk in chunks if len(chunk)]
+        if len({c.dtype for c in cols}) <= 1:
+            continue
+        if all(types.is_numeric_dtype(c) and not types.is_bool_dtype(c) for c in cols):
+            continue    # pandas reconciles these itself (e.g. int with float)
+        mismatched.append(name)
+    return mismatched
+
+
+def _read_csv_parallel(path, max_workers, **kwargs):
+    import pandas
+    header = kwargs.get("header", "infer")
+    if header not in ("infer", 0, None):
+        return _read_csv(path, **kwargs)
+    has_header_line = header == 0 or (header == "infer" and kwargs.get("names") is None)
+
+    # Fix the column names and (roughly) their types up front, so that every chunk is parsed the same way
+    sample = _read_csv(path, **dict(kwargs, nrows=PARALLEL_CSV_SAMPLE_ROWS, usecols=None))
+    offsets = _split_csv(path, max_workers, has_header_line)
+    if len(offsets) <= 2:
+        return _read_csv(path, **kwargs)
+
+    # Only the first chunk has the header line, so the rest are told the column names
+    rest_kwargs = dict(kwargs, header=None, names=list(sample.columns))
+    dtype = _csv_dtypes(sample, kwargs.get("dtype"))
+    log.info("Parsing %s in %d chunks", path, len(offsets) - 1)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        chunks = _parse_csv_chunks(executor, path, offsets, dict(kwargs, dtype=dtype), dict(rest_kwargs, dtype=dtype))
+        mismatched = _mismatched_csv_columns(chunks)
+        if mismatched:
+            # Strings turned up after the sample, in columns that looked numeric, so parse them as strings throughout
+            log.info("Parsing %s again with columns %s as strings", path, mismatched)
+            dtype = dict(dtype)
+            dtype.update({name: str for name in mismatched})
+            chunks = _parse_csv_chunks(executor, path, offsets, dict(kwargs, dtype=dtype),
+                                       dict(rest_kwargs, dtype=dtype))
+    return pandas.concat(chunks, ignore_index=True)
+
+
+def _split_csv(path, max_workers, has_header_line):
+    size = os.path.getsize(path)
+    num_chunks = min(max_workers or os.cpu_count() or 1, max(1, size // PARALLEL_CSV_MIN_CHUNK_BYTES))
+    with open(path, "rb") as f:
+        return _csv_chunk_offsets(f, size, num_chunks, len(f.readline()) if has_header_line else 0)
+
+
+def _parse_csv_chunks(executor, path, offsets, first_kwargs, rest_kwargs):
+    num_chunks = len(offsets) - 1
+    return list(executor.map(_parse_csv_chunk, [path] * num_chunks, offsets[:-1], offsets[1:],
+                             [first_kwargs] + [rest_kwargs] * (num_chunks - 1)))
 
 
 def _read_parquet(f):
     import pyarrow.parquet as pq
     with f:
-        tbl = pq.read_table(f)
-        return tbl.to_pandas()
+        return pq.read_table(f).to_pandas()
+
+
+def _write_arrow_ipc(df_or_table, f):
+    import pyarrow as pa
+
+    tbl = df_or_table if isinstance(df_or_table, pa.Table) else pa.Table.from_pandas(df_or_table)
+    writer = pa.RecordBatchFileWriter(pa.PythonFile(f, mode="w"), tbl.schema)
+    for batch in _record_batches(tbl):
+        writer.write_batch(batch)
+    writer.close()
+    return table_stats(tbl)
+
+
+def _record_batches(tbl):
+    """The chunks of tbl as record batches, without copying (as pyarrow 0.4 has no Table.to_batches)."""
+    import pyarrow as pa
+    columns = [tbl.column(i).data for i in range(tbl.num_columns)]
+    if len({column.num_chunks for column in columns}) > 1:
+        raise ValueError("Cannot write a table whose columns are chunked differently")
+    for i in range(columns[0].num_chunks if columns else 0):
+        yield pa.RecordBatch.from_arrays([column.chunk(i) for column in columns], tbl.schema.names,
+                                         metadata=tbl.schema.metadata)
+
+
+def _read_arrow_ipc(f):
+    import pyarrow as pa
+    with f:
+        # Memory-mapped files can be read zero-copy via the footer
+        if isinstance(f, pa.MemoryMappedFile):
+            return pa.RecordBatchFileReader(f).read_all()
+
+        # Otherwise the footer (which is the only place pyarrow 0.4 puts the schema) is at the end of the stream, so
+        # read it all into an Arrow buffer first
+        data = f.read()
+        if not data.startswith(ARROW_IPC_MAGIC):
+            raise ValueError("Not an Arrow IPC file")
+        return pa.RecordBatchFileReader(pa.BufferReader(data)).read_all()
+
+
+def _head_parquet(f, n, **kwargs):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(f)
+    tables = []
+    for i in range(pf.num_row_groups):
+        if sum(t.num_rows for t in tables) >= n:
+            break
+        tables.append(pf.read_row_group(i))
+    tbl = pa.concat_tables(tables) if tables else pf.read()     # Which is empty
+    return tbl.to_pandas().head(n)
+
+
+def _head_arrow_ipc(f, n, **kwargs):
+    import pyarrow as pa
+    reader = pa.RecordBatchFileReader(f)
+    batches = []
+    for i in range(reader.num_record_batches):
+        if sum(b.num_rows for b in batches) >= n:
+            break
+        batches.append(reader.get_batch(i))
+    tbl = pa.Table.from_batches(batches) if batches else reader.read_all()   # Which is empty
+    return tbl.to_pandas().head(n)
+
+
+def _head_lines(f, num_lines, block_size=64 * 1024):
+    data = b""
+    while data.count(b"\n") < num_lines:
+        block = f.read(block_size)
+        if not block:
+            break
+        data += block
+    return b"\n".join(data.split(b"\n")[:num_lines])
+
+
+def _head_csv(f, n, **kwargs):
+    return _read_csv(io.BytesIO(_head_lines(f, n + 1)), nrows=n, **kwargs)  # Allow for the header
+
+
+def _head_jsonl(f, n, **kwargs):
+    import pandas
+    return pandas.read_json(io.BytesIO(_head_lines(f, n)), lines=True, **kwargs)
+
+
+_HEAD_READERS = {
+    PARQUET_MIME_TYPE: _head_parquet,
+    ARROW_IPC_MIME_TYPE: _head_arrow_ipc,
+    CSV_MIME_TYPE: _head_csv,
+    JSONL_MIME_TYPE: _head_jsonl,
+}
+
+
+def _sniff_mime_type(f):
+    """The type of a binary format identified by its magic number, otherwise None."""
+    magic = f.read(len(ARROW_IPC_MAGIC))
+    f.seek(0)
+    if magic.startswith(PARQUET_MAGIC):
+        return PARQUET_MIME_TYPE
+    elif magic == ARROW_IPC_MAGIC:
+        return ARROW_IPC_MIME_TYPE
+    return None
+
+
+def _preview_of(df_or_table, num_rows):
+    import pyarrow as pa
+    if isinstance(df_or_table, pa.Table):
+        return _table_head(df_or_table, num_rows), df_or_table.num_rows
+    return df_or_table.head(num_rows), len(df_or_table)
+
+
+def _table_head(tbl, num_rows):
+    # pyarrow 0.4 has no Table.slice, but does have RecordBatch.slice
+    import pyarrow as pa
+    batches = []
+    for batch in _record_batches(tbl):
+        remaining = num_rows - sum(b.num_rows for b in batches)
+        if remaining <= 0:
+            break
+        batches.append(batch.slice(0, min(remaining, batch.num_rows)))
+    return pa.Table.from_batches(batches) if batches else tbl  # Which is empty
+
+
+def partition_path(path, name):
+    # Keep the partition within the final path component, so it's still a valid Howl key, after a separator which
+    # dataset ids can't contain (see raise_if_invalid_coord), so it can't be mistaken for another dataset's key
+    return path + ":" + urllib.parse.quote(name, safe="")
+
+
+def howl_partition_path(path, name):
+    # Anonymous datasets are uploaded to their namespace's collection (see Howl.path) and only get a key once
+    # registered, so there's no key to extend
+    if len(path.split("/")) != 5:
+        raise QuarticException("Can't write partitions or previews of anonymous datasets (at {})".format(path))
+    return partition_path(path, name)
+
+
+def _partition_matches(partitions, values):
+    if partitions is None:
+        return True
+    elif callable(partitions):
+        return partitions(values)
+    for column, allowed in partitions.items():
+        allowed = allowed if isinstance(allowed, (list, set, tuple)) else [allowed]
+        if values[column] not in [str(a) for a in allowed]:
+            return False
+    return True
 
 
 class DatasetReader:
-    def __init__(self, io_factory):
+    def __init__(self, io_factory, locator=None):
         self._io_factory = io_factory
+        self._locator = locator or {}
+        # Memory before/after of the most recent compact read
+        self.memory_report = None
 
     def raw(self):
         return self._io_factory.readable_file()
 
-    def csv(self, *args, **kwargs):
-        return _read_csv(self.raw(), *args, **kwargs)
+    def csv(self, *args, compact=False, parallel=False, max_workers=None, **kwargs):
+        """Read a CSV dataset, with any args passed to the parser.
+
+        If compact is set, low-cardinality string columns are converted to categoricals and numeric columns are
+        downcast where that loses nothing (see memory_report for the effect).
 
-    def parquet(self):
-        return _read_parquet(self.raw())
+        If parallel is set, large files are split at line boundaries and the pieces parsed concurrently by up to
+        max_workers processes.  The column names and string columns are taken from a sample at the start of the
+        file, so every piece is parsed alike.  This assumes that no quoted field contains a newline, and falls
+        back to a single parser for options that depend on position within the file (e.g. skiprows, or a header
+        other than the first line)."""
+        if parallel and not args and not _POSITIONAL_CSV_KWARGS.intersection(kwargs):
+            with self._io_factory.local_copy() as path:
+                df = _read_csv_parallel(path, max_workers, **kwargs)
+        else:
+            df = _read_csv(self.raw(), *args, **kwargs)
+        return self._compact(df, compact)
+
+    def parquet(self, partitions=None, max_workers=None, compact=False):
+        """Read a parquet dataset.
+
+        For partitioned datasets, partitions selects which partitions to read, either as a dict mapping each
+        column to a value (or list of values), or as a predicate over a dict of partition values.  Selected
+        partitions are read concurrently, by up to max_workers threads.
+
+        If compact is set, the result is compacted as for csv()."""
+        if "partitions" in self._locator:
+            df = self._read_partitions(
+                partitions, max_workers, lambda io_factory: _read_parquet(io_factory.mapped_file()))
+        elif partitions is not None:
+            raise QuarticException("Can't select partitions of an unpartitioned dataset")
+        else:
+            df = _read_parquet(self._io_factory.mapped_file())
+        return self._compact(df, compact)
+
+    def _compact(self, df, compact):
+        if not compact:
+            return df
+        self.memory_report = compact_dataframe(df)
+        log.info(format_report(self.memory_report))
+        return df
+
+    def head(self, n=10, **kwargs):
+        """The first n rows of a tabular dataset, without reading the whole thing.
+
+        This is served from the preview written alongside the dataset if there is one, otherwise by reading only
+        the start of the data (or the first row groups/batches, for parquet and Arrow).  Any kwargs are passed to
+        the CSV parser."""
+        preview = self._locator.get("preview")
+        if preview and (preview["num_rows"] >= n or preview["complete"]):
+            return DatasetReader(self._io_factory.partition(preview["name"])).arrow_ipc().head(n)
+
+        if "partitions" in self._locator:
+            dfs = []
+            for part in self._locator["partitions"]["parts"]:
+                if sum(len(df) for df in dfs) >= n:
+                    break
+                reader = DatasetReader(self._io_factory.partition(part["name"]),
+                                       {"mime_type": self._locator.get("mime_type")})
+                dfs.append(reader.head(n, **kwargs))
+            import pandas
+            return pandas.concat(dfs).head(n) if dfs else pandas.DataFrame()
+
+        with self._io_factory.random_access_file() as f:
+            mime_type = self._locator.get("mime_type")
+            if mime_type not in _HEAD_READERS:
+                mime_type = _sniff_mime_type(f)
+            if mime_type is None:
+                raise QuarticException("Can't read the head of a dataset of unknown format ({})".format(
+                    self._locator.get("mime_type")))
+            return _HEAD_READERS[mime_type](f, n, **kwargs)
+
+    def partitions(self):
+        manifest = self._locator.get("partitions")
+        return [p["values"] for p in manifest["parts"]] if manifest else []
+
+    def _read_partitions(self, partitions, max_workers, read):
+        import pandas
+        parts = self._locator["partitions"]["parts"]
+        if not parts:
+            return pandas.DataFrame()
+
+        selected = [p for p in parts if _partition_matches(partitions, p["values"])]
+        if not selected:
+            # Still honour the schema
+            return read(self._io_factory.partition(parts[0]["name"])).iloc[0:0]
+
+        io_factories = [self._io_factory.partition(p["name"]) for p in selected]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return pandas.concat(list(executor.map(read, io_factories)))
+
+    def arrow_ipc(self, as_table=False):
+        tbl = _read_arrow_ipc(self._io_factory.readable_stream())
+        return tbl if as_table else tbl.to_pandas()
 
     def json(self):
         return json.load(self.raw())
 
 
 class DatasetWriter:
-    def __init__(self, io_factory, on_close, catalogue_extensions):
+    # pylint: disable=too-many-instance-attributes
+    # Locator entries describing previously-written content, which are superseded by any write
+    SUPERSEDED_LOCATOR_KEYS = ("partitions", "content_hash", "preview")
+
+    def __init__(self, io_factory, on_close, catalogue_extensions, previous_locator=None):
         self._io_factory = io_factory
         self._on_close = on_close
         self._extensions = catalogue_extensions
+        self._previous_locator = previous_locator or {}
+        self._locator = {}
+        self._stats = None
         self._file = None
+        self._closed = False
 
     def __enter__(self):
-        self._file = self._io_factory.writable_file()
+        self._file = HashingFile(self._io_factory.writable_file())
         return self
 
     def __exit__(self, exception_type, exception_value, traceback):
+        self._closed = True
         if exception_type:
             self._file.cancel()
         else:
-            self._file.close()
+            self._record_stats()
+            self._record_content_hash()
+            if self.unchanged():
+                # Whatever's already there is identical, so don't bother uploading it again
+                log.info("Content unchanged (%s), skipping upload", self._locator["content_hash"])
+                self._file.cancel()
+            else:
+                self._file.close()
             self._on_close(self._extensions)
 
     def write(self, *args, **kwargs):
         self._file.write(*args, **kwargs)
 
+    @property
+    def closed(self):
+        # So that pyarrow will treat us as a file
+        return self._closed
+
     def extensions(self):
         return self._extensions
 
-    def parquet(self, df, *args, **kwargs):
-        return _write_parquet(df, self)
+    def locator(self):
+        """Updates to the catalogue locator describing what was written."""
+        return self._locator
+
+    def parquet(self, df, partition_by=None, preview_rows=None, row_group_size=DEFAULT_PARQUET_ROW_GROUP_SIZE):
+        """Write a DataFrame as parquet.
+
+        If partition_by (a column name or list of column names) is specified, a separate object is written for each
+        distinct value, and a manifest of the partitions is recorded in the catalogue locator.
+
+        If preview_rows is specified, that many rows are also written to a small sidecar object, from which
+        DatasetReader.head() can be served.
+
+        The DataFrame is converted and written row_group_size rows at a time, which bounds the extra memory needed
+        to write it."""
+        self._locator["mime_type"] = PARQUET_MIME_TYPE
+        self._write_preview(df, preview_rows)
+        if partition_by is None:
+            self._stats = _write_parquet(df, self, row_group_size)
+        else:
+            self._write_partitions(df, partition_by, lambda writer, part: writer.parquet(
+                part, row_group_size=row_group_size))
+
+    def arrow_ipc(self, df_or_table, preview_rows=None):
+        self._locator["mime_type"] = ARROW_IPC_MIME_TYPE
+        self._write_preview(df_or_table, preview_rows)
+        self._stats = _write_arrow_ipc(df_or_table, self)
 
     def json(self, o):
+        self._locator["mime_type"] = JSON_MIME_TYPE
         self._reopen_as_text_file()
         json.dump(o, self._file)
 
-    def csv(self, df, *args, **kwargs):
+    def csv(self, df, *args, preview_rows=None, **kwargs):
+        self._locator["mime_type"] = CSV_MIME_TYPE
+        self._write_preview(df, preview_rows)
         self._reopen_as_text_file()
         df.to_csv(self._file, *args, **kwargs)
+        self._stats = dataframe_stats(df)
+
+    def _write_partitions(self, df, partition_by, write):
+        if isinstance(partition_by, str):
+            partition_by = [partition_by]
+        null_columns = [c for c in partition_by if df[c].isnull().any()]
+        if null_columns:
+            raise ValueError("Cannot partition by columns with null values: {}".format(null_columns))
+
+        previous_parts = {p["name"]: p for p in self._previous_locator.get("partitions", {}).get("parts", [])}
+        parts = []
+        for values, part in df.groupby(partition_by, sort=True):
+            values = values if isinstance(values, tuple) else (values,)
+            values = [(column, str(value)) for column, value in zip(partition_by, values)]
+            name = "/".join("{}={}".format(column, value) for column, value in values)
+            with DatasetWriter(self._io_factory.partition(name), lambda _: None, None,
+                               previous_locator=previous_parts.get(name)) as writer:
+                write(writer, part)
+            parts.append({
+                "name": name,
+                "values": dict(values),
+                "stats": writer.extensions()[STATS_EXTENSION],
+                "content_hash": writer.locator()["content_hash"]
+            })
+
+        self._locator["partitions"] = {"columns": partition_by, "parts": parts}
+        self._stats = merge_stats([p["stats"] for p in parts])
+
+    def _write_preview(self, df_or_table, preview_rows):
+        if not preview_rows:
+            return
+        preview, total_rows = _preview_of(df_or_table, preview_rows)
+        with DatasetWriter(self._io_factory.partition(PREVIEW_NAME), lambda _: None, None,
+                           previous_locator=self._previous_locator.get("preview")) as writer:
+            writer.arrow_ipc(preview)
+        self._locator["preview"] = {
+            "name": PREVIEW_NAME,
+            "num_rows": min(preview_rows, total_rows),
+            "complete": total_rows <= preview_rows,
+            "content_hash": writer.locator()["content_hash"]
+        }
+
+    def unchanged(self):
+        """Whether what was written is identical to what the previous locator describes."""
+        content_hash = self._locator.get("content_hash")
+        return content_hash is not None and content_hash == self._previous_locator.get("content_hash")
+
+    def _record_content_hash(self):
+        content_hash = self._file.content_hash()
+        if content_hash is None:
+            self._locator.pop("content_hash", None)
+        elif "partitions" in self._locator:
+            # The object itself is empty, so describe the content by its parts instead
+            h = hashlib.sha256(content_hash.encode())
+            for part in self._locator["partitions"]["parts"]:
+                h.update("\n{}\n{}".format(part["name"], part["content_hash"]).encode())
+            self._locator["content_hash"] = "sha256:" + h.hexdigest()
+        else:
+            self._locator["content_hash"] = content_hash
+
+    def _record_stats(self):
+        if self._stats is None:
+            # Stats carried over from the previous version no longer describe the content
+            if self._extensions and STATS_EXTENSION in self._extensions:
+                self._extensions = {k: v for k, v in self._extensions.items() if k != STATS_EXTENSION}
+            return
+        if "num_bytes" not in self._stats:
+            self._stats["num_bytes"] = self._file.size()
+        if self._extensions is None:
+            self._extensions = {}
+        self._extensions[STATS_EXTENSION] = self._stats
 
     # Bit of a hack to deal with the fact that json.dump wants a text file
     # TODO - see if https://stackoverflow.com/a/14870531/129570 solves this issue
     def _reopen_as_text_file(self):
         self._file.cancel()
-        self._file = self._io_factory.writable_file(mode="w+")
+        self._file = HashingFile(self._io_factory.writable_file(mode="w+"))
+
+
+class HashingFile:
+    """Wraps a writable file, computing a digest of (and counting) everything written to it."""
+    def __init__(self, file):
+        self._file = file
+        self._hash = hashlib.sha256()
+        self._size = 0
+
+    def write(self, data):
+        if self._hash is not None:
+            raw = data.encode("utf-8") if isinstance(data, str) else data
+            self._hash.update(raw)
+            self._size += len(raw)
+        return self._file.write(data)
+
+    def seek(self, *args, **kwargs):
+        # We can no longer vouch for the content
+        self._hash = None
+        return self._file.seek(*args, **kwargs)
+
+    def tell(self, *args, **kwargs):
+        return self._file.tell(*args, **kwargs)
+
+    def close(self):
+        self._file.close()
+
+    def cancel(self):
+        self._file.cancel()
+
+    def content_hash(self):
+        return None if self._hash is None else "sha256:" + self._hash.hexdigest()
+
+    def size(self):
+        return self._size if self._hash is not None else self._file.tell()
 
 
 class DownloadFile:
@@ -148,6 +706,100 @@ class DownloadFile:
         self.close()
 
 
+class RangeFile:
+    """Read-only, seekable view of a remote object, which fetches only the byte ranges that are actually read.
+
+    If the server doesn't support range requests, the whole object is downloaded once, on the first read."""
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, howl, path, block_size=1024 * 1024, max_blocks=16):
+        self._howl = howl
+        self._path = path
+        self._size = howl.size_path(path)
+        self._block_size = block_size
+        self._max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._download = None
+        self._pos = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        end = self._size if size is None or size < 0 else min(self._pos + size, self._size)
+        chunks = []
+        while self._pos < end:
+            index, offset = divmod(self._pos, self._block_size)
+            chunk = self._block(index)[offset:offset + end - self._pos]
+            chunks.append(chunk)
+            self._pos += len(chunk)
+        return b"".join(chunks)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._blocks.clear()
+        if self._download is not None:
+            self._download.close()
+        self.closed = True
+
+    def _block(self, index):
+        start = index * self._block_size
+        if self._download is not None:
+            self._download.seek(start)
+            return self._download.read(self._block_size)
+        if index in self._blocks:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+
+        block = self._howl.download_range(self._path, start, min(start + self._block_size, self._size) - 1)
+        if block is None:
+            # The range was ignored, so each block would cost a download of the whole object
+            self._download = DownloadFile(self._howl, self._path)
+            return self._block(index)
+        self._blocks[index] = block
+        if len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+class DownloadStream:
+    """Forward-only view of a download, for consumers that can decode as data arrives."""
+    def __init__(self, howl, path):
+        self._response = howl.download_path(path, stream=True)
+        self._response.raw.decode_content = True
+
+    def read(self, *args, **kwargs):
+        return self._response.raw.read(*args, **kwargs)
+
+    def close(self):
+        self._response.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
 class UploadFile:
     def __init__(self, howl, path, mode):
         self._howl = howl
@@ -181,6 +833,46 @@ class UploadFile:
         self.close()
 
 
+class AtomicFile:
+    """Writes to a temporary file alongside the target, which is only renamed into place on close.
+
+    Readers therefore never observe a partially-written file."""
+    def __init__(self, path, mode="w+b"):
+        self._path = path
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        self._tmp = os.fdopen(fd, mode)
+
+    def write(self, *args, **kwargs):
+        return self._tmp.write(*args, **kwargs)
+
+    def seek(self, *args, **kwargs):
+        return self._tmp.seek(*args, **kwargs)
+
+    def tell(self, *args, **kwargs):
+        return self._tmp.tell(*args, **kwargs)
+
+    def close(self):
+        self._tmp.flush()
+        os.fsync(self._tmp.fileno())
+        self._tmp.close()
+        os.replace(self._tmp_path, self._path)
+
+    def cancel(self):
+        self._tmp.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *args, **kwargs):
+        if exception_type:
+            self.cancel()
+        else:
+            self.close()
+
+
 class LocalIoFactory:
     def __init__(self, path):
         self._path = path
@@ -191,7 +883,26 @@ class LocalIoFactory:
         return file
 
     def readable_file(self):
-        return open(self._path, "r+b")
+        return open(self._path, "rb")
+
+    def mapped_file(self):
+        # Read-only memory map, so pyarrow can decode straight out of the page cache (shared between processes)
+        # rather than via copies into Python buffers
+        import pyarrow as pa
+        return pa.memory_map(str(self._path), "r")
+
+    def readable_stream(self):
+        return self.mapped_file()
+
+    def random_access_file(self):
+        return self.mapped_file()
+
+    @contextmanager
+    def local_copy(self):
+        yield str(self._path)
+
+    def partition(self, name):
+        return LocalIoFactory(partition_path(str(self._path), name))
 
 
 class RemoteIoFactory:
@@ -204,3 +915,26 @@ class RemoteIoFactory:
 
     def readable_file(self):
         return DownloadFile(self._howl, self._path)
+
+    def mapped_file(self):
+        return self.readable_file()
+
+    def readable_stream(self):
+        return DownloadStream(self._howl, self._path)
+
+    def random_access_file(self):
+        return RangeFile(self._howl, self._path)
+
+    @contextmanager
+    def local_copy(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as f, self._howl.download_path(self._path, stream=True) as r:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+            yield path
+        finally:
+            os.remove(path)
+
+    def partition(self, name):
+        return RemoteIoFactory(self._howl, howl_partition_path(self._path, name))
@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+import shutil
+import urllib.parse
+import uuid
+from .exceptions import QuarticException
+from .io import AtomicFile, LocalIoFactory, howl_partition_path
+from .services import Howl, raise_if_entries_differ
+
+
+def _local_path(root, path):
+    bits = path.strip("/").split("/")
+    if any(bit in ("", ".", "..") for bit in bits):
+        raise QuarticException("Malformed path: {}".format(path))
+    return os.path.join(root, *bits)
+
+
+class LocalResponse:
+    """Just enough of requests.Response for code written against the remote Howl."""
+    def __init__(self, path):
+        self._path = path
+        self.status_code = 200
+
+    @property
+    def content(self):
+        with open(self._path, "rb") as f:
+            return f.read()
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def iter_content(self, chunk_size=1):
+        with open(self._path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                yield chunk
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+
+class LocalHowl:
+    """Howl semantics on the local filesystem, with each object stored as a file under root_dir."""
+    def __init__(self, root_dir):
+        self._root = os.path.join(root_dir, "howl")
+
+    def exists_path(self, path):
+        return os.path.isfile(self.local_path(path))
+
+    def download_path(self, path, stream=False):
+        local_path = self.local_path(path)
+        if not os.path.isfile(local_path):
+            raise QuarticException("Object not found: {}".format(path))
+        return LocalResponse(local_path)
+
+    def download_range(self, path, start, end):
+        with open(self.local_path(path), "rb") as f:
+            f.seek(start)
+            return f.read(end + 1 - start)
+
+    def size_path(self, path):
+        return os.path.getsize(self.local_path(path))
+
+    def upload_path(self, path, data):
+        with AtomicFile(self.local_path(path), "w+b") as f:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                shutil.copyfileobj(data, f)
+        return LocalResponse(self.local_path(path))
+
+    def local_path(self, path):
+        return _local_path(self._root, path)
+
+    @staticmethod
+    def path(namespace, key=None):
+        # The remote Howl assigns keys to anonymous objects, so we do the same
+        return Howl.path(namespace, key if key is not None else str(uuid.uuid4()))
+
+
+class LocalCatalogue:
+    """Catalogue semantics on the local filesystem, with each entry stored as a JSON file under root_dir."""
+    def __init__(self, root_dir):
+        self._root = os.path.join(root_dir, "catalogue")
+
+    def datasets(self):
+        out = {}
+        if not os.path.isdir(self._root):
+            return out
+        for namespace in sorted(os.listdir(self._root)):
+            out[namespace] = {}
+            for fname in sorted(os.listdir(os.path.join(self._root, namespace))):
+                if fname.endswith(".json"):
+                    with open(os.path.join(self._root, namespace, fname)) as f:
+                        out[namespace][urllib.parse.unquote(fname[:-len(".json")])] = json.load(f)
+        return out
+
+    def get(self, namespace, dataset_id):
+        path = self._entry_path(namespace, dataset_id)
+        if os.path.isfile(path):
+            with open(path) as f:
+                return json.load(f)
+
+    def put(self, namespace, dataset_id, dataset, overwrite=False):
+        if dataset_id is None:
+            dataset_id = str(uuid.uuid4())
+        elif not overwrite:
+            raise_if_entries_differ(namespace, dataset_id, self.get(namespace, dataset_id), dataset)
+
+        entry = dict(dataset, metadata=dict(dataset["metadata"], registered=_now()))
+        with AtomicFile(self._entry_path(namespace, dataset_id), "w+") as f:
+            json.dump(entry, f, indent=1)
+        return {"namespace": namespace, "id": dataset_id}
+
+    def unregister(self, namespace, dataset_id):
+        path = self._entry_path(namespace, dataset_id)
+        if not os.path.isfile(path):
+            raise QuarticException("Dataset not found: {}::{}".format(namespace, dataset_id))
+        os.remove(path)
+
+    def _entry_path(self, namespace, dataset_id):
+        return _local_path(self._root, "{}/{}.json".format(namespace, urllib.parse.quote(dataset_id, safe="")))
+
+
+class LocalHowlIoFactory(LocalIoFactory):
+    def __init__(self, howl, path):
+        LocalIoFactory.__init__(self, howl.local_path(path))
+        self._howl = howl
+        self._howl_path = path
+
+    def writable_file(self, mode="w+b"):
+        return AtomicFile(self._path, mode)
+
+    def partition(self, name):
+        return LocalHowlIoFactory(self._howl, howl_partition_path(self._howl_path, name))
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat() + "Z"
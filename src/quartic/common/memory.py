@@ -0,0 +1,246 @@
+import copy
+import io
+import json
+import threading
+from .compact import compact as compact_dataframe, format_report
+from .exceptions import QuarticException
+from .io import DEFAULT_PARQUET_ROW_GROUP_SIZE, _partition_matches, _write_arrow_ipc, _write_parquet
+from .log import logger
+log = logger(__name__)
+
+# Parser options that can be applied to already-parsed data
+_IN_MEMORY_CSV_KWARGS = {"usecols", "dtype"}
+
+
+class MemoryStore:
+    """Holds the outputs of pipeline steps in memory, so that steps running in the same process can hand datasets to
+    each other without writing them out and reading them back.
+
+    Only datasets in persist are also written through to the underlying Quartic client.  If consumers (a count
+    per dataset) is given, datasets without consumers aren't kept, and each dataset is dropped once it has been
+    released as many times as it has consumers."""
+    def __init__(self, persist=(), consumers=None):
+        self._persist = set(persist)
+        self._consumers = dict(consumers) if consumers is not None else None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, coords):
+        with self._lock:
+            return coords in self._entries
+
+    def persists(self, coords):
+        return coords in self._persist
+
+    def dataset(self, coords, target=None):
+        """A dataset backed by this store, which also writes through to target (a Quartic dataset) if given."""
+        return MemoryDataset(self, coords, target)
+
+    def get(self, coords):
+        with self._lock:
+            if coords not in self._entries:
+                raise QuarticException("Dataset not in memory: {}".format(coords))
+            return self._entries[coords]
+
+    def put(self, coords, entry):
+        with self._lock:
+            if self._consumers is None or self._consumers.get(coords):
+                self._entries[coords] = entry
+
+    def release(self, coords):
+        with self._lock:
+            if self._consumers is None or coords not in self._consumers:
+                return
+            self._consumers[coords] -= 1
+            if self._consumers[coords] <= 0:
+                self._entries.pop(coords, None)
+
+
+class MemoryEntry:
+    """A dataset's content, along with how it was written (the writer method and its arguments), so that it can be
+    reproduced by MemoryReader.raw()."""
+    # pylint: disable=too-many-arguments
+    def __init__(self, metadata, kind, value, method, args=(), kwargs=None):
+        self.metadata = metadata
+        self.kind = kind
+        self.value = value
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs or {}
+
+
+class MemoryDataset:
+    """Just enough of quartic.Dataset for pipeline steps."""
+    def __init__(self, store, coords, target=None):
+        self._store = store
+        self._coords = coords
+        self._target = target
+
+    def metadata(self):
+        return dict(self._store.get(self._coords).metadata)
+
+    def extensions(self):
+        return self._target.extensions() if self._target else {}
+
+    def version(self):
+        # In-memory content has no durable version, so nothing downstream of it is considered up to date
+        return self._target.version() if self._target else None
+
+    def reader(self):
+        return MemoryReader(self._store.get(self._coords))
+
+    def writer(self, name=None, description=None, **kwargs):
+        target_writer = self._target.writer(name, description, **kwargs) if self._target else None
+        return MemoryWriter(self._store, self._coords, {"name": name, "description": description or name},
+                            target_writer)
+
+    def __repr__(self):
+        return repr(self._coords)
+
+
+class MemoryReader:
+    """Just enough of DatasetReader for pipeline steps.
+
+    The data is already parsed, so of the CSV parser options only usecols and dtype can be honoured, and any others
+    are rejected (raw() gives the content as it would have been written, for parsing some other way)."""
+    def __init__(self, entry):
+        self._entry = entry
+        self.memory_report = None
+
+    def raw(self):
+        entry = self._entry
+        if entry.method == "json":
+            return io.BytesIO(json.dumps(entry.value).encode())
+        elif entry.method == "csv":
+            kwargs = {k: v for k, v in entry.kwargs.items() if k != "preview_rows"}
+            return io.BytesIO(entry.value.to_csv(None, *entry.args, **kwargs).encode())
+        elif entry.method == "parquet" and entry.kwargs.get("partition_by") is None:
+            f = io.BytesIO()
+            _write_parquet(entry.value, f, entry.kwargs.get("row_group_size", DEFAULT_PARQUET_ROW_GROUP_SIZE))
+        elif entry.method == "arrow_ipc":
+            f = io.BytesIO()
+            _write_arrow_ipc(entry.value, f)
+        else:
+            raise QuarticException("Can't read raw content of a partitioned dataset")
+        f.seek(0)
+        return f
+
+    def csv(self, *args, compact=False, parallel=False, max_workers=None, **kwargs):
+        # pylint: disable=unused-argument
+        return self._compact(self._apply_csv_options(self._tabular(), *args, **kwargs), compact)
+
+    def parquet(self, partitions=None, max_workers=None, compact=False):
+        # pylint: disable=unused-argument
+        df = self._tabular()
+        partition_by = self._entry.kwargs.get("partition_by")
+        if partition_by is not None:
+            df = _select_partitions(df, partition_by, partitions)
+        elif partitions is not None:
+            raise QuarticException("Can't select partitions of an unpartitioned dataset")
+        return self._compact(df, compact)
+
+    def arrow_ipc(self, as_table=False):
+        import pyarrow as pa
+        df = self._tabular()
+        return pa.Table.from_pandas(df) if as_table else df
+
+    def head(self, n=10, **kwargs):
+        return self._apply_csv_options(self._tabular(), **kwargs).head(n)
+
+    def partitions(self):
+        partition_by = self._entry.kwargs.get("partition_by")
+        if partition_by is None:
+            return []
+        return [_partition_values(partition_by, values) for values, _ in self._tabular().groupby(partition_by)]
+
+    def json(self):
+        self._raise_unless("json")
+        return copy.deepcopy(self._entry.value)
+
+    def _compact(self, df, compact):
+        if not compact:
+            return df
+        df = df.copy()  # Compacted in place, so needs its own columns
+        self.memory_report = compact_dataframe(df)
+        log.info(format_report(self.memory_report))
+        return df
+
+    def _apply_csv_options(self, df, *args, **kwargs):
+        unsupported = sorted(set(kwargs) - _IN_MEMORY_CSV_KWARGS)
+        if args or unsupported:
+            raise QuarticException("Can't apply CSV parser options to in-memory dataset {}: {}".format(
+                self._entry.metadata.get("name"), list(args) + unsupported))
+        usecols = kwargs.get("usecols")
+        if callable(usecols):
+            df = df[[c for c in df.columns if usecols(c)]]
+        elif usecols is not None:
+            df = df[[c for i, c in enumerate(df.columns) if c in usecols or i in usecols]]
+        dtype = kwargs.get("dtype")
+        if isinstance(dtype, dict):
+            dtype = {c: t for c, t in dtype.items() if c in df.columns}
+        return df.astype(dtype) if dtype else df
+
+    def _tabular(self):
+        import pyarrow as pa
+        self._raise_unless("tabular")
+        value = self._entry.value
+        # A shallow copy, so that consumers can add or replace columns without affecting each other
+        return value.to_pandas() if isinstance(value, pa.Table) else value.copy(deep=False)
+
+    def _raise_unless(self, kind):
+        if self._entry.kind != kind:
+            raise QuarticException("Can't read {} dataset as {}".format(self._entry.kind, kind))
+
+
+def _select_partitions(df, partition_by, partitions):
+    import pandas
+    selected = [part for values, part in df.groupby(partition_by, sort=True)
+                if _partition_matches(partitions, _partition_values(partition_by, values))]
+    return pandas.concat(selected) if selected else df.iloc[0:0]
+
+
+def _partition_values(partition_by, values):
+    values = values if isinstance(values, tuple) else (values,)
+    return {column: str(value) for column, value in zip(partition_by, values)}
+
+
+class MemoryWriter:
+    def __init__(self, store, coords, metadata, target_writer=None):
+        self._store = store
+        self._coords = coords
+        self._metadata = metadata
+        self._target_writer = target_writer
+        self._entry = None
+
+    def __enter__(self):
+        if self._target_writer:
+            self._target_writer.__enter__()
+        return self
+
+    def __exit__(self, etype, value, tb):
+        if self._target_writer:
+            self._target_writer.__exit__(etype, value, tb)
+        if etype is None and self._entry:
+            self._store.put(self._coords, self._entry)
+
+    def parquet(self, df, partition_by=None, **kwargs):
+        partition_by = [partition_by] if isinstance(partition_by, str) else partition_by
+        self._write("tabular", "parquet", df.copy(), partition_by=partition_by, **kwargs)
+
+    def arrow_ipc(self, df_or_table, **kwargs):
+        import pyarrow as pa
+        # Tables are immutable, so needn't be copied
+        self._write("tabular", "arrow_ipc",
+                    df_or_table if isinstance(df_or_table, pa.Table) else df_or_table.copy(), **kwargs)
+
+    def csv(self, df, *args, **kwargs):
+        self._write("tabular", "csv", df.copy(), *args, **kwargs)
+
+    def json(self, o):
+        self._write("json", "json", copy.deepcopy(o))
+
+    def _write(self, kind, method, value, *args, **kwargs):
+        # value is a copy, so that the writing step can carry on modifying what it wrote without affecting readers
+        self._entry = MemoryEntry(self._metadata, kind, value, method, args, kwargs)
+        if self._target_writer:
+            getattr(self._target_writer, method)(value, *args, **kwargs)
@@ -0,0 +1,203 @@
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the request latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)    # Final slot is the +Inf bucket
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for le, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield le, total
+
+    def to_dict(self):
+        return {
+            "buckets": [[le, count] for le, count in zip(self.buckets, self.counts)],
+            "overflow": self.counts[-1],
+            "count": self.count,
+            "sum": self.sum
+        }
+
+
+class EndpointStats:
+    def __init__(self, buckets):
+        self.latency = Histogram(buckets)
+        self.status_codes = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+
+    def to_dict(self):
+        return {
+            "latency": self.latency.to_dict(),
+            "status_codes": dict(self.status_codes),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "retries": self.retries
+        }
+
+
+class Metrics:
+    """Records per-endpoint request statistics and trace spans for service calls.
+
+    Services only touch this when one is supplied, so there's no cost when metrics are disabled."""
+    def __init__(self, buckets=DEFAULT_BUCKETS, max_spans=10000):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._spans = deque(maxlen=max_spans)
+        self._local = threading.local()
+
+    # pylint: disable=too-many-arguments
+    def record_request(self, service, method, endpoint, status_code, start, end,
+                       bytes_sent=0, bytes_received=0, retries=0):
+        key = (service, method, endpoint)
+        status = str(status_code) if status_code is not None else "error"
+        with self._lock:
+            stats = self._endpoints.get(key)
+            if stats is None:
+                stats = self._endpoints[key] = EndpointStats(self._buckets)
+            stats.latency.observe(end - start)
+            stats.status_codes[status] = stats.status_codes.get(status, 0) + 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.retries += retries
+        self._add_span("{} {}".format(method, endpoint), start, end, {
+            "service.name": service,
+            "http.method": method,
+            "http.route": endpoint,
+            "http.status_code": status_code,
+            "http.request_content_length": bytes_sent,
+            "http.response_content_length": bytes_received,
+            "http.retry_count": retries
+        })
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Group the requests made within the block under a parent span (e.g. a pipeline step)."""
+        span_id = self._new_id()
+        parents = self._parents()
+        parents.append(span_id)
+        start = time.time()
+        try:
+            yield
+        finally:
+            parents.pop()
+            self._add_span(name, start, time.time(), attributes, span_id=span_id)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "requests": [
+                    dict(service=service, method=method, endpoint=endpoint, **stats.to_dict())
+                    for (service, method, endpoint), stats in sorted(self._endpoints.items())
+                ]
+            }
+
+    def to_prometheus(self):
+        lines = []
+
+        def metric(name, metric_type, help_text):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+
+            metric("quartic_request_duration_seconds", "histogram", "Latency of Quartic service requests.")
+            for key, stats in endpoints:
+                for le, count in stats.latency.cumulative():
+                    lines.append(_sample("quartic_request_duration_seconds_bucket", key, count, le=_format_le(le)))
+                lines.append(_sample("quartic_request_duration_seconds_sum", key, stats.latency.sum))
+                lines.append(_sample("quartic_request_duration_seconds_count", key, stats.latency.count))
+
+            metric("quartic_requests_total", "counter", "Quartic service requests by status code.")
+            for key, stats in endpoints:
+                for status, count in sorted(stats.status_codes.items()):
+                    lines.append(_sample("quartic_requests_total", key, count, status=status))
+
+            for name, attr, help_text in [
+                    ("quartic_request_bytes_sent_total", "bytes_sent", "Bytes sent in request bodies."),
+                    ("quartic_request_bytes_received_total", "bytes_received", "Bytes received in response bodies."),
+                    ("quartic_request_retries_total", "retries", "Retries performed by the HTTP transport.")]:
+                metric(name, "counter", help_text)
+                for key, stats in endpoints:
+                    lines.append(_sample(name, key, getattr(stats, attr)))
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        _write_atomically(path, self.to_prometheus())
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(dict(self.to_dict(), spans=self.spans()), indent=1))
+
+    def _add_span(self, name, start, end, attributes, span_id=None):
+        parents = self._parents()
+        span = {
+            "name": name,
+            "span_id": span_id or self._new_id(),
+            "parent_span_id": parents[-1] if parents else None,
+            "start_time_unix_nano": int(start * 1e9),
+            "end_time_unix_nano": int(end * 1e9),
+            "attributes": attributes
+        }
+        with self._lock:
+            self._spans.append(span)
+
+    def _parents(self):
+        if not hasattr(self._local, "parents"):
+            self._local.parents = []
+        return self._local.parents
+
+    @staticmethod
+    def _new_id():
+        return uuid.uuid4().hex[:16]
+
+
+def _format_le(le):
+    return "+Inf" if le == float("inf") else repr(le)
+
+
+def _sample(name, key, value, **extra_labels):
+    service, method, endpoint = key
+    labels = [("service", service), ("method", method), ("endpoint", endpoint)] + sorted(extra_labels.items())
+    return "{}{{{}}} {}".format(
+        name,
+        ",".join("{}=\"{}\"".format(k, _escape_label(v)) for k, v in labels),
+        value)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _write_atomically(path, content):
+    # So that a scraper (e.g. the node_exporter textfile collector) never sees a partial file
+    tmp_path = "{}.tmp".format(path)
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
@@ -1,19 +1,35 @@
 # pylint: disable=too-many-arguments
+import copy
 import requests
 
 from quartic.common.dataset import raise_if_invalid_coord
 from .io import DatasetWriter, DatasetReader, RemoteIoFactory
 from .services import Howl, Catalogue
+from .local import LocalCatalogue, LocalHowl, LocalHowlIoFactory
 from .exceptions import QuarticException
+from .log import logger
+log = logger(__name__)
 
 class Quartic:
-    def __init__(self, api_token, url_format="http://localhost:{port}/api/", shell=None):
-        self._catalogue = Catalogue(url_format.format(service="catalogue", port=8090), bearer_token=api_token)
-        self._howl = Howl(url_format.format(service="howl", port=8120), bearer_token=api_token)
+    def __init__(self, api_token, url_format="http://localhost:{port}/api/", shell=None, metrics=None,
+                 catalogue=None, howl=None, io_factory_class=RemoteIoFactory):
+        self._catalogue = catalogue or Catalogue(url_format.format(service="catalogue", port=8090),
+                                                 bearer_token=api_token, metrics=metrics)
+        self._howl = howl or Howl(url_format.format(service="howl", port=8120),
+                                  bearer_token=api_token, metrics=metrics)
+        self._io_factory_class = io_factory_class
         self._shell = shell
 
+    @staticmethod
+    def local(root_dir, shell=None):
+        """A client backed by catalogue and Howl implementations that live under root_dir on the local filesystem."""
+        return Quartic(api_token=None, shell=shell,
+                       catalogue=LocalCatalogue(root_dir),
+                       howl=LocalHowl(root_dir),
+                       io_factory_class=LocalHowlIoFactory)
+
     def __call__(self, namespace):
-        return Namespace(self._catalogue, self._howl, namespace, self._notebook_name())
+        return Namespace(self._catalogue, self._howl, namespace, self._notebook_name(), self._io_factory_class)
 
     def _notebook_name(self):
         # WEIRD WEIRD HACK
@@ -27,16 +43,17 @@ class Quartic:
 
 
 class Namespace:
-    def __init__(self, catalogue, howl, namespace, notebook_name):
+    def __init__(self, catalogue, howl, namespace, notebook_name, io_factory_class=RemoteIoFactory):
         raise_if_invalid_coord(namespace)
         self._catalogue = catalogue
         self._howl = howl
         self._namespace = namespace
         self._notebook_name = notebook_name
+        self._io_factory_class = io_factory_class
 
     def dataset(self, dataset_id):
         return Dataset(self._catalogue, self._howl, self._namespace,
-                       dataset_id, self._notebook_name)
+                       dataset_id, self._notebook_name, self._io_factory_class)
 
 
 class Dataset:
@@ -48,7 +65,7 @@ class Dataset:
         self._namespace = namespace
         self._dataset_id = dataset_id
         self._notebook_name = notebook_name
-        self._io_factory_class = io_factory_class # Used for testing
+        self._io_factory_class = io_factory_class
 
     def metadata(self):
         return self._get_dataset()["metadata"]
@@ -56,6 +73,13 @@ class Dataset:
     def extensions(self):
         return self._get_dataset()["extensions"]
 
+    def version(self):
+        """Identifies the current content of the dataset, or None if it doesn't exist."""
+        dataset = self._get_dataset()
+        if not dataset:
+            return None
+        return dataset["locator"].get("content_hash") or dataset["metadata"].get("registered")
+
     def update(self, metadata=None, extensions=None):
         if metadata is None and extensions is None:
             raise QuarticException("Must specify metadata or extensions")
@@ -80,13 +104,13 @@ class Dataset:
         dataset = self._get_dataset()
         if not dataset:
             raise QuarticException("Can't read non-existent dataset: {}".format(self))
-        return DatasetReader(self._io_factory_class(self._howl, dataset["locator"]["path"], None))
+        return DatasetReader(self._io_factory_class(self._howl, dataset["locator"]["path"]), dataset["locator"])
 
     def writer(self, name=None, description=None, mime_type="application/octet-stream",
                attribution="quartic", extensions=None, streaming=False):
         dataset = self._get_dataset()
         if dataset:
-            return self._writer_for_existing_dataset(name, description, dataset)
+            return self._writer_for_existing_dataset(name, description, dataset, extensions)
         else:
             return self._writer_for_new_dataset(name, description, mime_type, attribution, extensions, streaming)
 
@@ -106,35 +130,47 @@ class Dataset:
                     "attribution": attribution
                 },
                 "extensions": self._enrich_extensions(final_extensions),
-                "locator": {
+                "locator": dict({
                     "type": "cloud",
                     "path": howl_path,
                     "streaming": streaming,
                     "mime_type": mime_type
-                }
+                }, **writer.locator())
             }
             r = self._put_dataset(dataset)
             if not self._dataset_id:
                 self._dataset_id = r["id"]
 
-        return DatasetWriter(self._io_factory_class(self._howl, howl_path), on_close, extensions)
+        writer = DatasetWriter(self._io_factory_class(self._howl, howl_path), on_close, extensions)
+        return writer
 
-    def _writer_for_existing_dataset(self, name, description, dataset):
+    def _writer_for_existing_dataset(self, name, description, dataset, extensions=None):
         assert dataset["locator"]["type"] == "cloud"
 
+        original = copy.deepcopy(dataset)
+        original["metadata"].pop("registered")
+
         def on_close(final_extensions):
             dataset["extensions"] = final_extensions
+            for key in DatasetWriter.SUPERSEDED_LOCATOR_KEYS:
+                dataset["locator"].pop(key, None)
+            dataset["locator"].update(writer.locator())
             dataset["metadata"].pop("registered")
             if name is not None:
                 dataset["metadata"]["name"] = name
             if description is not None:
                 dataset["metadata"]["description"] = description
+            if dataset == original:
+                log.info("Catalogue entry for %s unchanged, skipping registration", self)
+                return
             self._put_dataset(dataset, True)
 
-        return DatasetWriter(
+        writer = DatasetWriter(
             self._io_factory_class(self._howl, dataset["locator"]["path"]),
             on_close,
-            dataset["extensions"])
+            _merge_extensions(dataset["extensions"], extensions),
+            previous_locator=original["locator"])
+        return writer
 
     def _get_dataset(self):
         if self._dataset_id is None:
@@ -148,11 +184,15 @@ class Dataset:
         out = {}
         if self._notebook_name:
             out["notebook"] = self._notebook_name
-        if extensions:
-            out.update(extensions)
-        return out
+        return _merge_extensions(out, extensions)
 
     def __repr__(self):
         return "{namespace}::{dataset_id}".format(
             namespace=self._namespace,
             dataset_id=self._dataset_id)
+
+
+def _merge_extensions(existing, updates):
+    # An update of None removes the extension
+    merged = dict(existing, **(updates or {}))
+    return {k: v for k, v in merged.items() if v is not None}
@@ -1,3 +1,4 @@
+import time
 import urllib.parse
 from datadiff import diff
 import requests
@@ -27,24 +28,48 @@ def get_session(bearer_token):
 
 class Service:
     """Abstract class for wrapping a service API."""
-    def __init__(self, api_root, bearer_token):
+    name = "service"
+
+    def __init__(self, api_root, bearer_token, metrics=None):
         self._api_root = api_root
         self._session = get_session(bearer_token)
+        self._metrics = metrics
 
     def _head(self, resource, allow_404=False, **kwargs):
-        return self._check(self._session.head(self._url(resource), **kwargs), allow_404=allow_404)
+        return self._request(self._session.head, "HEAD", resource, allow_404, **kwargs)
 
     def _get(self, resource, allow_404=False, **kwargs):
-        return self._check(self._session.get(self._url(resource), **kwargs), allow_404=allow_404)
+        return self._request(self._session.get, "GET", resource, allow_404, **kwargs)
 
     def _post(self, resource, allow_404=False, **kwargs):
-        return self._check(self._session.post(self._url(resource), **kwargs), allow_404=allow_404)
+        return self._request(self._session.post, "POST", resource, allow_404, **kwargs)
 
     def _put(self, resource, allow_404=False, **kwargs):
-        return self._check(self._session.put(self._url(resource), **kwargs), allow_404=allow_404)
+        return self._request(self._session.put, "PUT", resource, allow_404, **kwargs)
 
     def _delete(self, resource, allow_404=False, **kwargs):
-        return self._check(self._session.delete(self._url(resource), **kwargs), allow_404=allow_404)
+        return self._request(self._session.delete, "DELETE", resource, allow_404, **kwargs)
+
+    # pylint: disable=too-many-arguments
+    def _request(self, send, method, resource, allow_404, **kwargs):
+        if self._metrics is None:
+            return self._check(send(self._url(resource), **kwargs), allow_404=allow_404)
+
+        r = None
+        start = time.time()
+        try:
+            r = send(self._url(resource), **kwargs)
+        finally:
+            self._metrics.record_request(
+                self.name, method, self._endpoint(resource),
+                r.status_code if r is not None else None,
+                start, time.time(),
+                **_transfer_stats(r, kwargs.get("stream", False)))
+        return self._check(r, allow_404=allow_404)
+
+    def _endpoint(self, resource):
+        """Low-cardinality label for a resource, used when recording metrics."""
+        return resource
 
     def _url(self, resource):
         if resource.startswith("/"):
@@ -65,9 +90,38 @@ class Service:
             raise QuarticException(r.text)
 
 
+def _transfer_stats(r, stream):
+    if r is None:
+        return {}
+    bytes_received = r.headers.get("Content-Length")
+    if bytes_received is None and not stream:
+        bytes_received = len(r.content)
+    retries = getattr(getattr(r.raw, "retries", None), "history", None) or ()
+    return {
+        "bytes_sent": int(r.request.headers.get("Content-Length", 0)) if r.request is not None else 0,
+        "bytes_received": int(bytes_received or 0),
+        "retries": len(retries)
+    }
+
+
+def raise_if_entries_differ(namespace, dataset_id, existing, dataset):
+    if existing:
+        existing["metadata"].pop("registered")
+
+        if existing != dataset:
+            msg = "[{} / {}] catalogue entries differ:\n{}.\n Specify overwrite=True to replace".format(
+                namespace,
+                dataset_id,
+                diff(existing, dataset)
+            )
+            raise QuarticException(msg)
+
+
 class Howl(Service):
-    def __init__(self, api_root, bearer_token):
-        Service.__init__(self, api_root, bearer_token)
+    name = "howl"
+
+    def __init__(self, api_root, bearer_token, metrics=None):
+        Service.__init__(self, api_root, bearer_token, metrics)
 
     def exists_path(self, path):
         return self._head(path, allow_404=True) is not None
@@ -75,6 +129,18 @@ class Howl(Service):
     def download_path(self, path, stream=False):
         return self._get(path, stream=stream)
 
+    def download_range(self, path, start, end):
+        """Bytes start to end (inclusive) of the object, or None if the server doesn't support range requests."""
+        r = self._get(path, headers={"Range": "bytes={}-{}".format(start, end)}, stream=True)
+        try:
+            # Servers that don't support range requests send everything, which we leave unread
+            return r.content if r.status_code == 206 else None
+        finally:
+            r.close()
+
+    def size_path(self, path):
+        return int(self._head(path).headers["Content-Length"])
+
     def upload_path(self, path, data):
         num_bits = len(path.split("/"))
         # Recall that the path includes a leading slash, so counts are one higher
@@ -92,10 +158,20 @@ class Howl(Service):
         else:
             return "/{}/managed/{}/{}".format(namespace, namespace, Service._quote(key))
 
+    def _endpoint(self, resource):
+        num_bits = len(resource.split("/"))
+        if num_bits == 5:
+            return "/{namespace}/managed/{namespace}/{key}"
+        elif num_bits == 4:
+            return "/{namespace}/managed/{namespace}"
+        return resource
+
 
 class Catalogue(Service):
-    def __init__(self, api_root, bearer_token):
-        Service.__init__(self, api_root, bearer_token)
+    name = "catalogue"
+
+    def __init__(self, api_root, bearer_token, metrics=None):
+        Service.__init__(self, api_root, bearer_token, metrics)
 
     def datasets(self):
         r = self._get("/datasets")
@@ -112,23 +188,21 @@ class Catalogue(Service):
             return self._post(self._path(namespace, dataset_id), json=dataset).json()
         else:
             if not overwrite:
-                existing = self.get(namespace, dataset_id)
-                if existing:
-                    existing["metadata"].pop("registered")
-
-                    if existing != dataset:
-                        msg = "[{} / {}] catalogue entries differ:\n{}.\n Specify overwrite=True to replace".format(
-                            namespace,
-                            dataset_id,
-                            diff(existing, dataset)
-                        )
-                        raise QuarticException(msg)
+                raise_if_entries_differ(namespace, dataset_id, self.get(namespace, dataset_id), dataset)
 
             return self._put(self._path(namespace, dataset_id), json=dataset).json()
 
     def unregister(self, namespace, dataset_id):
         return self._delete(self._path(namespace, dataset_id))
 
+    def _endpoint(self, resource):
+        num_bits = len(resource.split("/"))
+        if num_bits == 4:
+            return "/datasets/{namespace}/{dataset_id}"
+        elif num_bits == 3:
+            return "/datasets/{namespace}"
+        return resource
+
     @staticmethod
     def _path(namespace, dataset_id):
         if dataset_id is None:
@@ -0,0 +1,104 @@
+import math
+
+# Dataset statistics recorded in the catalogue extensions at write time, so that consumers can learn about a
+# dataset without downloading it.  Shaped like:
+#
+#   {
+#       "schema": [{"name": "foo", "type": "int64"}, ...],
+#       "num_rows": 1234,
+#       "num_bytes": 56789,
+#       "columns": {"foo": {"min": 0, "max": 42, "null_count": 3}, ...}
+#   }
+#
+# Types are given in the vocabulary of whatever produced the data (i.e. Arrow for parquet, pandas for CSV).
+STATS_EXTENSION = "stats"
+
+
+def table_stats(tbl):
+    return _schema_stats(tbl.schema, tbl.num_rows)
+
+
+def _schema_stats(schema, num_rows):
+    return {
+        "schema": [{"name": field.name, "type": str(field.type)} for field in schema],
+        "num_rows": num_rows,
+    }
+
+
+def dataframe_stats(df, schema=None):
+    """Statistics for df.  If it was written with an Arrow schema (e.g. as parquet), the types are taken from
+    that rather than from pandas."""
+    columns = {}
+    for name in df.columns:
+        col = df[name]
+        values = col.dropna()
+        lo = hi = None
+        if not values.empty:
+            try:
+                lo, hi = values.min(), values.max()
+            except TypeError:   # Values aren't mutually comparable
+                pass
+        columns[str(name)] = _json_column({"min": lo, "max": hi, "null_count": len(col) - len(values)})
+
+    stats = _schema_stats(schema, len(df)) if schema is not None else {
+        "schema": [{"name": str(name), "type": str(dtype)} for name, dtype in df.dtypes.items()],
+        "num_rows": len(df)
+    }
+    stats["columns"] = columns
+    return stats
+
+
+def merge_stats(stats_list):
+    """Combine statistics for several pieces (e.g. partitions) of the same dataset."""
+    if not stats_list:
+        return None
+    merged = {
+        "schema": stats_list[0]["schema"],
+        "num_rows": sum(s["num_rows"] for s in stats_list),
+    }
+    if all("num_bytes" in s for s in stats_list):
+        merged["num_bytes"] = sum(s["num_bytes"] for s in stats_list)
+    if all("columns" in s for s in stats_list):
+        columns = {}
+        for s in stats_list:
+            for name, column in s["columns"].items():
+                columns[name] = _merge_column(columns[name], column) if name in columns else column
+        merged["columns"] = columns
+    return merged
+
+
+def _merge_column(a, b):
+    return {
+        "min": _extreme(min, a["min"], b["min"]),
+        "max": _extreme(max, a["max"], b["max"]),
+        "null_count": a["null_count"] + b["null_count"]
+    }
+
+
+def _extreme(f, a, b):
+    if a is None:
+        return b
+    elif b is None:
+        return a
+    try:
+        return f(a, b)
+    except TypeError:   # Values aren't mutually comparable
+        return None
+
+
+def _json_column(column):
+    return {k: _json_value(v) for k, v in column.items()}
+
+
+def _json_value(v):
+    if v is None or isinstance(v, (bool, int, str)):
+        return v
+    elif isinstance(v, float):
+        return v if math.isfinite(v) else None
+    elif isinstance(v, bytes):
+        return v.decode("utf-8", errors="replace")
+    elif hasattr(v, "item"):    # numpy scalars
+        return _json_value(v.item())
+    elif hasattr(v, "isoformat"):
+        return v.isoformat()
+    return str(v)
@@ -1,16 +1,19 @@
+import ast
+import contextlib
 import os
 import sys
 import importlib
 import pkgutil
+import threading
 from quartic.dsl.context import DslContext
 from quartic.common.exceptions import QuarticException
 
 
-def get_python_files(dirs_and_files):
+def get_python_files(dirs_and_files, recursive=False):
     files = []
     for a in dirs_and_files:
         if os.path.isdir(a):
-            files += find_python_files(a)
+            files += find_python_files(a, recursive)
         if a.endswith(".py"):
             files.append(a)
     if files:
@@ -19,13 +22,14 @@ def get_python_files(dirs_and_files):
         print("No files found for current config. Bailing.") #TODO - log this scenario
         sys.exit(1)
 
-def find_python_files(d):
+def find_python_files(d, recursive=False):
+    """Python files in the directory, and if recursive, in its subdirectories too (as loaded with recursive)."""
+    if not recursive:
+        return [os.path.join(d, f) for f in sorted(os.listdir(d)) if f.endswith(".py")]
     files = []
-    for f in os.listdir(d):
-        if f.endswith(".py"):
-            files.append(os.path.join(d, f))
-        else:
-            continue
+    for root, dirs, names in os.walk(d):
+        dirs[:] = sorted(sub for sub in dirs if not sub.startswith(".") and sub != "__pycache__")
+        files += [os.path.join(root, f) for f in sorted(names) if f.endswith(".py")]
     return files
 
 def load_module(mspec):
@@ -33,15 +37,15 @@ def load_module(mspec):
     return module
 
 # TODO: Figure out a way to do this more nicely
-def load_package(package_dir):
-    # First load the root package
+def load_package_root(package_dir):
     package_name = os.path.basename(package_dir)
     init_py = os.path.join(package_dir, "__init__.py")
     if not os.path.exists(init_py):
         raise QuarticException("Package {} is missing __init__.py".format(package_dir))
-    mspec = importlib.util.spec_from_file_location(os.path.dirname(package_dir), init_py)
+    # Named after the whole path (so that's its __name__), as packages in the same directory would otherwise load into
+    # each other's module
+    mspec = importlib.util.spec_from_file_location(package_dir, init_py)
     m = load_module(mspec)
-    yield m
 
     # This is a bit of a kludge to make sure the submodules can find the root package
     # under a sensible name. e.g. if you have the following:
@@ -60,20 +64,142 @@ def load_package(package_dir):
     #
     # this ensures that both of these imports can resolve the pipelines package.
     sys.modules[package_name] = m
+    return m
+
+def submodule_specs(package):
+    # Submodules of the package to depth 1
+    # TODO: This is a namedtuple in some versions of Python
+    return [pkg[0].find_spec(pkg[1]) for pkg in pkgutil.iter_modules(package.__path__)]
 
-    # Then load submodules of the package to depth 1
-    for pkg in pkgutil.iter_modules(m.__path__):
-        # TODO: This is a namedtuple in some versions of Python
-        mspec = pkg[0].find_spec(pkg[1])
-        m = load_module(mspec)
-        yield m
+def nested_module_names(package_dir):
+    """Qualified names of the modules in subpackages of the package (i.e. below depth 1), parents first."""
+    def walk(d, prefix):
+        for info in pkgutil.iter_modules([d]):
+            name = "{}.{}".format(prefix, info[1])
+            yield name
+            if info[2]:
+                for nested in walk(os.path.join(d, info[1]), name):
+                    yield nested
 
-def load_modules(package_dirs):
+    package_name = os.path.basename(package_dir)
+    return [name for info in pkgutil.iter_modules([package_dir]) if info[2]
+            for name in walk(os.path.join(package_dir, info[1]), "{}.{}".format(package_name, info[1]))]
+
+def load_package(package_dir, module_names=None, recursive=False):
+    # First load the root package
+    m = load_package_root(package_dir)
+    yield m
+
+    # Then its submodules (or just those named)
+    for mspec in submodule_specs(m):
+        if module_names is None or mspec.name in module_names:
+            yield load_module(mspec)
+
+    # Then anything in nested packages that those didn't already import
+    if recursive and module_names is None:
+        for name in nested_module_names(package_dir):
+            if name not in sys.modules:
+                yield importlib.import_module(name)
+
+def load_modules(package_dirs, module_names=None, recursive=False):
     for package_dir in package_dirs:
-        for m in load_package(package_dir):
+        for m in load_package(package_dir, module_names, recursive):
             yield m
 
-def get_pipeline_from_args(dirs):
-    with DslContext() as context:
-        list(load_modules(dirs))
-        return context.nodes()
+def get_pipeline_from_args(dirs, module_names=None, isolated=False, recursive=False):
+    """If isolated, see isolated_modules.  If recursive, modules in nested packages are loaded too."""
+    with isolated_modules(dirs) if isolated else contextlib.suppress():
+        with DslContext() as context:
+            list(load_modules(dirs, module_names, recursive))
+            return context.nodes()
+
+_module_locks = {}
+_module_locks_lock = threading.Lock()
+
+def _module_lock(name):
+    with _module_locks_lock:
+        return _module_locks.setdefault(name, threading.RLock())
+
+@contextlib.contextmanager
+def isolated_modules(package_dirs):
+    """Remove everything loaded from the packages from sys.modules afterwards, restoring whatever was there before.
+
+    The packages and their submodules are loaded under global names in sys.modules, so this also holds a lock per
+    name until then.  Only packages whose module names don't overlap can be loaded concurrently (in other threads):
+    any sharing a name, e.g. two checkouts of the same repo, are serialised.  Steps which import their own package at
+    run time won't find it afterwards, so this is for evaluating pipelines rather than running them."""
+    names = set(package_dirs)
+    for package_dir in package_dirs:
+        names.add(os.path.basename(package_dir))
+        names.update(info[1] for info in pkgutil.iter_modules([package_dir]))
+    locks = [_module_lock(name) for name in sorted(names)]     # Always in the same order, so we can't deadlock
+    for lock in locks:
+        lock.acquire()
+    before = dict(sys.modules)
+    try:
+        yield
+    finally:
+        dirs = tuple(os.path.abspath(d) + os.sep for d in package_dirs)
+        for name, m in list(sys.modules.items()):
+            local = (name.split(".")[0] in names or name in names or
+                     os.path.abspath(getattr(m, "__file__", None) or os.sep).startswith(dirs))
+            if local and before.get(name) is not m:
+                if name in before:
+                    sys.modules[name] = before[name]
+                else:
+                    del sys.modules[name]
+        for lock in reversed(locks):
+            lock.release()
+
+def import_closure(path, roots):
+    """Local files imported (transitively) by the file at path, including the packages they're in.
+
+    roots maps the name of each pipeline package to its directory.  Imports are found statically, so any made by
+    computed name are missed."""
+    seen = set()
+    pending = [path]
+    while pending:
+        for f in _imported_files(pending.pop(), roots):
+            if f not in seen:
+                seen.add(f)
+                pending.append(f)
+    seen.discard(path)
+    return seen
+
+def _imported_files(path, roots):
+    with open(path, "rb") as f:
+        tree = ast.parse(f.read(), path)
+    package = _package_name(path, roots)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level:
+                parts = package.split(".")[:len(package.split(".")) - node.level + 1] if package else []
+                base = ".".join(parts + ([node.module] if node.module else []))
+            names.add(base)
+            names.update("{}.{}".format(base, alias.name) for alias in node.names)
+    return {f for name in names for f in _module_files(name, roots)}
+
+def _package_name(path, roots):
+    for name, root in roots.items():
+        relative = os.path.relpath(os.path.dirname(path), root)
+        if not relative.startswith(".."):
+            return ".".join([name] + ([] if relative == "." else relative.split(os.sep)))
+    return None
+
+def _module_files(name, roots):
+    # Files executed by importing the named module, if it's local
+    parts = name.split(".")
+    if parts[0] not in roots:
+        return []
+    path = roots[parts[0]]
+    files = [os.path.join(path, "__init__.py")]
+    for part in parts[1:]:
+        path = os.path.join(path, part)
+        for candidate in [os.path.join(path, "__init__.py"), path + ".py"]:
+            if os.path.isfile(candidate):
+                files.append(candidate)
+    return files
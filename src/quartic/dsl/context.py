@@ -1,27 +1,41 @@
+import contextvars
+
+# The innermost open context in the current thread (or asyncio task), so that evaluations in different threads don't
+# see each other's nodes, and a context can be opened within another
+_current = contextvars.ContextVar("quartic_dsl_context", default=None)
+
 class DslContext:
-    _instance = None
     def __init__(self):
         self._objects = []
+        self._tokens = []
 
     def __enter__(self):
-        if DslContext._instance:
-            raise ValueError("A DSLContext is already open")
-        DslContext._instance = self
+        self._tokens.append(_current.set(self))
         return self
 
     def __exit__(self, etype, value, tb):
-        DslContext._instance = None
+        _current.reset(self._tokens.pop())
 
     @classmethod
-    def register(cls, o):
-        if cls._instance is None:
+    def current(cls):
+        context = _current.get()
+        if context is None:
             raise ValueError("No DSLContext created")
-        cls._instance.objects().append(o)
+        return context
+
+    @classmethod
+    def register(cls, o):
+        cls.current().objects().append(o)
         return o
 
     def objects(self):
         return self._objects
 
-    @classmethod
-    def nodes(cls):
-        return cls._instance.objects()
+    def nodes(self):
+        return self.objects()
+
+    def take(self):
+        """The nodes registered since they were last taken, which are then forgotten."""
+        nodes = list(self._objects)
+        del self._objects[:]
+        return nodes
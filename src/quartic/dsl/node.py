@@ -1,48 +1,66 @@
+import hashlib
 import inspect
 import itertools
-import zlib
 import os.path
 import pprint
 from quartic.common.exceptions import QuarticException
 from quartic.common.dataset import Dataset
 
 class ExecutionContext:
-    def __init__(self, quartic, namespace):
+    def __init__(self, quartic, namespace, store=None, incremental=False):
         self.quartic = quartic
         self.namespace = namespace
+        self.store = store
+        self.incremental = incremental
 
     def resolve(self, dataset):
-        return dataset.with_namespace(self.namespace).resolve(self.quartic)
+        dataset = dataset.with_namespace(self.namespace)
+        if self.store is not None and dataset in self.store:
+            return self.store.dataset(dataset)
+        return dataset.resolve(self.quartic)
+
+    def resolve_output(self, dataset):
+        dataset = dataset.with_namespace(self.namespace)
+        if self.store is None:
+            return dataset.resolve(self.quartic)
+        return self.store.dataset(dataset, dataset.resolve(self.quartic) if self.store.persists(dataset) else None)
 
 class Executor:
     def execute(self, context, inputs, output, func):
+        """Returns False if there was nothing to do, as the output was already up to date."""
         raise NotImplementedError()
 
+    def runnable(self):
+        return True
+
     def to_dict(self):
         return {}
 
 class LexicalInfo:
+    __slots__ = ("file", "line_range")
+
     def __init__(self, file, line_range):
         self.file = file
         self.line_range = line_range
 
 class Node:
+    # pylint: disable=too-many-instance-attributes
+    # Pipelines can have thousands of nodes, so they're kept small, and anything that's slow to work out (e.g.
+    # lexical info, which means reading and tokenising the source) is left until it's needed
+    __slots__ = ("name", "description", "_func", "_executor", "_lexical_info", "_inputs", "_output", "_id")
+
     def __init__(self, func, executor, *args, **kwargs):
         self.name = func.__name__
         self.description = func.__doc__
         self._func = func
         self._executor = executor
-        source_lines = inspect.getsourcelines(func)
-        end_line = source_lines[1] + len(source_lines[0]) - 1
-        self._lexical_info = LexicalInfo(
-            os.path.relpath(inspect.getsourcefile(func)),
-            (source_lines[1], end_line))
+        self._lexical_info = None
+        self._id = None
         self._inputs = {}
-        sig = inspect.signature(func)
+        params, ret = _annotations(func)
 
         # Input datasets
-        for p in sig.parameters:
-            ann = sig.parameters[p].annotation
+        for p, ann in params:
             if ann == inspect.Signature.empty:
                 raise QuarticException("Unannotated argument: '{}'".format(p))
             elif isinstance(ann, dict):
@@ -51,18 +69,29 @@ class Node:
                 self._inputs[p] = Dataset(ann)
 
         # Output dataset
-        ret = sig.return_annotation
         if ret == inspect.Signature.empty:
             raise QuarticException("No output annotation")
         self._output = Dataset(ret)
 
     def get_id(self):
-        in_datasets = sorted([str(ds) for ds in self.inputs()])
-        out_datasets = [str(ds) for ds in self.outputs()]
-        return str(zlib.adler32("\n".join(in_datasets + out_datasets).encode()))
+        # Only steps with exactly the same datasets should share an id, so a strong hash
+        if self._id is None:
+            in_datasets = sorted([str(ds) for ds in self.inputs()])
+            out_datasets = [str(ds) for ds in self.outputs()]
+            self._id = hashlib.sha256("\n".join(in_datasets + out_datasets).encode()).hexdigest()
+        return self._id
+
+    def lexical_info(self):
+        if self._lexical_info is None:
+            source_lines = inspect.getsourcelines(self._func)
+            end_line = source_lines[1] + len(source_lines[0]) - 1
+            self._lexical_info = LexicalInfo(
+                os.path.relpath(inspect.getsourcefile(self._func)),
+                (source_lines[1], end_line))
+        return self._lexical_info
 
     def get_file(self):
-        return self._lexical_info.file
+        return self.lexical_info().file
 
     def get_name(self):
         return self.name
@@ -81,24 +110,53 @@ class Node:
     def datasets(self):
         return itertools.chain(self.inputs(), self.outputs())
 
-    def execute(self, quartic, namespace):
-        self._executor.execute(ExecutionContext(quartic, namespace),
-                               self._inputs, self._output, self._func)
+    def runnable(self):
+        return self._executor.runnable()
+
+    def execute(self, quartic, namespace, store=None, incremental=False):
+        return self._executor.execute(ExecutionContext(quartic, namespace, store, incremental),
+                                      self._inputs, self._output, self._func)
 
     def __repr__(self):
         return pprint.pformat(self.to_dict())
 
     def to_dict(self):
+        lexical_info = self.lexical_info()
         out = {
             "id": self.get_id(),
             "info": {
                 "name": self.name,
                 "description": self.description,
-                "file": self._lexical_info.file,
-                "line_range": self._lexical_info.line_range
+                "file": lexical_info.file,
+                "line_range": lexical_info.line_range
             },
             "inputs": list([i.to_json() for i in self.inputs()]),
             "output": self._output.to_json()
         }
         out.update(self._executor.to_dict())
         return out
+
+# Defined dynamically, so pylint can't see them
+_CO_VARARGS = inspect.CO_VARARGS     # pylint: disable=no-member
+_CO_VARKEYWORDS = inspect.CO_VARKEYWORDS     # pylint: disable=no-member
+
+def _annotations(func):
+    """Annotation of each parameter (in order) and of the return value, like inspect.signature(func) would give but
+    reading them straight off plain functions, which is much cheaper."""
+    code = getattr(func, "__code__", None)
+    if code is None or hasattr(func, "__wrapped__"):
+        sig = inspect.signature(func)
+        return [(p, sig.parameters[p].annotation) for p in sig.parameters], sig.return_annotation
+
+    # co_varnames starts with the positional parameters, then keyword-only ones, then *args and **kwargs
+    positional = code.co_varnames[:code.co_argcount]
+    keyword_only = code.co_varnames[code.co_argcount:code.co_argcount + code.co_kwonlyargcount]
+    rest = code.co_argcount + code.co_kwonlyargcount
+    varargs = code.co_varnames[rest:rest + 1] if code.co_flags & _CO_VARARGS else ()
+    rest += len(varargs)
+    varkw = code.co_varnames[rest:rest + 1] if code.co_flags & _CO_VARKEYWORDS else ()
+
+    annotations = func.__annotations__
+    params = positional + varargs + keyword_only + varkw
+    return ([(p, annotations.get(p, inspect.Signature.empty)) for p in params],
+            annotations.get("return", inspect.Signature.empty))
@@ -10,6 +10,9 @@ class RawExecutor(Executor):
     def execute(self, context, inputs, output, func):
         raise NotImplementedError()  # Handled by platform instead, so should never be called
 
+    def runnable(self):
+        return False
+
     def to_dict(self):
         return {
             "type": "raw",
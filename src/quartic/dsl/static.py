@@ -0,0 +1,255 @@
+# Extracting pipeline nodes from source without executing it, so that tools which only need the shape of the
+# pipeline (e.g. qli validate) don't have to import user code and everything it depends on.
+#
+# A module can be extracted statically if its only use of step / raw is to decorate top-level functions whose
+# annotations are string (or dict of string) literals, and (for raw) whose body just returns a FromBucket of literals.
+# Anything else -- importing other pipeline modules, computed annotations, calling step directly, etc. -- makes the
+# module dynamic, and it's imported as usual instead.
+import ast
+import inspect
+import os
+import sys
+import tokenize
+from quartic.common import utils
+from quartic.common.exceptions import QuarticException
+from quartic.common.dataset import Dataset
+from .context import DslContext
+from .node import LexicalInfo, Node
+from .raw import FromBucket, RawExecutor
+from .step import StepExecutor
+
+# Where the decorators (and FromBucket) can be imported from
+_DSL_MODULES = {
+    "step": {"quartic", "quartic.dsl.step"},
+    "raw": {"quartic.incubating", "quartic.dsl.raw"},
+    "FromBucket": {"quartic.incubating", "quartic.dsl.raw"},
+}
+
+
+class StaticNode(Node):
+    """A Node extracted from source, so has no function to execute."""
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = ()
+
+    # pylint: disable=super-init-not-called,too-many-arguments
+    def __init__(self, name, description, executor, lexical_info, inputs, output):
+        self.name = name
+        self.description = description
+        self._func = None
+        self._executor = executor
+        self._lexical_info = lexical_info
+        self._inputs = inputs
+        self._output = output
+        self._id = None
+
+    def execute(self, quartic, namespace, store=None, incremental=False):
+        raise QuarticException("Can't execute statically extracted step {}".format(self.name))
+
+
+class _Dynamic(Exception):
+    pass
+
+
+def extract_nodes(path, package_name=None):
+    """Nodes declared by the module at path, in the order they'd be registered by importing it, or None if it has
+    to be imported to find out."""
+    try:
+        with tokenize.open(path) as f:
+            source = f.read()
+        tree = ast.parse(source, path)
+        return _Extractor(path, package_name, source.splitlines(True)).extract(tree)
+    except (SyntaxError, ValueError, _Dynamic):     # Importing will report any errors properly
+        return None
+
+
+def get_pipeline(dirs):
+    """The same nodes as utils.get_pipeline_from_args(dirs, isolated=True), but only importing modules that can't be
+    extracted statically."""
+    per_package = []
+    for package_dir in dirs:
+        package_name = os.path.basename(package_dir)
+        init_py = os.path.join(package_dir, "__init__.py")
+        if not os.path.exists(init_py):
+            raise QuarticException("Package {} is missing __init__.py".format(package_dir))
+        modules = [(None, init_py)] + [(name, path) for name, path in _submodules(package_dir)]
+        per_package.append((package_dir, [(name, extract_nodes(path, package_name)) for name, path in modules]))
+
+    dynamic = {name for _, modules in per_package for name, nodes in modules if nodes is None}
+    imported = {}
+    if dynamic:
+        imported = _import_dynamic([d for d, modules in per_package if any(n is None for _, n in modules)], dynamic)
+    nodes = []
+    for package_dir, modules in per_package:
+        for name, module_nodes in modules:
+            nodes += imported[(package_dir, name)] if module_nodes is None else module_nodes
+    return nodes
+
+
+def _submodules(package_dir):
+    # Mirrors the modules utils.load_package finds, without importing the package
+    import pkgutil
+    for info in pkgutil.iter_modules([package_dir]):
+        name = info[1]
+        path = os.path.join(package_dir, name, "__init__.py") if info[2] else os.path.join(package_dir, name + ".py")
+        yield name, path
+
+
+def _import_dynamic(package_dirs, module_names):
+    # Nodes registered by importing each of the named modules (None for the root package), by package
+    imported = {}
+    with utils.isolated_modules(package_dirs), DslContext() as context:
+        for package_dir in package_dirs:
+            root = utils.load_package_root(package_dir)
+            imported[(package_dir, None)] = context.take()
+            for mspec in utils.submodule_specs(root):
+                if mspec.name in module_names:
+                    utils.load_module(mspec)
+                    imported[(package_dir, mspec.name)] = context.take()
+    return imported
+
+
+class _Extractor:
+    def __init__(self, path, package_name, lines):
+        self._path = path
+        self._package_name = package_name
+        self._lines = lines
+        self._names = {}        # Local name -> DSL name (step, raw or FromBucket)
+        self._modules = set()   # Local names of the quartic package
+
+    def extract(self, tree):
+        # Wherever they are, as e.g. imports under an if still run on import
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom):
+                self._import_from(node)
+            elif isinstance(node, ast.Import):
+                self._import(node)
+
+        nodes = []
+        decorators = set()
+        for stmt in tree.body:
+            if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                kinds = [self._dsl_name(d) for d in stmt.decorator_list]
+                if any(kinds):
+                    if len(stmt.decorator_list) != 1:
+                        raise _Dynamic()
+                    nodes.append(self._node(stmt, kinds[0]))
+                    decorators.add(id(stmt.decorator_list[0]))
+        self._check_no_other_uses(tree, decorators)
+        return nodes
+
+    def _import_from(self, stmt):
+        if stmt.level or (self._package_name and stmt.module.split(".")[0] == self._package_name):
+            raise _Dynamic()    # May register nodes of other pipeline modules
+        if stmt.module == "__future__" and any(alias.name == "annotations" for alias in stmt.names):
+            raise _Dynamic()    # Annotations would be the source text rather than the values
+        for alias in stmt.names:
+            if alias.name == "*" and stmt.module.split(".")[0] == "quartic":
+                raise _Dynamic()
+            if stmt.module in _DSL_MODULES.get(alias.name, ()):
+                self._bind(alias.asname or alias.name, alias.name)
+            else:
+                self._bind(alias.asname or alias.name, None)
+
+    def _import(self, stmt):
+        for alias in stmt.names:
+            if self._package_name and alias.name.split(".")[0] == self._package_name:
+                raise _Dynamic()
+            if alias.name == "quartic" or (alias.name.startswith("quartic.") and not alias.asname):
+                self._modules.add("quartic")
+            else:
+                self._bind(alias.asname or alias.name.split(".")[0], None)
+
+    def _bind(self, name, dsl_name):
+        # Bound to more than one thing, so which one a use refers to depends on the order things run in
+        if self._names.get(name, dsl_name) != dsl_name:
+            raise _Dynamic()
+        self._names[name] = dsl_name
+
+    def _dsl_name(self, expr):
+        if isinstance(expr, ast.Name):
+            return self._names.get(expr.id)
+        if (isinstance(expr, ast.Attribute) and isinstance(expr.value, ast.Name) and
+                expr.value.id in self._modules and expr.attr == "step"):
+            return "step"
+        return None
+
+    def _check_no_other_uses(self, tree, allowed):
+        # e.g. step(f) rather than @step, decorating nested functions, or rebinding the names
+        for node in ast.walk(tree):
+            if id(node) in allowed:
+                continue
+            if isinstance(node, ast.Name) and self._names.get(node.id) in ("step", "raw"):
+                raise _Dynamic()
+            if (isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)) and
+                    self._names.get(node.name)):
+                raise _Dynamic()
+            if isinstance(node, ast.Name) and node.id in self._modules and not isinstance(node.ctx, ast.Load):
+                raise _Dynamic()
+            if isinstance(node, ast.Attribute) and self._dsl_name(node) and id(node) not in allowed:
+                raise _Dynamic()
+
+    def _node(self, func, kind):
+        # The block that inspect.getsourcelines would find, which starts at the decorator
+        start = func.decorator_list[0].lineno
+        end = start + len(inspect.getblock(self._lines[start - 1:])) - 1
+        lexical_info = LexicalInfo(os.path.relpath(self._path), (start, end))
+
+        inputs = {}
+        args = func.args
+        posonlyargs = getattr(args, "posonlyargs", [])     # From 3.8
+        for arg in posonlyargs + args.args + ([args.vararg] if args.vararg else []) + args.kwonlyargs + \
+                ([args.kwarg] if args.kwarg else []):
+            inputs[arg.arg] = _input_datasets(arg.annotation)
+        if func.returns is None:
+            raise _Dynamic()
+        output = Dataset(_string(func.returns))
+
+        if kind == "step":
+            executor = StepExecutor()
+        elif kind == "raw" and not inputs:
+            executor = RawExecutor(self._raw_spec(func))
+        else:
+            raise _Dynamic()
+        return StaticNode(func.name, _docstring(func), executor, lexical_info, inputs, output)
+
+    def _raw_spec(self, func):
+        body = func.body[1:] if ast.get_docstring(func, clean=False) is not None else func.body
+        if len(body) != 1 or not isinstance(body[0], ast.Return) or not isinstance(body[0].value, ast.Call):
+            raise _Dynamic()
+        call = body[0].value
+        if not (isinstance(call.func, ast.Name) and self._names.get(call.func.id) == "FromBucket"):
+            raise _Dynamic()
+        return FromBucket(*[_literal(a) for a in call.args], **{k.arg: _literal(k.value) for k in call.keywords})
+
+
+def _input_datasets(annotation):
+    if annotation is None:
+        raise _Dynamic()    # Unannotated, which importing reports
+    value = _literal(annotation)
+    if isinstance(value, dict) and all(isinstance(v, str) for v in value.values()):
+        return {k: Dataset(v) for k, v in value.items()}
+    return Dataset(_string(annotation))
+
+
+def _string(expr):
+    value = _literal(expr)
+    if not isinstance(value, str):
+        raise _Dynamic()
+    return value
+
+
+def _literal(expr):
+    if isinstance(expr, ast.Starred) or expr is None:
+        raise _Dynamic()
+    try:
+        return ast.literal_eval(expr)
+    except ValueError:
+        raise _Dynamic()
+
+
+def _docstring(func):
+    doc = ast.get_docstring(func, clean=False)
+    # The compiler strips docstring indentation itself from 3.13
+    if doc is not None and sys.version_info >= (3, 13):
+        doc = inspect.cleandoc(doc)
+    return doc
@@ -1,9 +1,32 @@
+import hashlib
+import inspect
+import json
 from .context import DslContext
 from .node import Node, Executor
+from ..common.log import logger
+log = logger(__name__)
+
+# Catalogue extension recording the fingerprint of the code and inputs that produced a step's output
+FINGERPRINT_EXTENSION = "fingerprint"
 
 def step(f):
     return DslContext.register(Node(f, StepExecutor()))
 
+def fingerprint(func, inputs):
+    """Hash of a step function's source and the current version of each of its (resolved) inputs.
+
+    Only the source of the function itself is hashed (as given by inspect.getsource), so changes to helpers or
+    constants that it uses aren't detected.  None if any input has no known version (e.g. it doesn't exist yet)."""
+    versions = {}
+    for k, v in inputs.items():
+        versions[k] = {k2: v2.version() for k2, v2 in v.items()} if isinstance(v, dict) else v.version()
+        known = versions[k].values() if isinstance(v, dict) else [versions[k]]
+        if None in known:
+            return None
+    h = hashlib.sha256(inspect.getsource(func).encode("utf-8"))
+    h.update(json.dumps(versions, sort_keys=True).encode("utf-8"))
+    return "sha256:" + h.hexdigest()
+
 class StepExecutor(Executor):
     def execute(self, context, inputs, output, func):
         kwargs = {}
@@ -13,8 +36,15 @@ class StepExecutor(Executor):
             else:
                 kwargs[k] = context.resolve(v)
 
-        output_writer = func(**kwargs)
-        output_writer.apply(context.resolve(output))
+        output_dataset = context.resolve_output(output)
+        current = fingerprint(func, kwargs) if context.incremental else None
+        if (current is not None and output_dataset.version() is not None and
+                output_dataset.extensions().get(FINGERPRINT_EXTENSION) == current):
+            log.info("%s is up to date, skipping", output_dataset)
+            return False
+        # Without a fresh fingerprint, any previous one is removed, as it doesn't describe what's written now
+        func(**kwargs).apply(output_dataset, {FINGERPRINT_EXTENSION: current})
+        return True
 
     def to_dict(self):
         return {"type": "step"}
@@ -1,25 +1,16 @@
 import sys
-import json
 from quartic.common.exceptions import (
     ArgumentParserException,
+    BatchExecutionException,
     MultipleMatchingStepsException,
     NoMatchingStepsException,
+    QuarticException,
+    StepIdCollisionException,
     UserCodeExecutionException,
 )
-from .cli import main, parse_args
+from .cli import main, parse_args, write_exception
 
 
-def write_exception(fname, etype, exception):
-    output = {"type": etype}
-    for k, v in exception.__dict__.items():
-        if not k.startswith("_"):
-            try:
-                json.dumps(v)
-                output[k] = v
-            except TypeError:
-                output[k] = str(v)
-    json.dump(output, open(fname, "w"), indent=1)
-
 if __name__ == "__main__":
     try:
         args = parse_args(sys.argv[1:])
@@ -30,6 +21,10 @@ if __name__ == "__main__":
     except UserCodeExecutionException as e:
         write_exception(args.exception, type(e).__name__, e)
         raise e.exception()
-    except (MultipleMatchingStepsException, NoMatchingStepsException) as e:
+    except (MultipleMatchingStepsException, NoMatchingStepsException, StepIdCollisionException,
+            QuarticException) as e:
         write_exception(args.exception, type(e).__name__, e)
         sys.exit(2)
+    except BatchExecutionException as e:
+        write_exception(args.exception, type(e).__name__, e)
+        sys.exit(1)
@@ -1,14 +1,25 @@
 import argparse
+import os
 import sys
 import json
+from collections import OrderedDict
 from quartic.common.quartic import Quartic
+from quartic.common.metrics import Metrics
 from quartic.common.exceptions import (
     ArgumentParserException,
+    BatchExecutionException,
     MultipleMatchingStepsException,
     NoMatchingStepsException,
+    StepIdCollisionException,
     UserCodeExecutionException,
+    exception_details,
 )
 from quartic.common import utils
+from quartic.pipeline.runner import manifest
+from quartic.pipeline.runner.evaluate_cache import EvaluateCache
+from quartic.pipeline.runner.loader import evaluate_in_processes
+from quartic.common.log import logger
+log = logger(__name__)
 
 class ThrowingArgumentParser(argparse.ArgumentParser):
     def error(self, message):
@@ -16,26 +27,52 @@ class ThrowingArgumentParser(argparse.ArgumentParser):
 
 def parse_args(argv):
     parser = ThrowingArgumentParser(description="Evaluate Quartic Python pipelines")
-    parser.add_argument("--execute", metavar="STEP_ID", type=str,
-                        help="step id to execute")
+    parser.add_argument("--execute", metavar="STEP_IDS", type=str,
+                        help="step id to execute, or a comma-separated list of them")
+    parser.add_argument("--execute-file", metavar="STEP_IDS_FILE", type=str,
+                        help="path of file listing step ids to execute, one per line")
     parser.add_argument("--evaluate", metavar="OUPUT_FILE", type=str,
                         help="path of file in which to output steps json")
+    parser.add_argument("--evaluate-cache", metavar="CACHE_DIR", type=str,
+                        help="directory in which to cache --evaluate results per module, so that only changed modules "
+                        "are executed")
+    parser.add_argument("--load-workers", metavar="N", type=int,
+                        help="with --evaluate, load independent pipeline modules in up to N worker processes")
+    parser.add_argument("--base", metavar="BASE_FILE", type=str,
+                        help="steps json from a previous --evaluate, so that --evaluate only outputs what has changed "
+                        "since")
+    parser.add_argument("--compact", action="store_true",
+                        help="output --evaluate steps json without indentation, writing each step as it's produced")
+    parser.add_argument("--manifest", metavar="STEPS_FILE", type=str,
+                        help="steps json from a previous --evaluate, used by --execute to load only the modules "
+                        "defining the requested steps")
     parser.add_argument("--exception", metavar="EXCEPTION_FILE", default="exception.json",
                         type=str, help="path of file in which to output error information")
     parser.add_argument("--namespace", metavar="NAMESPACE", type=str,
                         help="path of file in which to output error information")
     parser.add_argument("--api-token", metavar="API_TOKEN", type=str,
                         help="Quartic API token")
+    parser.add_argument("--metrics", metavar="METRICS_FILE", type=str,
+                        help="path of file in which to output service request metrics "
+                        "(JSON with trace spans if it ends in .json, otherwise Prometheus text format)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="skip the step if its code and inputs haven't changed since its output was last written "
+                        "(only the step function's own source is compared, not helpers or constants it uses)")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also load modules in packages nested within the pipeline packages")
     parser.add_argument("pipelines", metavar="PIPELINES", type=str, nargs="+",
                         help="one or more paths to python packages containing pipeline code")
 
     args = parser.parse_args(argv)
+    execute = args.execute or args.execute_file
     # TODO - could we do this via subparsers?
-    if not (args.execute or args.evaluate) or (args.execute and args.evaluate):
+    if not (execute or args.evaluate) or (execute and args.evaluate):
         raise ArgumentParserException(parser, "Must specify either --execute or --evaluate")
-    if args.execute and not args.namespace:
+    if (args.base or args.compact) and not args.evaluate:
+        raise ArgumentParserException(parser, "Can only specify --base or --compact with --evaluate")
+    if execute and not args.namespace:
         raise ArgumentParserException(parser, "Must specify --namespace with --execute")
-    if args.execute and not args.api_token:
+    if execute and not args.api_token:
         raise ArgumentParserException(parser, "Must specify --api-token with --execute")
 
     return args
@@ -47,20 +84,170 @@ def run_user_code(f):
         _, _, tb = sys.exc_info()
         raise UserCodeExecutionException(e, tb)
 
-def main(args):
+def write_exception(fname, etype, exception):
+    output = {"type": etype, "message": str(exception)}
+    output.update(exception_details(exception))
+    json.dump(output, open(fname, "w"), indent=1)
+
+def write_metrics(metrics, path):
+    if path.endswith(".json"):
+        metrics.write_json(path)
+    else:
+        metrics.write_prometheus(path)
+
+def requested_step_ids(args):
+    step_ids = []
     if args.execute:
-        steps = run_user_code(lambda: utils.get_pipeline_from_args(args.pipelines))
-        execute_steps = [step for step in steps if step.get_id() == args.execute]
-        quartic = Quartic(api_token=args.api_token, url_format="http://{service}.platform:{port}/api/")
-        if len(execute_steps) > 1:
-            raise MultipleMatchingStepsException(args.execute, [step.to_dict() for step in execute_steps])
-        elif not execute_steps:
-            raise NoMatchingStepsException(args.execute, [(step.get_id(), list(step.outputs())) for step in steps])
+        step_ids += [step_id.strip() for step_id in args.execute.split(",") if step_id.strip()]
+    if args.execute_file:
+        with open(args.execute_file) as f:
+            step_ids += [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    return list(OrderedDict.fromkeys(step_ids))   # Drop duplicates
+
+def index_steps(steps):
+    """Map each step id to the steps with that id (of which there should only be one)."""
+    index = OrderedDict()
+    for step in steps:
+        index.setdefault(step.get_id(), []).append(step)
+    return index
+
+def find_step(index, step_id):
+    matching_steps = index.get(step_id, [])
+    if len(matching_steps) > 1:
+        raise MultipleMatchingStepsException(step_id, [step.to_dict() for step in matching_steps])
+    elif not matching_steps:
+        raise NoMatchingStepsException(step_id, [(step.get_id(), list(step.outputs()))
+                                                 for steps in index.values() for step in steps])
+    return matching_steps[0]
+
+def raise_if_colliding(index):
+    """Steps sharing an id can't be told apart by --execute, so are reported when evaluating.
+
+    index maps ids to steps or to their dicts (as loaded in other processes, or from the cache)."""
+    for step_id, matching_steps in index.items():
+        if len(matching_steps) > 1:
+            raise StepIdCollisionException(
+                step_id, [step if isinstance(step, dict) else step.to_dict() for step in matching_steps])
+
+def execute_step(step, quartic, args, metrics):
+    if metrics:
+        with metrics.span("step", step_id=step.get_id(), step_name=step.get_name()):
+            run_user_code(lambda: step.execute(quartic, args.namespace, incremental=args.incremental))
+    else:
+        run_user_code(lambda: step.execute(quartic, args.namespace, incremental=args.incremental))
+
+def execute_batch(steps, quartic, args, metrics):
+    """Execute steps in dependency order, carrying on past failures (but skipping anything downstream of them).
+
+    Steps which aren't runnable (i.e. raw ones, which the platform ingests) are reported as failures."""
+    from quartic.pipeline.runner import scheduler
+    by_id = {step.get_id(): step for step in steps}
+    dependencies = scheduler.step_dependencies(steps, args.namespace)
+    failures = [{"step_id": step.get_id(), "step_name": step.get_name(), "status": "not_runnable"}
+                for step in steps if not step.runnable()]
+    failed = set()
+    for step_id in scheduler.execution_order(dependencies):
+        step = by_id[step_id]
+        upstream_failures = dependencies[step_id] & failed
+        if upstream_failures:
+            failed.add(step_id)
+            failures.append({"step_id": step_id, "step_name": step.get_name(), "status": "skipped",
+                             "failed_dependencies": sorted(upstream_failures)})
+            continue
+        try:
+            execute_step(step, quartic, args, metrics)
+        except UserCodeExecutionException as e:
+            failed.add(step_id)
+            failures.append({"step_id": step_id, "step_name": step.get_name(), "status": "failed",
+                             "type": type(e).__name__, "exception": exception_details(e)})
+    if failures:
+        raise BatchExecutionException(failures)
+
+def load_steps_from_manifest(manifest_path, pipelines, step_ids):
+    """Load just the modules which (according to the manifest) define the given steps, returning their steps.
+
+    Returns None if the manifest can't be read or turns out to be stale, i.e. the steps aren't where it said."""
+    try:
+        files = {node["id"]: node["info"]["file"] for node in manifest.load_nodes(manifest_path)}
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.info("Can't read manifest %s (%s), loading all modules", manifest_path, e)
+        return None
+    if not all(step_id in files for step_id in step_ids):
+        log.info("Steps missing from manifest %s, loading all modules", manifest_path)
+        return None
+
+    module_names = {_module_name(files[step_id], pipelines) for step_id in step_ids}
+    if None in module_names:
+        log.info("Steps outside top-level pipeline modules in manifest %s, loading all modules", manifest_path)
+        return None
+    steps = run_user_code(lambda: utils.get_pipeline_from_args(pipelines, module_names))
+    loaded_ids = {step.get_id() for step in steps}
+    if not all(step_id in loaded_ids for step_id in step_ids):
+        log.info("Manifest %s is stale, loading all modules", manifest_path)
+        return None
+    return steps
+
+def _module_name(path, pipelines):
+    # Name of the depth-1 module (as loaded by utils.load_package) at path, relative to the working directory
+    for package_dir in pipelines:
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(package_dir))
+        if os.sep not in relative and not relative.startswith("..") and relative.endswith(".py"):
+            return relative[:-len(".py")]
+    return None
+
+def write_evaluation(nodes, args):
+    with open(args.evaluate, "w") as f:
+        if args.base:
+            json.dump(manifest.delta(manifest.load_nodes(args.base), nodes, manifest.file_hash(args.base)), f)
         else:
-            run_user_code(lambda: execute_steps[0].execute(quartic, args.namespace))
+            manifest.write_nodes(nodes, f, indent=None if args.compact else 1)
+
+def _index_nodes(nodes):
+    index = OrderedDict()
+    for node in nodes:
+        index.setdefault(node["id"], []).append(node)
+    return index
+
+def evaluate_nodes(nodes, args):
+    raise_if_colliding(_index_nodes(nodes))
+    write_evaluation(nodes, args)
+
+def main(args, steps=None, index=None):
+    """Run the command described by args, using the pipeline steps given (if already loaded, along with their index
+    if built) or loading them."""
+    execute = args.execute or args.execute_file
+    step_ids = requested_step_ids(args) if execute else None
+    if steps is None and execute and args.manifest:
+        steps = load_steps_from_manifest(args.manifest, args.pipelines, step_ids)
+    if steps is None and args.evaluate and args.load_workers:
+        evaluate_nodes(run_user_code(lambda: evaluate_in_processes(
+            args.pipelines, args.load_workers, args.recursive)), args)
+        return
+    if steps is None and args.evaluate and args.evaluate_cache:
+        cache = EvaluateCache(args.evaluate_cache)
+        evaluate_nodes(run_user_code(lambda: cache.evaluate(args.pipelines, args.recursive)), args)
+        return
+    if steps is None:
+        steps = run_user_code(lambda: utils.get_pipeline_from_args(args.pipelines, recursive=args.recursive))
+    if index is None:
+        index = index_steps(steps)
+
+    if execute:
+        execute_steps = [find_step(index, step_id) for step_id in step_ids]
+        metrics = Metrics() if args.metrics else None
+        quartic = Quartic(api_token=args.api_token, url_format="http://{service}.platform:{port}/api/",
+                          metrics=metrics)
+        try:
+            if len(execute_steps) == 1:
+                execute_step(execute_steps[0], quartic, args, metrics)
+            else:
+                # A single client, so connections and caches are shared between the steps
+                execute_batch(execute_steps, quartic, args, metrics)
+        finally:
+            if metrics:
+                write_metrics(metrics, args.metrics)
 
     elif args.evaluate:
-        nodes = run_user_code(lambda: utils.get_pipeline_from_args(args.pipelines))
-        output = {"nodes": [node.to_dict() for node in nodes]}
-        json.dump(output, open(args.evaluate, "w"), indent=1)
+        raise_if_colliding(index)
+        write_evaluation((node.to_dict() for node in steps), args)
         
\ No newline at end of file
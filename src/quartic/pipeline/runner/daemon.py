@@ -0,0 +1,168 @@
+# Long-lived runner which loads the pipelines (and heavy libraries) once, and then serves requests to run them.
+#
+# Each request is a line of JSON holding the arguments that would otherwise be passed to the runner on the command
+# line (minus the pipeline paths), e.g.
+#
+#   {"id": "abc", "argv": ["--execute", "123456", "--namespace", "foo", "--api-token", "xyz"]}
+#
+# and is answered with a line of JSON giving the exit code the runner would have exited with:
+#
+#   {"id": "abc", "exit_code": 0}
+#
+# Requests are read from stdin, or from connections to a Unix socket if --socket is given.  Each one is handled in
+# a forked child, so starts from the warm state of the daemon without being able to affect it.
+#
+# Requests are trusted: anyone able to send one runs the loaded pipeline steps as the daemon's user, and has files
+# (e.g. --evaluate and --exception output) written wherever that user can.  So the socket is created accessible to
+# that user only (mode 0600), and shouldn't be opened up to anyone not trusted to act as them.
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import traceback
+from quartic.common import utils
+from quartic.common.exceptions import (
+    ArgumentParserException,
+    BatchExecutionException,
+    MultipleMatchingStepsException,
+    NoMatchingStepsException,
+    QuarticException,
+    StepIdCollisionException,
+    UserCodeExecutionException,
+)
+from quartic.common.log import logger
+from .cli import index_steps, main, parse_args, run_user_code, write_exception
+log = logger(__name__)
+
+# Imported up front so that children needn't
+PRELOADED_LIBRARIES = ["pandas", "pyarrow", "pyarrow.parquet", "requests"]
+
+
+class Daemon:
+    def __init__(self, pipelines, recursive=False):
+        self._pipelines = list(pipelines)
+        for name in PRELOADED_LIBRARIES:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+        self._steps = run_user_code(lambda: utils.get_pipeline_from_args(self._pipelines, recursive=recursive))
+        self._index = index_steps(self._steps)
+        log.info("Loaded %d steps from %s", len(self._steps), ", ".join(self._pipelines))
+
+    def handle(self, req):
+        """Run the request in a forked child, returning the response once it exits."""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.dup2(sys.stderr.fileno(), sys.stdout.fileno())   # Keep stdout for responses
+                exit_code = self._run(req["argv"])
+            finally:
+                os._exit(exit_code)     # pylint: disable=protected-access
+        _, status = os.waitpid(pid, 0)
+        exit_code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        return {"id": req.get("id"), "exit_code": exit_code}
+
+    def serve(self, infile, outfile):
+        for line in infile:
+            if line.strip():
+                outfile.write(json.dumps(self.respond(line)) + "\n")
+                outfile.flush()
+
+    def serve_socket(self, path):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if line.strip():
+                        self.wfile.write((json.dumps(daemon.respond(line)) + "\n").encode("utf-8"))
+
+        if os.path.exists(path):
+            os.remove(path)
+        # Created accessible to our own user only, with no window in which others could connect
+        old_umask = os.umask(0o177)
+        try:
+            server = _ForkingUnixServer(path, Handler)
+        finally:
+            os.umask(old_umask)
+        with server:
+            log.info("Listening on %s", path)
+            server.serve_forever()
+
+    def respond(self, line):
+        try:
+            req = json.loads(line)
+        except ValueError as e:
+            return {"id": None, "error": "Malformed request: {}".format(e)}
+        if not isinstance(req, dict):
+            return {"id": None, "error": "Malformed request: expected an object"}
+        argv = req.get("argv")
+        if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+            return {"id": req.get("id"), "error": "Malformed request: argv must be a list of strings"}
+        return self.handle(req)
+
+    def _run(self, argv):
+        # Mirrors __main__, but reporting the outcome as an exit code
+        args = None
+        try:
+            args = parse_args(list(argv) + self._pipelines)
+            main(args, self._steps, self._index)
+            return 0
+        except ArgumentParserException as e:
+            e.parser.print_usage()
+            return 1
+        except UserCodeExecutionException as e:
+            write_exception(args.exception, type(e).__name__, e)
+            sys.stderr.write(e.formatted_exception)
+            return 1
+        except (MultipleMatchingStepsException, NoMatchingStepsException, StepIdCollisionException,
+                QuarticException) as e:
+            write_exception(args.exception, type(e).__name__, e)
+            return 2
+        except BatchExecutionException as e:
+            write_exception(args.exception, type(e).__name__, e)
+            return 1
+        except Exception:   # pylint: disable=broad-except
+            traceback.print_exc()
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+
+class _ForkingUnixServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+def request(path, argv, request_id=None):
+    """Send a request to a daemon listening on the Unix socket at path, returning its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall((json.dumps({"id": request_id, "argv": list(argv)}) + "\n").encode("utf-8"))
+        with s.makefile("r") as f:
+            return json.loads(f.readline())
+
+
+def parse_daemon_args(argv):
+    parser = argparse.ArgumentParser(description="Serve requests to run Quartic Python pipelines")
+    parser.add_argument("--socket", metavar="SOCKET_PATH", type=str,
+                        help="path of Unix socket on which to listen (otherwise requests are read from stdin)")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also load modules in packages nested within the pipeline packages")
+    parser.add_argument("pipelines", metavar="PIPELINES", type=str, nargs="+",
+                        help="one or more paths to python packages containing pipeline code")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    daemon_args = parse_daemon_args(sys.argv[1:])
+    if daemon_args.socket:
+        Daemon(daemon_args.pipelines, daemon_args.recursive).serve_socket(daemon_args.socket)
+    else:
+        Daemon(daemon_args.pipelines, daemon_args.recursive).serve(sys.stdin, sys.stdout)
@@ -0,0 +1,167 @@
+# Cache of --evaluate output, so that only the pipeline modules which have changed since the last evaluation are
+# executed again.
+#
+# Each top-level pipeline module gets an entry holding the nodes registered while loading it, along with:
+#
+#   - deps:     hashes of the module's source and of every local file it imports (found statically with ast, plus
+#               whatever it was seen to import at runtime)
+#   - imported: which of those local modules had already been imported (by earlier modules) when it was loaded, as
+#               Python doesn't execute them again, so any nodes they declare aren't registered a second time
+#   - added:    the local modules that loading it imported, for the same reason
+#
+# An entry is only used if all of these still hold, so merging cached and freshly evaluated modules gives the same
+# output as evaluating everything from scratch.  Before a module is executed, the local modules that a cold
+# evaluation would have imported by that point are imported (discarding anything they register), so that it sees the
+# same state too.
+import hashlib
+import importlib
+import json
+import os
+import sys
+from quartic import __version__
+from quartic.common import utils
+from quartic.common.log import logger
+from quartic.dsl.context import DslContext
+log = logger(__name__)
+
+# Bump if the format of entries (or of the nodes in them) changes.  Entries are also keyed by the quartic version, so
+# releases never serve nodes from an older Node.to_dict, but this still needs bumping for changes between releases.
+CACHE_FORMAT = 2
+
+
+class EvaluateCache:
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        self._hashes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def evaluate(self, package_dirs, recursive=False):
+        """The same as [node.to_dict() for node in utils.get_pipeline_from_args(package_dirs, isolated=True,
+        recursive=recursive)], but only executing modules which have changed.
+
+        Nested modules (see utils.load_package) aren't cached, so are executed every time unless a top-level module
+        has already imported them."""
+        roots = {os.path.basename(d): os.path.abspath(d) for d in package_dirs}
+        nodes = []
+        imported = {}   # Local modules that a cold evaluation would have imported by now, by name
+        top_level = {}
+        with utils.isolated_modules(package_dirs), DslContext() as context:
+            for package_dir in package_dirs:
+                # Root packages are always executed, as everything else imports them
+                package = utils.load_package_root(package_dir)
+                nodes += [node.to_dict() for node in context.take()]
+                specs = utils.submodule_specs(package)
+                top_level.update((spec.name, spec) for spec in specs)
+                imported.update(_local_modules(roots, top_level))
+
+                for spec in specs:
+                    nodes += self._module_nodes(spec, roots, top_level, imported, context)
+                if recursive:
+                    nodes += _nested_nodes(package_dir, roots, top_level, imported, context)
+
+        log.info("Evaluated %d modules (%d from cache)", self.hits + self.misses, self.hits)
+        return nodes
+
+    def _module_nodes(self, spec, roots, top_level, imported, context):
+        # pylint: disable=too-many-arguments
+        path = os.path.abspath(spec.origin)
+        key = self._key(spec.name, path)
+        entry = self._read(key)
+        if entry is not None and self._valid(entry, imported):
+            self.hits += 1
+        else:
+            self.misses += 1
+            entry = self._load(spec, path, roots, top_level, imported, context)
+            self._write(key, entry)
+        imported.update(entry["added"])
+        return entry["nodes"]
+
+    def _load(self, spec, path, roots, top_level, imported, context):
+        # pylint: disable=too-many-arguments
+        _preload(imported, top_level)
+        context.take()      # Discarding anything preloading registered
+        before = set(sys.modules)
+        utils.load_module(spec)
+        nodes = [node.to_dict() for node in context.take()]
+
+        added = {name: f for name, f in _local_modules(roots, top_level).items() if name not in before}
+        deps = {path} | utils.import_closure(path, roots) | set(added.values())
+        return {
+            "deps": {f: self._hash(f) for f in sorted(deps)},
+            "imported": sorted(name for name, f in imported.items() if f in deps),
+            "added": added,
+            "nodes": nodes
+        }
+
+    def _valid(self, entry, imported):
+        return (all(self._hash(f) == h for f, h in entry["deps"].items()) and
+                sorted(name for name, f in imported.items() if f in entry["deps"]) == entry["imported"])
+
+    def _key(self, name, path):
+        key = {
+            "format": CACHE_FORMAT,
+            "quartic": __version__,
+            "python": sys.version,
+            "cwd": os.getcwd(),     # Nodes record their file relative to it
+            "name": name,
+            "path": path,
+            "source": self._hash(path)
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _hash(self, path):
+        if path not in self._hashes:
+            try:
+                with open(path, "rb") as f:
+                    self._hashes[path] = hashlib.sha256(f.read()).hexdigest()
+            except OSError:
+                self._hashes[path] = None
+        return self._hashes[path]
+
+    def _read(self, key):
+        try:
+            with open(os.path.join(self._cache_dir, key + ".json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, entry):
+        os.makedirs(self._cache_dir, exist_ok=True)
+        path = os.path.join(self._cache_dir, key + ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(path + ".tmp", path)    # So concurrent evaluations never see a partial entry
+
+
+def _local_modules(roots, top_level):
+    # Top-level modules are excluded, as they're loaded afresh regardless of what has been imported
+    dirs = tuple(d + os.sep for d in roots.values())
+    return {
+        name: os.path.abspath(m.__file__) for name, m in list(sys.modules.items())
+        if name not in top_level and getattr(m, "__file__", None) and os.path.abspath(m.__file__).startswith(dirs)
+    }
+
+
+def _nested_nodes(package_dir, roots, top_level, imported, context):
+    # pylint: disable=too-many-arguments
+    names = [name for name in utils.nested_module_names(package_dir) if name not in imported]
+    if not names:
+        return []
+    _preload(imported, top_level)
+    context.take()
+    for name in names:
+        if name not in sys.modules:     # Imported by one before it
+            importlib.import_module(name)
+    imported.update(_local_modules(roots, top_level))
+    return [node.to_dict() for node in context.take()]
+
+
+def _preload(imported, top_level):
+    for name in sorted(imported):   # Parents first
+        if name in sys.modules:
+            continue
+        parent = name.split(".")[0]
+        if parent not in sys.modules and parent in top_level:
+            utils.load_module(top_level[parent])
+        importlib.import_module(name)
@@ -0,0 +1,95 @@
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+from quartic.common.exceptions import QuarticException
+
+# Statuses (see scheduler) of steps that needn't be run again when resuming, so long as their output is unchanged
+_COMPLETE_STATUSES = ("succeeded", "up-to-date", "completed-earlier")
+
+# Number of most recent runs whose step timings are used to prioritise steps
+_TIMED_RUNS = 5
+
+
+def new_run_id():
+    return "{}-{}".format(datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8])
+
+
+class RunJournal:
+    """Durable record of a pipeline run's progress, so that it can be resumed after a failure.
+
+    Each step start and finish is appended to a JSONL file and fsynced before the run carries on.  output_version
+    maps a step id to the current version of its output, which is recorded when the step finishes so that a resumed
+    run only skips steps whose output hasn't changed since."""
+    def __init__(self, journal_dir, run_id, output_version, resume=False):
+        self.run_id = run_id
+        self._journal_dir = journal_dir
+        self.path = os.path.join(journal_dir, "{}.jsonl".format(run_id))
+        self._output_version = output_version
+        self._lock = threading.Lock()
+        if resume and not os.path.isfile(self.path):
+            raise QuarticException("No journal for run {} in {}".format(run_id, journal_dir))
+        self._finished = _load_finished(self.path) if resume else {}
+        os.makedirs(journal_dir, exist_ok=True)
+        self._file = open(self.path, "a")
+
+    def completed_steps(self):
+        """Ids of steps which completed in an earlier attempt at this run, and whose outputs are still current."""
+        return {
+            step_id for step_id, record in self._finished.items()
+            if record["status"] in _COMPLETE_STATUSES and
+            record["output_version"] is not None and
+            record["output_version"] == self._output_version(step_id)
+        }
+
+    def durations(self):
+        """Seconds taken by each step the last time it succeeded, in the most recent runs journalled alongside this
+        one (run ids sort by their start time)."""
+        durations = {}
+        paths = sorted(os.path.join(self._journal_dir, name) for name in os.listdir(self._journal_dir)
+                       if name.endswith(".jsonl"))
+        for path in paths[-_TIMED_RUNS:]:
+            for step_id, record in _load_finished(path).items():
+                if record["status"] == "succeeded":
+                    durations[step_id] = record["end"] - record["start"]
+        return durations
+
+    def started(self, result):
+        self._append({"event": "started", "step_id": result.step_id, "name": result.name, "time": time.time()})
+
+    def finished(self, result):
+        complete = result.status in _COMPLETE_STATUSES
+        record = dict(result.to_dict(), event="finished",
+                      output_version=self._output_version(result.step_id) if complete else None)
+        record["step_id"] = record.pop("id")
+        self._append(record)
+
+    def close(self):
+        self._file.close()
+
+    def _append(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+def _load_finished(path):
+    finished = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:   # Torn final line, if we died mid-write
+                continue
+            if record["event"] == "finished":
+                finished[record["step_id"]] = record
+    return finished
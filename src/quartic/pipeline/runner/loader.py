@@ -0,0 +1,102 @@
+# Evaluating pipelines by loading their modules in several worker processes at once.
+#
+# Whichever module imports a piece of local code first is the one that registers any steps it declares, so modules
+# which (transitively) import any of the same local files are loaded together, by one worker, in their usual order.
+# Groups that share nothing are independent, so can be loaded in parallel.  Nodes can't be pickled (their functions
+# belong to modules only the worker has loaded), so workers return them as dicts, and these are merged back into the
+# order that loading everything in one process would give.
+import importlib
+import os
+import pkgutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from quartic.common import utils
+from quartic.dsl.context import DslContext
+
+
+def module_groups(package_dir, recursive=False):
+    """Lists of modules (by name, as utils.load_package loads them) that have to be loaded together, in load
+    order."""
+    roots = {os.path.basename(package_dir): os.path.abspath(package_dir)}
+    modules = _modules(package_dir, recursive)
+    init_py = os.path.join(os.path.abspath(package_dir), "__init__.py")
+    root_files = {init_py} | utils.import_closure(init_py, roots)
+
+    # Union-find over modules, joining any that share a file other than those the root package imports (which
+    # every worker imports anyway)
+    parent = list(range(len(modules)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner = {}
+    for i, (name, path) in enumerate(modules):
+        for f in ({path} | _parent_packages(name, package_dir) | utils.import_closure(path, roots)) - root_files:
+            if f in owner:
+                parent[find(i)] = find(owner[f])
+            else:
+                owner[f] = i
+
+    groups = {}
+    for i, (name, _) in enumerate(modules):
+        groups.setdefault(find(i), []).append(name)
+    return sorted(groups.values(), key=lambda group: [name for name, _ in modules].index(group[0]))
+
+
+def evaluate_in_processes(package_dirs, max_workers=None, recursive=False):
+    """The same as [node.to_dict() for node in utils.get_pipeline_from_args(package_dirs, recursive=recursive)],
+    but loading independent groups of modules (see module_groups) in parallel."""
+    tasks = [(package_dir, group) for package_dir in package_dirs
+             for group in module_groups(package_dir, recursive) or [[]]]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_load_group, *zip(*tasks)))
+
+    nodes = []
+    for package_dir in package_dirs:
+        loaded = [by_module for (d, _), by_module in zip(tasks, results) if d == package_dir]
+        nodes += loaded[0][None]    # The root package's own nodes are the same in every group
+        for name, _ in _modules(package_dir, recursive):
+            nodes += next(by_module[name] for by_module in loaded if name in by_module)
+    return nodes
+
+
+def _modules(package_dir, recursive):
+    # (name, path) of each module in load order: top-level ones by bare name, then nested ones by qualified name
+    names = [info[1] for info in pkgutil.iter_modules([package_dir])]
+    if recursive:
+        names += utils.nested_module_names(package_dir)
+
+    modules = []
+    for name in names:
+        path = os.path.join(package_dir, *(name.split(".")[1:] if "." in name else [name]))
+        init_py = os.path.join(path, "__init__.py")
+        modules.append((name, os.path.abspath(init_py if os.path.isfile(init_py) else path + ".py")))
+    return modules
+
+
+def _parent_packages(name, package_dir):
+    # Importing a nested module by name executes the packages it's in first
+    parts = name.split(".")[1:-1]
+    return {os.path.abspath(os.path.join(package_dir, *parts[:i + 1], "__init__.py")) for i in range(len(parts))}
+
+
+def _load_group(package_dir, names):
+    # Runs in a worker, which may have loaded other groups before, hence isolating the modules
+    names = set(names)
+    by_module = {}
+    with utils.isolated_modules([package_dir]), DslContext() as context:
+        root = utils.load_package_root(package_dir)
+        by_module[None] = [node.to_dict() for node in context.take()]
+        for spec in utils.submodule_specs(root):
+            if spec.name in names:
+                utils.load_module(spec)
+                by_module[spec.name] = [node.to_dict() for node in context.take()]
+        for name in utils.nested_module_names(package_dir):
+            if name in names:
+                if name not in sys.modules:
+                    importlib.import_module(name)
+                by_module[name] = [node.to_dict() for node in context.take()]
+    return by_module
@@ -0,0 +1,69 @@
+# The node list written by --evaluate, and deltas between two of them.
+#
+# A delta against a base node list looks like:
+#
+#   {"base": "sha256:...", "added": [<node>, ...], "removed": ["<id>", ...], "changed": [<node>, ...]}
+#
+# where base is the hash of the base file, so that a consumer can check it's applying the delta to the right thing.
+# Nodes are grouped by id, so if several nodes share an id (which --evaluate now rejects, but older node lists may
+# contain) they're all listed in changed whenever any of them changes.
+import hashlib
+import json
+
+
+def load_nodes(path):
+    with open(path) as f:
+        return json.load(f)["nodes"]
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return "sha256:" + h.hexdigest()
+
+
+def write_nodes(nodes, f, indent=None):
+    """Write {"nodes": [...]} to f.  Without indent, nodes are written one at a time as they're produced, rather than
+    the whole document being built up in memory first."""
+    if indent is not None:
+        json.dump({"nodes": list(nodes)}, f, indent=indent)
+        return
+    f.write("{\"nodes\": [")
+    for i, node in enumerate(nodes):
+        if i:
+            f.write(", ")
+        f.write(json.dumps(node))
+    f.write("]}")
+
+
+def delta(base_nodes, nodes, base=None):
+    """The changes from base_nodes to nodes (see above).  base identifies the base nodes, e.g. by file_hash."""
+    before = _by_id(base_nodes)
+    after = _by_id(_normalised(nodes))
+    return {
+        "base": base,
+        "added": [node for node_id, group in after.items() if node_id not in before for node in group],
+        "removed": [node_id for node_id in before if node_id not in after],
+        "changed": [node for node_id, group in after.items()
+                    if node_id in before and before[node_id] != group for node in group]
+    }
+
+
+def apply_delta(base_nodes, d):
+    """Nodes as of the delta.  Unchanged nodes keep their order, followed by anything changed or added."""
+    replaced = set(d["removed"]) | {node["id"] for node in d["changed"]}
+    return [node for node in base_nodes if node["id"] not in replaced] + d["changed"] + d["added"]
+
+
+def _by_id(nodes):
+    by_id = {}
+    for node in nodes:
+        by_id.setdefault(node["id"], []).append(node)
+    return by_id
+
+
+def _normalised(nodes):
+    # As they'd be after a round trip through JSON (e.g. tuples become lists), so they compare equal to the base's
+    return [json.loads(json.dumps(node)) for node in nodes]
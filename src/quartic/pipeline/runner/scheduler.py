@@ -0,0 +1,315 @@
+import heapq
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from quartic.common import utils
+from quartic.common.exceptions import MultipleMatchingStepsException, QuarticException
+from quartic.common.log import logger
+from quartic.pipeline.validator import dag_utils
+log = logger(__name__)
+
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"     # Because something upstream failed
+UP_TO_DATE = "up-to-date"
+COMPLETED_EARLIER = "completed-earlier"     # In a previous attempt at a resumed run
+
+
+class StepResult:
+    def __init__(self, step_id, name):
+        self.step_id = step_id
+        self.name = name
+        self.status = None
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.end is not None else None
+
+    def to_dict(self):
+        return {
+            "id": self.step_id,
+            "name": self.name,
+            "status": self.status,
+            "start": self.start,
+            "end": self.end,
+            "error": self.error
+        }
+
+
+def step_dependencies(steps, namespace):
+    """Map the id of each runnable step to the ids of the runnable steps producing its inputs.
+
+    Raw steps aren't runnable (the platform ingests those datasets), so their outputs are treated as already
+    existing."""
+    runnable = [step for step in steps if step.runnable()]
+    ids = [step.get_id() for step in runnable]
+    for step_id in set(ids):
+        if ids.count(step_id) > 1:
+            raise MultipleMatchingStepsException(
+                step_id, [step.to_dict() for step in runnable if step.get_id() == step_id])
+    if not runnable:
+        return {}
+
+    dag = dag_utils.build_dag(steps, namespace)
+    if not dag_utils.is_valid_dag(dag):
+        raise QuarticException("The pipeline is not a DAG. Check for cycles.")
+
+    producers = {}
+    duplicated = set()
+    for step in runnable:
+        for ds in step.outputs():
+            ds = ds.fully_qualified(namespace)
+            if ds in producers:
+                duplicated.add(ds)
+            producers[ds] = step.get_id()
+    if duplicated:
+        raise QuarticException("The following outputs are defined in multiple steps: {}".format(
+            ", ".join(sorted(str(ds) for ds in duplicated))))
+
+    return {
+        step.get_id(): {producers[ds.fully_qualified(namespace)] for ds in step.inputs()
+                        if ds.fully_qualified(namespace) in producers} - {step.get_id()}
+        for step in runnable
+    }
+
+
+def critical_path_lengths(dependencies, durations=None):
+    """Length of the longest chain of steps from each step to the end of the pipeline (including the step itself),
+    weighting each step by its duration if known.  Steps of unknown duration are weighted by the mean known
+    duration, or by 1 if none are known (so that without durations this is the number of steps in the chain)."""
+    durations = durations or {}
+    known = [durations[step_id] for step_id in dependencies if step_id in durations]
+    default = sum(known) / len(known) if known else 1
+    dependents = _dependents(dependencies)
+    lengths = {}
+    for step_id in reversed(_topological_order(dependencies, dependents)):
+        weight = durations.get(step_id, default)
+        lengths[step_id] = weight + max((lengths[d] for d in dependents[step_id]), default=0)
+    return lengths
+
+
+def execution_order(dependencies):
+    """Step ids ordered such that every step comes after its dependencies."""
+    return _topological_order(dependencies, _dependents(dependencies))
+
+
+def run_steps(dependencies, run_step, executor, max_workers, names=None, journal=None):
+    """Call run_step(step_id) in executor for each step once all of its dependencies have succeeded.
+
+    At most max_workers steps are in flight at once, and whenever a worker frees up the ready step heading the
+    critical path (the longest remaining chain, weighted by how long each step took in earlier runs if the journal
+    knows) is started next.  Steps downstream of a failure are skipped, but independent branches
+    carry on.  run_step may return False to indicate that the step was already up to date.  Returns a StepResult
+    per step.
+
+    If a journal (see RunJournal) is given, the progress of each step is recorded in it, and steps which it reports
+    as completed (along with everything upstream of them) aren't run again."""
+    # pylint: disable=too-many-arguments,too-many-locals
+    dependents = _dependents(dependencies)
+    priority = critical_path_lengths(dependencies, journal.durations() if journal else None)
+    waiting_on = {step_id: set(deps) for step_id, deps in dependencies.items()}
+    results = {step_id: StepResult(step_id, (names or {}).get(step_id)) for step_id in dependencies}
+
+    for step_id in _completed_earlier(dependencies, dependents, journal.completed_steps() if journal else set()):
+        results[step_id].status = COMPLETED_EARLIER
+        journal.finished(results[step_id])
+        for dependent in dependents[step_id]:
+            waiting_on[dependent].discard(step_id)
+
+    ready = [(-priority[step_id], step_id) for step_id, deps in waiting_on.items()
+             if not deps and results[step_id].status is None]
+    heapq.heapify(ready)
+    running = {}
+    while ready or running:
+        while ready and len(running) < max_workers:
+            _, step_id = heapq.heappop(ready)
+            log.info("Starting step %s", _describe(results[step_id]))
+            if journal:
+                journal.started(results[step_id])
+            running[executor.submit(_timed_call, run_step, step_id)] = step_id
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = results[running.pop(future)]
+            result.start, result.end, result.error, executed = future.result()
+            if result.error is None:
+                result.status = SUCCEEDED if executed is not False else UP_TO_DATE
+                log.info("Finished step %s in %.2fs", _describe(result), result.duration)
+                for dependent in dependents[result.step_id]:
+                    waiting_on[dependent].discard(result.step_id)
+                    if not waiting_on[dependent] and results[dependent].status is None:
+                        heapq.heappush(ready, (-priority[dependent], dependent))
+            else:
+                result.status = FAILED
+                log.error("Step %s failed:\n%s", _describe(result), result.error)
+                for downstream in _downstream(result.step_id, dependents):
+                    results[downstream].status = SKIPPED
+            if journal:
+                journal.finished(result)
+
+    return [results[step_id] for step_id in _topological_order(dependencies, dependents)]
+
+
+def sink_datasets(steps, namespace):
+    """Datasets output by runnable steps that no runnable step consumes."""
+    runnable = [step for step in steps if step.runnable()]
+    consumed = {ds.with_namespace(namespace) for step in runnable for ds in step.inputs()}
+    return {ds.with_namespace(namespace) for step in runnable for ds in step.outputs()} - consumed
+
+
+def run_in_threads(steps, namespace, client_factory, max_workers=None, persist=None, incremental=False,
+                   journal=None):
+    """Run the pipeline with each step executing on a thread of this process.
+
+    client_factory is called once per thread to construct its Quartic client, as the underlying requests sessions
+    aren't safe to share between threads.
+
+    If persist is given, outputs are handed between steps in memory rather than via the catalogue and Howl, and
+    only the sinks of the pipeline plus the datasets in persist are written out.
+
+    If incremental is set, steps whose code and inputs are unchanged since their output was written are skipped."""
+    # pylint: disable=too-many-arguments
+    by_id = {step.get_id(): step for step in steps}
+    store = None if persist is None else _memory_store(steps, namespace, persist)
+    clients = threading.local()
+
+    def run_step(step_id):
+        if not hasattr(clients, "quartic"):
+            clients.quartic = client_factory()
+        executed = by_id[step_id].execute(clients.quartic, namespace, store, incremental)
+        if store is not None:
+            for ds in by_id[step_id].inputs():
+                store.release(ds.with_namespace(namespace))
+        return executed
+
+    max_workers = max_workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return run_steps(step_dependencies(steps, namespace), run_step, executor, max_workers, _names(steps), journal)
+
+
+def run_in_processes(steps, namespace, pipelines, client_factory, max_workers=None, incremental=False,
+                     journal=None):
+    """Run the pipeline with each step executing in a worker process, which loads the pipelines itself.
+
+    client_factory is called in the worker to construct the Quartic client, so must be picklable (e.g. a
+    functools.partial of Quartic or Quartic.local)."""
+    # pylint: disable=too-many-arguments
+    from functools import partial
+    max_workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return run_steps(step_dependencies(steps, namespace),
+                         partial(_execute_in_worker, tuple(pipelines), client_factory, namespace, incremental),
+                         executor, max_workers, _names(steps), journal)
+
+
+def output_versions(steps, namespace, quartic, persist=None):
+    """A function giving the current version of a step's output, for RunJournal.
+
+    Outputs that are only held in memory (see run_in_threads) have no durable version."""
+    outputs = {step.get_id(): next(step.outputs()).with_namespace(namespace) for step in steps}
+    durable = None if persist is None else _persisted(steps, namespace, persist)
+
+    def version(step_id):
+        if durable is not None and outputs[step_id] not in durable:
+            return None
+        return outputs[step_id].resolve(quartic).version()
+    return version
+
+
+def format_report(results, wall_time):
+    timed = [r for r in results if r.start is not None and r.status != UP_TO_DATE]
+    durations = {r.step_id: r.duration for r in timed}
+    lines = ["{:<17} {:>9}  {} ({})".format(
+        r.status, "{:.2f}s".format(r.duration) if r.duration is not None else "-", r.name, r.step_id)
+             for r in sorted(results, key=lambda r: (r.start is None, r.start))]
+    serial = sum(durations.values())
+    lines.append("Ran {} of {} steps in {:.2f}s ({:.2f}s of step time, {:.1f}x parallelism)".format(
+        len(timed), len(results), wall_time, serial, serial / wall_time if wall_time else 0))
+    return "\n".join(lines)
+
+
+def _memory_store(steps, namespace, persist):
+    from quartic.common.memory import MemoryStore
+    consumers = {}
+    for step in steps:
+        if step.runnable():
+            for ds in step.inputs():
+                key = ds.with_namespace(namespace)
+                consumers[key] = consumers.get(key, 0) + 1
+    return MemoryStore(_persisted(steps, namespace, persist), consumers)
+
+
+def _persisted(steps, namespace, persist):
+    return {ds.with_namespace(namespace) for ds in persist} | sink_datasets(steps, namespace)
+
+
+_worker_steps = {}
+
+
+def _execute_in_worker(pipelines, client_factory, namespace, incremental, step_id):
+    # Loaded once per worker process, and reused for every step it runs
+    if pipelines not in _worker_steps:
+        _worker_steps[pipelines] = {step.get_id(): step for step in utils.get_pipeline_from_args(pipelines)}
+    return _worker_steps[pipelines][step_id].execute(client_factory(), namespace, incremental=incremental)
+
+
+def _timed_call(f, step_id):
+    # Exceptions are returned as formatted text rather than raised, as they aren't necessarily picklable
+    start = time.time()
+    try:
+        executed = f(step_id)
+        return start, time.time(), None, executed
+    except Exception:   # pylint: disable=broad-except
+        return start, time.time(), traceback.format_exc(), None
+
+
+def _completed_earlier(dependencies, dependents, completed):
+    # A completed step still has to run again if anything upstream of it does
+    done = set()
+    for step_id in _topological_order(dependencies, dependents):
+        if step_id in completed and dependencies[step_id] <= done:
+            done.add(step_id)
+    return done
+
+
+def _dependents(dependencies):
+    dependents = {step_id: [] for step_id in dependencies}
+    for step_id, deps in dependencies.items():
+        for dep in deps:
+            dependents[dep].append(step_id)
+    return dependents
+
+
+def _topological_order(dependencies, dependents):
+    remaining = {step_id: len(deps) for step_id, deps in dependencies.items()}
+    order = sorted(step_id for step_id, count in remaining.items() if count == 0)
+    for step_id in order:     # Grows as we go
+        for dependent in dependents[step_id]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                order.append(dependent)
+    return order
+
+
+def _downstream(step_id, dependents):
+    seen = set()
+    stack = list(dependents[step_id])
+    while stack:
+        d = stack.pop()
+        if d not in seen:
+            seen.add(d)
+            stack.extend(dependents[d])
+    return seen
+
+
+def _names(steps):
+    return {step.get_id(): step.get_name() for step in steps}
+
+
+def _describe(result):
+    return "{} ({})".format(result.name, result.step_id)
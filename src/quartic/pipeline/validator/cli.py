@@ -1,4 +1,6 @@
+import os
 import sys
+import time
 import click
 from quartic.common import yaml_utils
 from quartic.pipeline.validator import dag_utils
@@ -15,11 +17,14 @@ def check_for_config():
 def cli():
     pass
 
+STATIC_HELP = "Read steps from source where possible, rather than importing the pipeline code."
+
 @cli.command()
-def validate():
+@click.option("--static", is_flag=True, help=STATIC_HELP)
+def validate(static):
     check_for_config()
     try:
-        graph = dag_utils.get_graph()
+        graph = dag_utils.get_graph(static=static)
         if dag_utils.is_valid_dag(graph):
             qdag = qd.QuarticDag(graph)
             if qdag.one_step_per_ds():
@@ -40,19 +45,21 @@ def validate():
         click.secho(" ".join([click.style("ERROR:", fg="red", bold=True), str(e)]))
 
 @cli.command()
-def test():
+@click.option("--recursive", is_flag=True, help="Also submit files in packages nested within the pipeline packages.")
+def test(recursive):
     click.secho("Submitting changes to Quartic")
     repo = git.get_git_repo()
     new_branch = git.create_test_branch(repo)
-    git.commit_push(repo, new_branch)
+    git.commit_push(repo, new_branch, recursive)
     click.secho("\n Submitted.", fg="green", bold=True)
     click.secho("Check the interface for details.")
 
 @cli.command()
-def status():
+@click.option("--static", is_flag=True, help=STATIC_HELP)
+def status(static):
     check_for_config()
     try:
-        graph = dag_utils.get_graph()
+        graph = dag_utils.get_graph(static=static)
         if not dag_utils.is_valid_dag(graph):
             click.secho("Error", fg="red", bold=True)
             click.echo("The pipeline is not a DAG. Check for cycles.")
@@ -71,6 +78,76 @@ def status():
     except Exception as e:
         click.secho(" ".join([click.style("ERROR:", fg="red", bold=True), str(e)]))
 
+@cli.command(help="""Run the pipeline locally, executing independent steps concurrently.
+
+              Progress is journalled under .quartic/runs (next to quartic.yml), so that a failed run can be
+              continued with --resume.""")
+@click.option("--namespace", default="local-testing", help="Namespace for datasets without one.")
+@click.option("--local", "local_root", type=click.Path(file_okay=False),
+              help="Use a catalogue and Howl stored under this directory, rather than the platform.")
+@click.option("--api-token", help="Quartic API token, to run against the platform.")
+@click.option("--url-format", default="http://{service}.platform:{port}/api/", help="Platform service URL format.")
+@click.option("--workers", type=int, help="Maximum number of steps to run at once (default: number of CPUs).")
+@click.option("--processes", is_flag=True, help="Run each step in a worker process rather than a thread.")
+@click.option("--in-memory", is_flag=True,
+              help="Hand intermediate datasets between steps in memory, only writing out the pipeline's sinks.")
+@click.option("--persist", multiple=True, metavar="DATASET",
+              help="With --in-memory, also write out this intermediate dataset (may be repeated).")
+@click.option("--incremental", is_flag=True,
+              help="Skip steps whose code and inputs haven't changed since their output was last written. Only "
+                   "the step function's own source is compared, not helpers or constants it uses.")
+@click.option("--resume", metavar="RUN_ID",
+              help="Continue an earlier run, skipping steps it completed whose outputs are unchanged.")
+def run(namespace, local_root, api_token, url_format, workers, processes, in_memory, persist, incremental, resume):
+    # pylint: disable=too-many-arguments,too-many-locals
+    from functools import partial
+    from quartic.common.dataset import Dataset
+    from quartic.common.quartic import Quartic
+    from quartic.common.utils import get_pipeline_from_args
+    from quartic.pipeline.runner import scheduler
+    from quartic.pipeline.runner.journal import RunJournal, new_run_id
+
+    check_for_config()
+    if in_memory and processes:
+        click.echo("Can't use --in-memory with --processes.")
+        sys.exit(1)
+    if local_root:
+        client_factory = partial(Quartic.local, local_root)
+    elif api_token:
+        client_factory = partial(Quartic, api_token, url_format)
+    else:
+        click.echo("Must specify either --local or --api-token.")
+        sys.exit(1)
+
+    pipelines = yaml_utils.attr_paths_from_config(yaml_utils.config()[yaml_utils.pipeline_directory])
+    journal_dir = os.path.join(os.path.dirname(yaml_utils.config_path()), ".quartic", "runs")
+    persist = [Dataset.parse(ds) if "::" in ds else Dataset(ds) for ds in persist] if in_memory else None
+    start = time.time()
+    try:
+        steps = get_pipeline_from_args(pipelines)
+        quartic = client_factory()
+        run_id = resume or new_run_id()
+        with RunJournal(journal_dir, run_id, scheduler.output_versions(steps, namespace, quartic, persist),
+                        resume=bool(resume)) as journal:
+            click.echo("Run ID: {}".format(run_id))
+            if processes:
+                results = scheduler.run_in_processes(steps, namespace, pipelines, client_factory, workers,
+                                                     incremental, journal)
+            else:
+                results = scheduler.run_in_threads(steps, namespace, client_factory, workers, persist, incremental,
+                                                   journal)
+    #pylint: disable=W0703
+    except Exception as e:
+        click.secho(" ".join([click.style("ERROR:", fg="red", bold=True), str(e)]))
+        sys.exit(1)
+
+    click.echo(scheduler.format_report(results, time.time() - start))
+    if any(r.status not in (scheduler.SUCCEEDED, scheduler.UP_TO_DATE, scheduler.COMPLETED_EARLIER)
+           for r in results):
+        click.secho("Pipeline failed. Continue it with --resume {}".format(run_id), fg="red", bold=True)
+        sys.exit(1)
+    click.secho("Pipeline succeeded.", fg="green")
+
 @cli.command(help="""Setup the repository by generating quartic.yml.
             This should be run in the root of your git repository.""")
 def init():
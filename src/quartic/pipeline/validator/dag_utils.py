@@ -25,11 +25,16 @@ def build_dag(steps, default_namespace="default"):
 
     return g
 
-def get_graph(steps=None):
+def get_graph(steps=None, static=False):
+    """If static, modules are only imported if their steps can't be extracted from source (see quartic.dsl.static)."""
     cfg = yaml_utils.config()
     if not steps:
         pipeline_dir = yaml_utils.attr_paths_from_config(cfg[yaml_utils.pipeline_directory])
-        steps = get_pipeline_from_args(pipeline_dir)
+        if static:
+            from quartic.dsl.static import get_pipeline
+            steps = get_pipeline(pipeline_dir)
+        else:
+            steps = get_pipeline_from_args(pipeline_dir)
     return build_dag(steps, "local-testing")
 
 def is_valid_dag(dag):
@@ -33,14 +33,14 @@ def get_git_repo():
 def create_test_branch(repo):
     return repo.create_head("quartic/{}".format(uuid.uuid4()))
 
-def commit_push(repo, branch):
+def commit_push(repo, branch, recursive=False):
     cfg = yaml_utils.config()
     old_branch = repo.active_branch
     br = branch.checkout()
     index = repo.index
     try:
         pdir = yaml_utils.attr_paths_from_config(cfg["pipeline_directory"])
-        index.add(utils.get_python_files(pdir))
+        index.add(utils.get_python_files(pdir, recursive))
         index.commit("Quartic - qli commit on {}".format(datetime.date.today()))
         origin = repo.remotes.origin
         origin.push("{}:{}".format(branch.name, branch.name), progress=ProgressPrinter())
@@ -0,0 +1,40 @@
+import pandas as pd
+from quartic.common.compact import compact
+
+
+class TestCompact:
+    def test_converts_low_cardinality_strings_to_categoricals(self):
+        df = pd.DataFrame({
+            "repeated": ["a", "b", "a", "b"],
+            "unique": ["w", "x", "y", "z"],
+            "mixed": ["a", 1, "a", 1],
+            "lists": [["a"], ["a"], ["a"], ["a"]]
+        })
+
+        report = compact(df)
+
+        assert str(df["repeated"].dtype) == "category"
+        assert str(df["unique"].dtype) != "category"
+        assert str(df["mixed"].dtype) == "object"
+        assert str(df["lists"].dtype) == "object"
+        assert df["repeated"].tolist() == ["a", "b", "a", "b"]
+        assert set(report["columns"]) == {"repeated"}
+
+    def test_downcasts_numbers_without_losing_values(self):
+        df = pd.DataFrame({
+            "small": [0, 1, 255],
+            "negative": [-1, 0, 1],
+            "big": [0, 1, 2**40],
+            "float": [0.5, 1.0, None],
+            "precise": [0.1, 0.2, 0.3]
+        })
+
+        report = compact(df)
+
+        assert df["small"].dtype == "uint8"
+        assert df["negative"].dtype == "int8"
+        assert df["big"].dtype == "uint64"
+        assert df["float"].dtype == "float32"
+        assert df["precise"].dtype == "float64"
+        assert df["big"].tolist() == [0, 1, 2**40]
+        assert report["after_bytes"] < report["before_bytes"]
@@ -1,6 +1,16 @@
+import io
 import json
 import csv
-from quartic.common.io import DownloadFile, UploadFile, DatasetReader, DatasetWriter, LocalIoFactory
+from quartic.common.io import (
+    DownloadFile,
+    UploadFile,
+    DatasetReader,
+    DatasetWriter,
+    LocalIoFactory,
+    RangeFile,
+    RemoteIoFactory,
+)
+from quartic.common.exceptions import QuarticException
 import pandas as pd
 import pytest
 from mock import MagicMock, Mock, call, ANY
@@ -56,6 +66,17 @@ class TestDatasetReader:
         assert data == data_read
 
 
+    def test_reads_local_files_read_only(self, tmpdir):
+        path = tmpdir.join("input.bin")
+        io_factory = LocalIoFactory(path)
+
+        with open(path, "wb") as f:
+            f.write(bytes([0, 1, 2, 3, 255]))
+
+        with pytest.raises(IOError):
+            DatasetReader(io_factory).raw().write(bytes([4]))
+
+
     def test_reads_csv(self, tmpdir):
         path = tmpdir.join("input.csv")
         io_factory = LocalIoFactory(path)
@@ -78,6 +99,39 @@ class TestDatasetReader:
         )
 
 
+    def test_reads_csv_in_parallel(self, tmpdir, monkeypatch):
+        monkeypatch.setattr("quartic.common.io.PARALLEL_CSV_MIN_CHUNK_BYTES", 100)
+        path = tmpdir.join("input.csv")
+        rows = ["{},{},{}".format(i, "x" if i < 150 else i, i / 2) for i in range(300)]
+        path.write("foo,bar,baz\n" + "\n".join(rows))
+
+        df = DatasetReader(LocalIoFactory(path)).csv(parallel=True, max_workers=4)
+
+        assert df["foo"].tolist() == list(range(300))
+        assert df["baz"].tolist() == [i / 2 for i in range(300)]
+        # Strings in some chunks and numbers in others, so strings throughout
+        assert df["bar"].tolist() == ["x"] * 150 + [str(i) for i in range(150, 300)]
+
+
+    @pytest.mark.parametrize("sample_rows", [10, 1000])
+    def test_reads_csv_in_parallel_like_serially(self, tmpdir, monkeypatch, sample_rows):
+        monkeypatch.setattr("quartic.common.io.PARALLEL_CSV_MIN_CHUNK_BYTES", 100)
+        monkeypatch.setattr("quartic.common.io.PARALLEL_CSV_SAMPLE_ROWS", sample_rows)
+        path = tmpdir.join("input.csv")
+        # Empty strings throughout some chunks, and strings only after the sample in another column
+        rows = ["{},{},{}".format(i, "" if i < 150 else "x", i if i < 250 else "y") for i in range(300)]
+        path.write("foo,bar,baz\n" + "\n".join(rows))
+
+        for kwargs in [{}, {"header": None}, {"names": ["a", "b", "c"]}, {"header": 0, "names": ["a", "b", "c"]},
+                       {"usecols": ["foo", "bar"]}]:
+            serial = DatasetReader(LocalIoFactory(path)).csv(**kwargs)
+            parallel = DatasetReader(LocalIoFactory(path)).csv(parallel=True, max_workers=4, **kwargs)
+
+            assert len(parallel) == len(serial)
+            assert list(parallel.columns) == list(serial.columns)
+            assert parallel.isnull().sum().tolist() == serial.isnull().sum().tolist()
+
+
     def test_reads_csv_with_non_ascii_chars(self, tmpdir):
         path = tmpdir.join("input.csv")
         io_factory = LocalIoFactory(path)
@@ -113,9 +167,116 @@ class TestDatasetReader:
         pd.util.testing.assert_frame_equal(df, df_read)
 
 
+    def test_reads_parquet_compact(self, tmpdir):
+        path = tmpdir.join("input.pq")
+        df = pd.DataFrame({
+            "foo": [0, 1, 2, 3],
+            "bar": ["hello", "goodbye", "hello", "hello"]
+        })
+        pq.write_table(pa.Table.from_pandas(df), path.strpath)
+
+        reader = DatasetReader(LocalIoFactory(path))
+        df_read = reader.parquet(compact=True)
+
+        assert str(df_read["bar"].dtype) == "category"
+        assert df_read["foo"].dtype == "uint8"
+        assert df_read["bar"].tolist() == df["bar"].tolist()
+        assert reader.memory_report["columns"]["foo"] == {"from": "int64", "to": "uint8"}
+
+
     # TODO - test parquet handling of timestamps?
 
 
+    def test_reads_arrow_ipc(self, tmpdir):
+        path = tmpdir.join("input.arrow")
+        io_factory = LocalIoFactory(path)
+
+        df = pd.DataFrame({
+            "foo": [0, 1, 2],
+            "bar": ["hello", "goodbye", "oh dear"]
+        })
+        batch = pa.RecordBatch.from_pandas(df)
+        with pa.OSFile(path.strpath, "wb") as sink:
+            writer = pa.RecordBatchFileWriter(sink, batch.schema)
+            writer.write_batch(batch)
+            writer.close()
+
+        tbl = DatasetReader(io_factory).arrow_ipc(as_table=True)
+        assert isinstance(tbl, pa.Table)
+        assert tbl.to_pandas().equals(df)
+
+
+    def test_streams_arrow_ipc_from_python_file(self, tmpdir):
+        path = tmpdir.join("input.arrow")
+
+        df = pd.DataFrame({"foo": [0, 1, 2]})
+        with DatasetWriter(LocalIoFactory(path), lambda x: None, None) as f:
+            f.arrow_ipc(df)
+
+        io_factory = Mock()
+        io_factory.readable_stream.return_value = io.BytesIO(open(path, "rb").read())
+
+        assert DatasetReader(io_factory).arrow_ipc()["foo"].tolist() == [0, 1, 2]
+
+
+    def test_head_reads_start_of_csv(self, tmpdir):
+        path = tmpdir.join("input.csv")
+        path.write("foo,bar\n" + "".join("{},x\n".format(i) for i in range(100000)))
+
+        df = DatasetReader(LocalIoFactory(path), {"mime_type": "text/csv"}).head(3)
+
+        assert df["foo"].tolist() == [0, 1, 2]
+
+
+    def test_head_reads_first_row_groups_of_parquet(self, tmpdir):
+        path = tmpdir.join("input.pq")
+        pq.write_table(pa.Table.from_pandas(pd.DataFrame({"foo": list(range(100))})), path.strpath, row_group_size=10)
+
+        df = DatasetReader(LocalIoFactory(path)).head(15)     # Format is sniffed when there's no locator
+
+        assert df["foo"].tolist() == list(range(15))
+
+
+    def test_head_reads_first_batches_of_arrow_ipc(self, tmpdir):
+        path = tmpdir.join("input.arrow")
+        with DatasetWriter(LocalIoFactory(path), lambda x: None, None) as f:
+            f.arrow_ipc(pd.DataFrame({"foo": list(range(100))}))
+
+        assert DatasetReader(LocalIoFactory(path), f.locator()).head(5)["foo"].tolist() == list(range(5))
+
+
+    def test_head_rejects_unknown_format(self, tmpdir):
+        path = tmpdir.join("input.json")
+        path.write("{\"foo\": 42}")
+
+        with pytest.raises(QuarticException):
+            DatasetReader(LocalIoFactory(path)).head(5)
+
+
+    def test_head_of_table_is_served_from_preview(self, tmpdir):
+        io_factory = LocalIoFactory(tmpdir.join("output.arrow").strpath)
+        df = pd.DataFrame({"foo": list(range(100))}, index=list(range(100, 200)))
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.arrow_ipc(pa.Table.from_pandas(df), preview_rows=10)
+
+        assert f.locator()["preview"]["num_rows"] == 10
+        io_factory.random_access_file = Mock(side_effect=AssertionError("Shouldn't touch the full dataset"))
+        pd.util.testing.assert_frame_equal(DatasetReader(io_factory, f.locator()).head(5), df.head(5))
+
+
+    def test_head_is_served_from_preview(self, tmpdir):
+        io_factory = LocalIoFactory(tmpdir.join("output.pq").strpath)
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.parquet(pd.DataFrame({"foo": list(range(100))}), preview_rows=10)
+
+        preview = f.locator()["preview"]
+        assert preview["num_rows"] == 10
+        assert not preview["complete"]
+
+        io_factory.random_access_file = Mock(side_effect=AssertionError("Shouldn't touch the full dataset"))
+        assert DatasetReader(io_factory, f.locator()).head(5)["foo"].tolist() == list(range(5))
+
+
     def test_reads_json(self, tmpdir):
         path = tmpdir.join("input.json")
         io_factory = LocalIoFactory(path)
@@ -151,6 +312,55 @@ class TestDatasetReader:
         assert data == data_read
 
 
+class TestRangeFile:
+    def test_fetches_only_blocks_that_are_read(self):
+        data = bytes(range(256)) * 4
+        howl = Mock()
+        howl.size_path.return_value = len(data)
+        howl.download_range.side_effect = lambda path, start, end: data[start:end + 1]
+
+        with RangeFile(howl, "/foo", block_size=100) as f:
+            f.seek(-10, io.SEEK_END)
+            assert f.read() == data[-10:]
+            f.seek(150)
+            assert f.read(100) == data[150:250]
+            assert f.read(50) == data[250:300]
+
+        assert howl.download_range.call_args_list == [
+            call("/foo", 1000, 1023),
+            call("/foo", 100, 199),
+            call("/foo", 200, 299),
+        ]
+
+    def test_downloads_everything_once_if_ranges_unsupported(self):
+        data = bytes(range(256)) * 4
+        howl = MagicMock()
+        howl.size_path.return_value = len(data)
+        howl.download_range.return_value = None
+        howl.download_path.return_value.__enter__.return_value.iter_content.return_value = [data]
+
+        with RangeFile(howl, "/foo", block_size=100) as f:
+            f.seek(150)
+            assert f.read(100) == data[150:250]
+            f.seek(-10, io.SEEK_END)
+            assert f.read() == data[-10:]
+
+        assert howl.download_range.call_count == 1
+        assert howl.download_path.call_count == 1
+
+
+class TestRemoteIoFactory:
+    def test_rejects_partitions_of_anonymous_datasets(self):
+        howl = Mock()
+        df = pd.DataFrame({"date": ["2017-01-02", "2017-01-01"], "foo": [0, 1]})
+
+        with pytest.raises(QuarticException) as excinfo:
+            with DatasetWriter(RemoteIoFactory(howl, "/yeah/managed/yeah"), lambda x: None, None) as f:
+                f.parquet(df, partition_by=["date"])
+        assert "anonymous" in str(excinfo.value)
+        assert not howl.upload_path.called
+
+
 class TestDatasetWriter:
     def test_passes_extensions_to_callback(self, tmpdir):
         path = tmpdir.join("output.pq")
@@ -166,6 +376,74 @@ class TestDatasetWriter:
         assert on_close.mock_calls == [call({"foo": "bar"})]
 
 
+    def test_records_mime_type_in_locator(self, tmpdir):
+        path = tmpdir.join("output.json")
+        io_factory = LocalIoFactory(path)
+
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            assert f.locator() == {}
+            f.json({"foo": "bar"})
+
+        assert f.locator()["mime_type"] == "application/json"
+
+
+    def test_arrow_ipc_round_trips(self, tmpdir):
+        path = tmpdir.join("output.arrow")
+        io_factory = LocalIoFactory(path)
+
+        df = pd.DataFrame({
+            "foo": [0, 1, 2],
+            "bar": ["hello", "goodbye", "oh dear"],
+            "baz": pd.to_datetime([1, 2, 3])  # Nanoseconds since epoch
+        })
+
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.arrow_ipc(df)
+
+        assert f.locator()["mime_type"] == "application/vnd.apache.arrow.file"
+        assert DatasetReader(io_factory).arrow_ipc().equals(df)
+
+
+    def test_records_content_hash(self, tmpdir):
+        io_factory = LocalIoFactory(tmpdir.join("output.bin"))
+
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.write(b"hello")
+
+        assert f.locator()["content_hash"] == \
+            "sha256:2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+
+
+    def test_skips_upload_if_content_unchanged(self):
+        io_factory = Mock()
+        on_close = Mock()
+        previous_locator = {
+            "content_hash": "sha256:2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+        }
+
+        with DatasetWriter(io_factory, on_close, {}, previous_locator=previous_locator) as f:
+            f.write(b"hello")
+
+        assert f.unchanged()
+        io_factory.writable_file.return_value.cancel.assert_called_with()
+        io_factory.writable_file.return_value.close.assert_not_called()
+        assert on_close.called
+
+
+    def test_uploads_if_content_changed(self):
+        io_factory = Mock()
+        previous_locator = {
+            "content_hash": "sha256:2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824"
+        }
+
+        with DatasetWriter(io_factory, lambda x: None, {}, previous_locator=previous_locator) as f:
+            f.write(b"goodbye")
+
+        assert not f.unchanged()
+        io_factory.writable_file.return_value.close.assert_called_with()
+        io_factory.writable_file.return_value.cancel.assert_not_called()
+
+
     def test_parquet_succeeds(self, tmpdir):
         path = tmpdir.join("output.pq")
         io_factory = LocalIoFactory(path)
@@ -183,6 +461,115 @@ class TestDatasetWriter:
         pd.util.testing.assert_frame_equal(df, df_written)
 
 
+    def test_parquet_records_stats(self, tmpdir):
+        path = tmpdir.join("output.pq")
+        io_factory = LocalIoFactory(path)
+
+        df = pd.DataFrame({
+            "foo": [0, 1, None],
+            "bar": ["hello", "goodbye", "oh dear"]
+        })
+
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.parquet(df)
+
+        stats = f.extensions()["stats"]
+        assert stats["num_rows"] == 3
+        assert stats["num_bytes"] == path.size()
+        assert {"name": "foo", "type": "double"} in stats["schema"]
+        assert stats["columns"]["foo"] == {"min": 0, "max": 1, "null_count": 1}
+        assert stats["columns"]["bar"] == {"min": "goodbye", "max": "oh dear", "null_count": 0}
+
+
+    def test_csv_records_stats(self, tmpdir):
+        path = tmpdir.join("output.csv")
+        io_factory = LocalIoFactory(path)
+
+        df = pd.DataFrame({
+            "foo": [0, 1, 2],
+            "bar": ["hello", None, "oh dear"]
+        })
+
+        with DatasetWriter(io_factory, lambda x: None, {"existing": 42}) as f:
+            f.csv(df, index=False)
+
+        stats = f.extensions()["stats"]
+        assert f.extensions()["existing"] == 42
+        assert stats["num_rows"] == 3
+        assert stats["num_bytes"] == path.size()
+        assert {"name": "foo", "type": "int64"} in stats["schema"]
+        assert stats["columns"]["foo"] == {"min": 0, "max": 2, "null_count": 0}
+        assert stats["columns"]["bar"] == {"min": "hello", "max": "oh dear", "null_count": 1}
+
+
+    def test_parquet_writes_row_groups_of_given_size(self, tmpdir):
+        path = tmpdir.join("output.pq")
+        df = pd.DataFrame({
+            "foo": list(range(25)),
+            "bar": ["x"] * 25
+        }, index=list(range(100, 125)))
+
+        with DatasetWriter(LocalIoFactory(path.strpath), lambda x: None, None) as f:
+            f.parquet(df, row_group_size=10)
+
+        assert pq.ParquetFile(path.strpath).num_row_groups == 3
+        assert f.extensions()["stats"]["num_rows"] == 25
+        pd.util.testing.assert_frame_equal(df, pq.read_table(path.strpath).to_pandas(), check_dtype=False)
+
+
+    def test_parquet_types_columns_null_in_first_row_group_from_the_rest(self, tmpdir):
+        path = tmpdir.join("output.pq")
+        df = pd.DataFrame({
+            "foo": list(range(25)),
+            "bar": [None] * 10 + ["x"] * 15
+        })
+
+        with DatasetWriter(LocalIoFactory(path.strpath), lambda x: None, None) as f:
+            f.parquet(df, row_group_size=10)
+
+        assert {"name": "bar", "type": "string"} in f.extensions()["stats"]["schema"]
+        pd.util.testing.assert_frame_equal(df, pq.read_table(path.strpath).to_pandas())
+
+
+    def test_parquet_partitioned_round_trips(self, tmpdir):
+        path = tmpdir.join("output.pq")
+        io_factory = LocalIoFactory(path.strpath)
+
+        df = pd.DataFrame({
+            "date": ["2017-01-02", "2017-01-01", "2017-01-02", "2017-01-03"],
+            "foo": [0, 1, 2, 3]
+        })
+
+        with DatasetWriter(io_factory, lambda x: None, None) as f:
+            f.parquet(df, partition_by="date")
+
+        partitions = f.locator()["partitions"]
+        assert partitions["columns"] == ["date"]
+        assert [p["values"] for p in partitions["parts"]] == [
+            {"date": "2017-01-01"}, {"date": "2017-01-02"}, {"date": "2017-01-03"}
+        ]
+        assert [p["stats"]["num_rows"] for p in partitions["parts"]] == [1, 2, 1]
+        assert f.extensions()["stats"]["num_rows"] == 4
+        assert f.extensions()["stats"]["columns"]["foo"] == {"min": 0, "max": 3, "null_count": 0}
+
+        reader = DatasetReader(io_factory, f.locator())
+        pd.util.testing.assert_frame_equal(df.sort_index(), reader.parquet().sort_index())
+        assert reader.parquet(partitions={"date": "2017-01-02"})["foo"].tolist() == [0, 2]
+        assert reader.parquet(partitions={"date": ["2017-01-01", "2017-01-03"]})["foo"].tolist() == [1, 3]
+        assert reader.parquet(partitions=lambda p: p["date"] >= "2017-01-02")["foo"].tolist() == [0, 2, 3]
+        assert list(reader.parquet(partitions={"date": "2018-01-01"}).columns) == ["date", "foo"]
+
+
+    def test_parquet_partitioned_rejects_null_partition_values(self, tmpdir):
+        io_factory = LocalIoFactory(tmpdir.join("output.pq").strpath)
+
+        df = pd.DataFrame({"date": ["2017-01-02", None], "foo": [0, 1]})
+
+        with pytest.raises(ValueError):
+            with DatasetWriter(io_factory, lambda x: None, None) as f:
+                f.parquet(df, partition_by="date")
+
+
     def test_parquet_with_mixed_type_columns(self, tmpdir):
         path = tmpdir.join("output.pq")
         io_factory = LocalIoFactory(path)
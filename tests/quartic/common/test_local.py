@@ -0,0 +1,197 @@
+import os
+import pandas as pd
+import pytest
+from quartic.common.quartic import Quartic
+from quartic.common.local import LocalCatalogue, LocalHowl
+from quartic.common.io import AtomicFile
+from quartic.common.exceptions import QuarticException
+
+
+class TestLocalQuartic:
+    def test_round_trips_dataset(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo", "bar") as f:
+            f.json({"hello": "€10"})
+
+        assert dataset.reader().json() == {"hello": "€10"}
+        assert dataset.metadata()["name"] == "foo"
+        assert dataset.metadata()["description"] == "bar"
+
+    def test_records_format_in_locator(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo", "bar") as f:
+            f.json({"hello": "€10"})
+        assert _locator(tmpdir, "my-dataset")["mime_type"] == "application/json"
+
+        with dataset.writer("foo", "bar") as f:
+            f.arrow_ipc(pd.DataFrame({"foo": [0, 1, 2]}))
+        assert _locator(tmpdir, "my-dataset")["mime_type"] == "application/vnd.apache.arrow.file"
+
+    def test_drops_stats_when_rewritten_without_any(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo", "bar") as f:
+            f.parquet(pd.DataFrame({"foo": [0, 1, 2]}))
+        assert dataset.extensions()["stats"]["num_rows"] == 3
+
+        with dataset.writer() as f:
+            f.json({"hello": "€10"})
+        assert "stats" not in dataset.extensions()
+
+    def test_round_trips_partitioned_dataset(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+        df = pd.DataFrame({"date": ["2017-01-02", "2017-01-01"], "foo": [0, 1]})
+
+        with dataset.writer("foo", "bar") as f:
+            f.parquet(df, partition_by=["date"])
+
+        assert dataset.extensions()["stats"]["num_rows"] == 2
+        reader = dataset.reader()
+        assert reader.partitions() == [{"date": "2017-01-01"}, {"date": "2017-01-02"}]
+        assert reader.parquet(partitions={"date": "2017-01-01"})["foo"].tolist() == [1]
+
+        # Rewriting without partitions supersedes the manifest
+        with dataset.writer() as f:
+            f.parquet(df)
+        assert dataset.reader().partitions() == []
+
+    def test_round_trips_anonymous_dataset(self, tmpdir):
+        namespace = Quartic.local(tmpdir.strpath)("yeah")
+        dataset = namespace.dataset(None)
+
+        with dataset.writer("foo") as f:
+            f.write(b"some bytes")
+
+        [dataset_id] = LocalCatalogue(tmpdir.strpath).datasets()["yeah"].keys()
+        assert namespace.dataset(dataset_id).reader().raw().read() == b"some bytes"
+
+    def test_keeps_partitions_apart_from_datasets_with_similar_ids(self, tmpdir):
+        namespace = Quartic.local(tmpdir.strpath)("yeah")
+        df = pd.DataFrame({"date": ["2017-01-01"], "foo": [0]})
+        with namespace.dataset("my-dataset").writer("foo", "bar") as f:
+            f.parquet(df, partition_by=["date"])
+
+        with namespace.dataset("my-dataset/date=2017-01-01").writer("foo", "bar") as f:
+            f.json({})
+
+        assert namespace.dataset("my-dataset").reader().parquet()["foo"].tolist() == [0]
+
+    def test_rewrites_existing_dataset(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo") as f:
+            f.write(b"first")
+        with dataset.writer(description="updated") as f:
+            f.write(b"second")
+
+        assert dataset.reader().raw().read() == b"second"
+        assert dataset.metadata()["description"] == "updated"
+
+    def test_skips_rewrite_if_unchanged(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+        df = pd.DataFrame({"date": ["2017-01-02", "2017-01-01"], "foo": [0, 1]})
+
+        with dataset.writer("foo") as f:
+            f.parquet(df, partition_by="date")
+        registered = dataset.metadata()["registered"]
+
+        with dataset.writer("foo") as f:
+            f.parquet(df, partition_by="date")
+        assert f.unchanged()
+        assert dataset.metadata()["registered"] == registered
+
+        with dataset.writer("foo") as f:
+            f.parquet(df.assign(foo=[0, 2]), partition_by="date")
+        assert not f.unchanged()
+        assert dataset.metadata()["registered"] != registered
+        assert dataset.reader().parquet()["foo"].tolist() == [2, 0]
+
+    def test_leaves_previous_content_if_write_fails(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo") as f:
+            f.write(b"first")
+        with pytest.raises(RuntimeError):
+            with dataset.writer() as f:
+                f.write(b"second")
+                raise RuntimeError("Oh no")
+
+        assert dataset.reader().raw().read() == b"first"
+
+    def test_deletes_dataset(self, tmpdir):
+        dataset = Quartic.local(tmpdir.strpath)("yeah").dataset("my-dataset")
+
+        with dataset.writer("foo") as f:
+            f.write(b"first")
+        dataset.delete()
+
+        with pytest.raises(QuarticException):
+            dataset.reader()
+
+
+def _locator(tmpdir, dataset_id):
+    return LocalCatalogue(tmpdir.strpath).get("yeah", dataset_id)["locator"]
+
+
+class TestLocalCatalogue:
+    def test_lists_datasets(self, tmpdir):
+        catalogue = LocalCatalogue(tmpdir.strpath)
+
+        catalogue.put("yeah", "dataset/id", {"metadata": {"name": "foo"}})
+
+        datasets = catalogue.datasets()
+        assert list(datasets.keys()) == ["yeah"]
+        assert datasets["yeah"]["dataset/id"]["metadata"]["name"] == "foo"
+        assert "registered" in datasets["yeah"]["dataset/id"]["metadata"]
+
+    def test_put_fails_if_overwrite_would_modify(self, tmpdir):
+        catalogue = LocalCatalogue(tmpdir.strpath)
+
+        catalogue.put("yeah", "dataset-id", {"metadata": {"name": "foo"}})
+
+        catalogue.put("yeah", "dataset-id", {"metadata": {"name": "foo"}})
+        with pytest.raises(QuarticException):
+            catalogue.put("yeah", "dataset-id", {"metadata": {"name": "bar"}})
+        catalogue.put("yeah", "dataset-id", {"metadata": {"name": "bar"}}, overwrite=True)
+
+        assert catalogue.get("yeah", "dataset-id")["metadata"]["name"] == "bar"
+
+    def test_returns_none_if_dataset_non_existent(self, tmpdir):
+        assert LocalCatalogue(tmpdir.strpath).get("yeah", "dataset-id") is None
+
+
+class TestLocalHowl:
+    def test_uploads_and_downloads(self, tmpdir):
+        howl = LocalHowl(tmpdir.strpath)
+        path = howl.path("yeah", "but/no")
+
+        assert not howl.exists_path(path)
+        howl.upload_path(path, "Hello world!")
+
+        assert howl.exists_path(path)
+        assert howl.download_path(path).text == "Hello world!"
+
+    def test_rejects_paths_escaping_root(self, tmpdir):
+        with pytest.raises(QuarticException):
+            LocalHowl(tmpdir.strpath).upload_path("/yeah/managed/yeah/..", "Hello world!")
+
+
+class TestAtomicFile:
+    def test_only_visible_after_close(self, tmpdir):
+        path = tmpdir.join("output.bin").strpath
+
+        f = AtomicFile(path)
+        f.write(b"hello")
+        assert not os.path.exists(path)
+        f.close()
+
+        assert open(path, "rb").read() == b"hello"
+
+    def test_cancel_leaves_no_trace(self, tmpdir):
+        f = AtomicFile(tmpdir.join("output.bin").strpath)
+        f.write(b"hello")
+        f.cancel()
+
+        assert tmpdir.listdir() == []
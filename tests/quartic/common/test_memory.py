@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+from quartic.common.memory import MemoryStore
+from quartic.common.exceptions import QuarticException
+
+
+def write(method, value, *args, **kwargs):
+    dataset = MemoryStore().dataset("my-dataset")
+    with dataset.writer("foo", "bar") as w:
+        getattr(w, method)(value, *args, **kwargs)
+    return dataset
+
+
+class TestMemoryDataset:
+    def test_keeps_a_copy_of_what_was_written(self):
+        df = pd.DataFrame({"foo": [0, 1, 2]})
+        dataset = write("parquet", df)
+
+        df["foo"] += 1
+
+        assert dataset.reader().parquet()["foo"].tolist() == [0, 1, 2]
+
+    def test_applies_column_options_to_csv(self):
+        dataset = write("csv", pd.DataFrame({"foo": [0, 1], "bar": ["a", "b"], "baz": [2, 3]},
+                                            columns=["foo", "bar", "baz"]))
+
+        df = dataset.reader().csv(usecols=["foo", "baz"], dtype={"foo": "float64", "bar": str})
+
+        assert list(df.columns) == ["foo", "baz"]
+        assert df["foo"].dtype == "float64"
+
+    def test_rejects_csv_options_it_cant_honour(self):
+        dataset = write("csv", pd.DataFrame({"foo": [0, 1]}))
+
+        with pytest.raises(QuarticException) as excinfo:
+            dataset.reader().csv(skiprows=1)
+        assert "skiprows" in str(excinfo.value)
+        with pytest.raises(QuarticException) as excinfo:
+            dataset.reader().head(sep="|")
+        assert "sep" in str(excinfo.value)
+
+    def test_compacts(self):
+        dataset = write("parquet", pd.DataFrame({"foo": [0, 1, 2]}))
+        reader = dataset.reader()
+
+        df = reader.parquet(compact=True)
+
+        assert df["foo"].dtype == "uint8"
+        assert reader.memory_report["columns"]["foo"] == {"from": "int64", "to": "uint8"}
+        assert dataset.reader().parquet()["foo"].dtype == "int64"
+
+    def test_selects_partitions(self):
+        df = pd.DataFrame({"date": ["2017-01-02", "2017-01-01", "2017-01-02"], "foo": [0, 1, 2]})
+        reader = write("parquet", df, partition_by="date").reader()
+
+        assert reader.partitions() == [{"date": "2017-01-01"}, {"date": "2017-01-02"}]
+        assert reader.parquet(partitions={"date": "2017-01-02"})["foo"].tolist() == [0, 2]
+        assert reader.parquet(partitions=lambda values: False).empty
+        with pytest.raises(QuarticException):
+            write("parquet", df).reader().parquet(partitions={"date": "2017-01-02"})
+
+    def test_gives_raw_content_as_written(self):
+        assert write("json", {"hello": "€10"}).reader().raw().read() == '{"hello": "\\u20ac10"}'.encode()
+        assert write("csv", pd.DataFrame({"foo": [0, 1]}), index=False).reader().raw().read() == b"foo\n0\n1\n"
+        raw = write("parquet", pd.DataFrame({"foo": [0, 1]})).reader().raw().read()
+        assert raw[:4] == b"PAR1"
@@ -0,0 +1,77 @@
+import json
+from quartic.common.metrics import Histogram, Metrics
+
+
+class TestHistogram:
+    def test_counts_observations_into_buckets(self):
+        h = Histogram(buckets=(0.1, 1.0))
+
+        h.observe(0.05)
+        h.observe(0.5)
+        h.observe(0.7)
+        h.observe(5.0)
+
+        assert h.counts == [1, 2, 1]
+        assert h.count == 4
+        assert list(h.cumulative()) == [(0.1, 1), (1.0, 3), (float("inf"), 4)]
+
+
+class TestMetrics:
+    def test_aggregates_requests_per_endpoint(self):
+        metrics = Metrics()
+
+        metrics.record_request("howl", "GET", "/a", 200, 0.0, 0.5, bytes_received=10)
+        metrics.record_request("howl", "GET", "/a", 404, 1.0, 1.25, bytes_received=5, retries=2)
+        metrics.record_request("catalogue", "PUT", "/b", None, 2.0, 2.1, bytes_sent=7)
+
+        requests = metrics.to_dict()["requests"]
+        assert [(r["service"], r["method"], r["endpoint"]) for r in requests] == [
+            ("catalogue", "PUT", "/b"),
+            ("howl", "GET", "/a"),
+        ]
+        assert requests[0]["status_codes"] == {"error": 1}
+        assert requests[0]["bytes_sent"] == 7
+        assert requests[1]["status_codes"] == {"200": 1, "404": 1}
+        assert requests[1]["bytes_received"] == 15
+        assert requests[1]["retries"] == 2
+        assert requests[1]["latency"]["count"] == 2
+        assert requests[1]["latency"]["sum"] == 0.75
+
+    def test_exports_prometheus_text(self):
+        metrics = Metrics(buckets=(1.0,))
+
+        metrics.record_request("howl", "GET", "/a", 200, 0.0, 0.5, bytes_received=10)
+
+        lines = metrics.to_prometheus().splitlines()
+        assert "# TYPE quartic_request_duration_seconds histogram" in lines
+        assert "quartic_request_duration_seconds_bucket{service=\"howl\",method=\"GET\",endpoint=\"/a\",le=\"1.0\"} 1" \
+            in lines
+        assert "quartic_request_duration_seconds_bucket{service=\"howl\",method=\"GET\",endpoint=\"/a\"," \
+            "le=\"+Inf\"} 1" in lines
+        assert "quartic_requests_total{service=\"howl\",method=\"GET\",endpoint=\"/a\",status=\"200\"} 1" in lines
+        assert "quartic_request_bytes_received_total{service=\"howl\",method=\"GET\",endpoint=\"/a\"} 10" in lines
+
+    def test_nests_request_spans_under_enclosing_span(self):
+        metrics = Metrics()
+
+        with metrics.span("step", step_id="123"):
+            metrics.record_request("howl", "GET", "/a", 200, 0.0, 0.5)
+        metrics.record_request("howl", "GET", "/a", 200, 1.0, 1.5)
+
+        request_span, step_span, orphan_span = metrics.spans()
+        assert step_span["name"] == "step"
+        assert step_span["attributes"] == {"step_id": "123"}
+        assert request_span["name"] == "GET /a"
+        assert request_span["parent_span_id"] == step_span["span_id"]
+        assert orphan_span["parent_span_id"] is None
+
+    def test_writes_json(self, tmpdir):
+        path = tmpdir.join("metrics.json").strpath
+        metrics = Metrics()
+        metrics.record_request("howl", "GET", "/a", 200, 0.0, 0.5)
+
+        metrics.write_json(path)
+
+        blob = json.load(open(path))
+        assert len(blob["requests"]) == 1
+        assert len(blob["spans"]) == 1
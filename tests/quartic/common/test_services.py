@@ -3,6 +3,7 @@ import responses
 import pytest
 from quartic.common.services import Service, Howl, Catalogue
 from quartic.common.exceptions import QuarticException
+from quartic.common.metrics import Metrics
 
 
 API_ROOT = "http://quartic/api/"
@@ -69,6 +70,24 @@ class TestService:
         assert self.service.invoke(method, allow_404=True) is None
 
 
+    @responses.activate
+    def test_records_metrics_if_enabled(self):
+        metrics = Metrics()
+        service = Catalogue(api_root=API_ROOT, bearer_token="my-token", metrics=metrics)
+        responses.add(responses.GET, _url("datasets/my-namespace/dataset-id"), body="12345")
+        responses.add(responses.GET, _url("datasets/my-namespace/other-id"), status=404)
+
+        service.get("my-namespace", "dataset-id")
+        service.get("my-namespace", "other-id")
+
+        [stats] = metrics.to_dict()["requests"]
+        assert stats["service"] == "catalogue"
+        assert stats["method"] == "GET"
+        assert stats["endpoint"] == "/datasets/{namespace}/{dataset_id}"
+        assert stats["status_codes"] == {"200": 1, "404": 1}
+        assert stats["bytes_received"] == 5
+
+
 class TestHowl:
     howl = Howl(api_root=API_ROOT, bearer_token="my-token")
 
@@ -97,6 +116,19 @@ class TestHowl:
         r = self.howl.download_path(self.howl.path("yeah", "key"))
         assert r.text == "Hello world!"
 
+    @responses.activate
+    def test_gets_range_of_content(self):
+        responses.add(responses.GET, _url("yeah/managed/yeah/key"), body="world", status=206)
+
+        assert self.howl.download_range(self.howl.path("yeah", "key"), 6, 10) == b"world"
+        assert responses.calls[0].request.headers["Range"] == "bytes=6-10"
+
+    @responses.activate
+    def test_gets_no_range_if_server_sends_everything(self):
+        responses.add(responses.GET, _url("yeah/managed/yeah/key"), body="Hello world!")
+
+        assert self.howl.download_range(self.howl.path("yeah", "key"), 6, 10) is None
+
     @responses.activate
     def test_puts_content_if_key_specified(self):
         responses.add(responses.PUT, _url("yeah/managed/yeah/key"))
@@ -0,0 +1,19 @@
+import os.path
+import pytest
+
+
+@pytest.fixture
+def write_package(tmpdir):
+    """Writes (or updates) the package of the given name under tmpdir, from a dict of sources keyed by path within
+    it, returning its directory.  The package's own __init__.py is added if missing."""
+    def write(name, modules):
+        package_dir = os.path.join(str(tmpdir), name)
+        if not os.path.exists(os.path.join(package_dir, "__init__.py")):
+            modules = dict({"__init__.py": ""}, **modules)
+        for path, source in modules.items():
+            path = os.path.join(package_dir, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(source)
+        return package_dir
+    return write
@@ -0,0 +1,65 @@
+import os.path
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from quartic.common.utils import get_pipeline_from_args
+from quartic.dsl.context import DslContext
+
+resources_dir = "tests/resources"
+
+
+class TestDslContext:
+    def test_requires_an_open_context(self):
+        with pytest.raises(ValueError):
+            DslContext.register("a")
+
+    def test_nested_contexts(self):
+        with DslContext() as outer:
+            DslContext.register("a")
+            with DslContext() as inner:
+                DslContext.register("b")
+            DslContext.register("c")
+        assert outer.nodes() == ["a", "c"]
+        assert inner.nodes() == ["b"]
+
+    def test_take_returns_nodes_registered_since_last_taken(self):
+        with DslContext() as context:
+            DslContext.register("a")
+            assert context.take() == ["a"]
+            DslContext.register("b")
+            assert context.take() == ["b"]
+        assert context.nodes() == []
+
+    def test_contexts_are_local_to_threads(self):
+        barrier = threading.Barrier(2)
+        contexts = {}
+
+        def register(name):
+            with DslContext() as context:
+                barrier.wait()  # Both open at once
+                DslContext.register(name)
+                barrier.wait()
+            contexts[name] = context
+
+        threads = [threading.Thread(target=register, args=(name,)) for name in ["a", "b"]]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert {name: context.nodes() for name, context in contexts.items()} == {"a": ["a"], "b": ["b"]}
+
+    def test_isolated_evaluations_run_concurrently(self):
+        dirs = [os.path.join(resources_dir, dag) for dag in ["good_dag", "failing_dag", "import_dag"]] * 4
+
+        def evaluate(package_dir):
+            return [node.to_dict() for node in get_pipeline_from_args([package_dir], isolated=True)]
+
+        before = set(sys.modules)
+        expected = [evaluate(d) for d in dirs]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            assert list(executor.map(evaluate, dirs)) == expected
+
+        assert len(expected[2]) == 1    # Nodes imported from import_dag.sub.dag, every time
+        left = {name.split(".")[0] for name in set(sys.modules) - before}
+        assert not left & {"good_dag", "failing_dag", "import_dag", "main"}
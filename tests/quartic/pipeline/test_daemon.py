@@ -0,0 +1,66 @@
+import io
+import json
+import os.path
+from quartic.pipeline.runner.daemon import Daemon
+
+resources_dir = "tests/resources"
+
+
+class TestDaemon:
+    def setup_method(self, method):
+        # pylint: disable=attribute-defined-outside-init
+        self.daemon = Daemon([os.path.join(resources_dir, "good_dag")])
+
+    def test_executes_requests_in_children(self, tmpdir):
+        output_path = os.path.join(tmpdir, "steps.json")
+        exception_path = os.path.join(tmpdir, "exception.json")
+        self.daemon.handle({"argv": ["--evaluate", output_path]})
+        nodes = json.load(open(output_path))["nodes"]
+
+        requests = "\n".join(json.dumps({"id": i, "argv": [
+            "--execute", step_id,
+            "--namespace", "test",
+            "--api-token", "my-special-token",
+            "--exception", exception_path]}) for i, step_id in enumerate([nodes[0]["id"], "nope"]))
+        out = io.StringIO()
+        self.daemon.serve(io.StringIO(requests), out)
+
+        assert [json.loads(line) for line in out.getvalue().splitlines()] == [
+            {"id": 0, "exit_code": 0},
+            {"id": 1, "exit_code": 2},
+        ]
+        assert json.load(open(exception_path))["type"] == "NoMatchingStepsException"
+
+    def test_rejects_malformed_requests(self):
+        assert "error" in self.daemon.respond("{nope")
+        assert "error" in self.daemon.respond("[]")
+        assert self.daemon.respond(json.dumps({"id": 3, "argv": "--help"}))["id"] == 3
+        assert "error" in self.daemon.respond(json.dumps({"id": 3}))
+
+    def test_reports_invalid_pipelines(self, tmpdir, write_package):
+        daemon = Daemon([write_package("colliding_dag", {"colliding.py": COLLIDING_PIPELINE})])
+        exception_path = os.path.join(str(tmpdir), "exception.json")
+
+        response = daemon.handle({"argv": [
+            "--execute", ",".join(step.get_id() for step in daemon._steps),   # pylint: disable=protected-access
+            "--namespace", "test",
+            "--api-token", "my-special-token",
+            "--exception", exception_path]})
+
+        assert response["exit_code"] == 2
+        exception = json.load(open(exception_path))
+        assert exception["type"] == "QuarticException"
+        assert "multiple steps" in exception["message"]
+
+
+COLLIDING_PIPELINE = """
+from quartic import step, writer
+
+@step
+def x() -> "b":
+    return writer("B", "B").json({})
+
+@step
+def y(_: "a") -> "b":
+    return writer("B", "B").json({})
+"""
@@ -0,0 +1,91 @@
+import json
+import os.path
+from quartic.common import utils
+from quartic.pipeline.runner.evaluate_cache import EvaluateCache
+
+STEP = """
+@step
+def {name}(_: "{input}") -> "{output}":
+    "A step"
+    pass
+"""
+
+
+class TestEvaluateCache:
+    def test_matches_cold_evaluation(self, tmpdir, write_package):
+        package_dir = write_package("cache_dag_basic", _modules("cache_dag_basic"))
+        cache = EvaluateCache(os.path.join(str(tmpdir), "cache"))
+
+        assert _evaluate(cache, package_dir) == _cold(package_dir)
+        assert (cache.hits, cache.misses) == (0, 3)
+
+    def test_reuses_unchanged_modules(self, tmpdir, write_package):
+        package_dir = write_package("cache_dag_reuse", _modules("cache_dag_reuse"))
+        cache_dir = os.path.join(str(tmpdir), "cache")
+        _evaluate(EvaluateCache(cache_dir), package_dir)
+
+        write_package("cache_dag_reuse", {"b.py": _steps("b", "input_b", "output_b2")})
+        cache = EvaluateCache(cache_dir)
+        assert _evaluate(cache, package_dir) == _cold(package_dir)
+        assert (cache.hits, cache.misses) == (2, 1)
+
+        cache = EvaluateCache(cache_dir)
+        _evaluate(cache, package_dir)
+        assert (cache.hits, cache.misses) == (3, 0)
+
+    def test_invalidates_entries_from_other_quartic_versions(self, tmpdir, write_package, monkeypatch):
+        package_dir = write_package("cache_dag_version", _modules("cache_dag_version"))
+        cache_dir = os.path.join(str(tmpdir), "cache")
+        _evaluate(EvaluateCache(cache_dir), package_dir)
+
+        monkeypatch.setattr("quartic.pipeline.runner.evaluate_cache.__version__", "0.0.0-other")
+        cache = EvaluateCache(cache_dir)
+        _evaluate(cache, package_dir)
+        assert (cache.hits, cache.misses) == (0, 3)
+
+    def test_invalidates_modules_whose_imports_change(self, tmpdir, write_package):
+        package_dir = write_package("cache_dag_imports", _modules("cache_dag_imports"))
+        cache_dir = os.path.join(str(tmpdir), "cache")
+        _evaluate(EvaluateCache(cache_dir), package_dir)
+
+        write_package("cache_dag_imports", {"shared/steps.py": _steps("shared", "input_s", "output_s2")})
+        cache = EvaluateCache(cache_dir)
+        assert _evaluate(cache, package_dir) == _cold(package_dir)
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_modules_sharing_imports_match_cold_evaluation_when_changed_alone(self, tmpdir, write_package):
+        # Only the first module to import shared registers its steps, so b's entry depends on a having done so
+        package_dir = write_package("cache_dag_shared", _modules("cache_dag_shared"))
+        cache_dir = os.path.join(str(tmpdir), "cache")
+        _evaluate(EvaluateCache(cache_dir), package_dir)
+
+        write_package("cache_dag_shared", {
+            "b.py": "from cache_dag_shared.shared.steps import *\n" + _steps("b", "input_b", "output_b2")})
+        assert _evaluate(EvaluateCache(cache_dir), package_dir) == _cold(package_dir)
+
+        write_package("cache_dag_shared", {"a.py": _steps("a", "input_a", "output_a2")})
+        cache = EvaluateCache(cache_dir)
+        assert _evaluate(cache, package_dir) == _cold(package_dir)
+        assert cache.misses == 2    # b now registers the shared steps itself
+
+
+def _modules(name):
+    return {
+        "a.py": "from {}.shared.steps import *\n".format(name) + _steps("a", "input_a", "output_a"),
+        "b.py": _steps("b", "input_b", "output_b"),
+        "shared/__init__.py": "",
+        "shared/steps.py": _steps("shared", "input_s", "output_s"),
+    }
+
+
+def _steps(name, input_name, output_name):
+    return "from quartic import step\n" + STEP.format(name=name, input=input_name, output=output_name)
+
+
+def _cold(package_dir):
+    nodes = utils.get_pipeline_from_args([package_dir], isolated=True)
+    return json.loads(json.dumps([node.to_dict() for node in nodes]))
+
+
+def _evaluate(cache, package_dir):
+    return json.loads(json.dumps(cache.evaluate([package_dir])))
@@ -0,0 +1,70 @@
+import json
+import os.path
+from quartic.common import utils
+from quartic.pipeline.runner.evaluate_cache import EvaluateCache
+from quartic.pipeline.runner.loader import evaluate_in_processes, module_groups
+
+STEP = """from quartic import step
+
+@step
+def {name}(_: "{name}_input") -> "{name}_output":
+    pass
+"""
+
+
+def _modules(name):
+    return {
+        "a.py": "from {}.shared.steps import *\n".format(name) + STEP.format(name="a"),
+        "b.py": STEP.format(name="b"),
+        "shared/__init__.py": "",
+        "shared/steps.py": STEP.format(name="shared"),
+        "deep/__init__.py": "",
+        "deep/inner/__init__.py": "",
+        "deep/inner/leaf.py": STEP.format(name="leaf"),
+    }
+
+
+def _names(nodes):
+    return [node["info"]["name"] for node in nodes]
+
+
+def _sequential(package_dir, recursive):
+    nodes = utils.get_pipeline_from_args([package_dir], isolated=True, recursive=recursive)
+    return json.loads(json.dumps([node.to_dict() for node in nodes]))
+
+
+class TestLoader:
+    def test_finds_nested_modules(self, write_package):
+        package_dir = write_package("loader_nested", _modules("loader_nested"))
+        assert utils.nested_module_names(package_dir) == [
+            "loader_nested.deep.inner", "loader_nested.deep.inner.leaf", "loader_nested.shared.steps"]
+        assert [os.path.relpath(f, package_dir) for f in utils.find_python_files(package_dir, recursive=True)] == [
+            "__init__.py", "a.py", "b.py", "deep/__init__.py", "deep/inner/__init__.py", "deep/inner/leaf.py",
+            "shared/__init__.py", "shared/steps.py"]
+        assert [os.path.relpath(f, package_dir) for f in utils.find_python_files(package_dir)] == [
+            "__init__.py", "a.py", "b.py"]
+
+    def test_recursive_loading(self, write_package):
+        package_dir = write_package("loader_recursive", _modules("loader_recursive"))
+        assert _names(_sequential(package_dir, False)) == ["shared", "a", "b"]
+        assert _names(_sequential(package_dir, True)) == ["shared", "a", "b", "leaf"]
+
+    def test_groups_modules_sharing_imports(self, write_package):
+        package_dir = write_package("loader_groups", _modules("loader_groups"))
+        assert module_groups(package_dir) == [["a", "shared"], ["b"], ["deep"]]
+        assert module_groups(package_dir, recursive=True) == [
+            ["a", "shared", "loader_groups.shared.steps"],
+            ["b"],
+            ["deep", "loader_groups.deep.inner", "loader_groups.deep.inner.leaf"]]
+
+    def test_parallel_evaluation_matches_sequential(self, write_package):
+        package_dir = write_package("loader_parallel", _modules("loader_parallel"))
+        for recursive in [False, True]:
+            expected = _sequential(package_dir, recursive)
+            assert json.loads(json.dumps(evaluate_in_processes([package_dir], 2, recursive))) == expected
+
+    def test_cached_recursive_evaluation_matches_sequential(self, tmpdir, write_package):
+        package_dir = write_package("loader_cached", _modules("loader_cached"))
+        for _ in range(2):
+            nodes = EvaluateCache(os.path.join(str(tmpdir), "cache")).evaluate([package_dir], recursive=True)
+            assert json.loads(json.dumps(nodes)) == _sequential(package_dir, True)
@@ -0,0 +1,41 @@
+import io
+import json
+from quartic.pipeline.runner import manifest
+
+
+def _node(node_id, name, line_range=(1, 2)):
+    return {"id": node_id, "info": {"name": name, "line_range": line_range}}
+
+
+class TestManifest:
+    def test_write_nodes_streams_the_same_document(self):
+        nodes = [_node("1", "a"), _node("2", "b")]
+        for indent in [None, 1]:
+            f = io.StringIO()
+            manifest.write_nodes(iter(nodes), f, indent)
+            assert json.loads(f.getvalue()) == json.loads(json.dumps({"nodes": nodes}))
+
+    def test_delta(self):
+        base = json.loads(json.dumps([_node("1", "a"), _node("2", "b"), _node("3", "c")]))
+        nodes = [_node("1", "a"), _node("2", "b2"), _node("4", "d")]
+
+        d = manifest.delta(base, nodes, "sha256:abc")
+        assert d == {
+            "base": "sha256:abc",
+            "added": [_node("4", "d", [1, 2])],
+            "removed": ["3"],
+            "changed": [_node("2", "b2", [1, 2])]
+        }
+        assert sorted(n["id"] for n in manifest.apply_delta(base, d)) == ["1", "2", "4"]
+        assert manifest.apply_delta(base, d)[1]["info"]["name"] == "b2"
+
+    def test_delta_lists_every_node_sharing_a_changed_id(self):
+        base = [_node("1", "a"), _node("1", "b")]
+        d = manifest.delta(base, [_node("1", "a")])
+        assert d["changed"] == [_node("1", "a", [1, 2])]
+        assert manifest.apply_delta(base, d) == [_node("1", "a", [1, 2])]
+
+    def test_empty_delta(self):
+        nodes = [_node("1", "a")]
+        assert manifest.delta(json.loads(json.dumps(nodes)), nodes) == \
+            {"base": None, "added": [], "removed": [], "changed": []}
@@ -2,12 +2,22 @@ import json
 import os.path
 import pytest
 from mock import Mock, MagicMock
-from quartic.common.exceptions import QuarticException, UserCodeExecutionException
+from quartic.common.exceptions import (
+    BatchExecutionException,
+    MultipleMatchingStepsException,
+    QuarticException,
+    StepIdCollisionException,
+    UserCodeExecutionException,
+)
 from quartic import step
 from quartic.dsl.node import Node
+from quartic.dsl.step import StepExecutor
 from quartic.common.dataset import Dataset, writer
+from quartic.pipeline.runner import cli
 from quartic.pipeline.runner.cli import main, parse_args
 from quartic.dsl.context import DslContext
+from quartic.dsl.raw import raw, FromBucket
+from quartic.common.quartic import Quartic
 
 resources_dir = "tests/resources"
 
@@ -70,6 +80,37 @@ class TestCli:
         }
 
 
+    def test_evaluate_with_cache(self, tmpdir):
+        outputs = []
+        cache_dir = os.path.join(str(tmpdir), "cache")
+        for cache_args in [[], ["--evaluate-cache", cache_dir]] * 2 + [["--load-workers", "2"]]:
+            output_path = os.path.join(str(tmpdir), "steps.json")
+            main(parse_args(["--evaluate", output_path] + cache_args + [os.path.join(resources_dir, "good_dag")]))
+            outputs.append(open(output_path).read())
+        assert len(set(outputs)) == 1
+        assert os.listdir(os.path.join(str(tmpdir), "cache"))
+
+
+    def test_evaluate_compact_and_against_base(self, tmpdir):
+        base_path = os.path.join(str(tmpdir), "base.json")
+        main(parse_args(["--evaluate", base_path, os.path.join(resources_dir, "good_dag")]))
+        output_path = os.path.join(str(tmpdir), "steps.json")
+        main(parse_args(["--evaluate", output_path, "--compact", os.path.join(resources_dir, "good_dag")]))
+        assert json.load(open(output_path)) == json.load(open(base_path))
+        assert "\n" not in open(output_path).read()
+
+        base = json.load(open(base_path))
+        removed = base["nodes"].pop()
+        base["nodes"][0]["info"]["description"] = "Changed"
+        json.dump(base, open(base_path, "w"))
+        main(parse_args(["--evaluate", output_path, "--base", base_path, os.path.join(resources_dir, "good_dag")]))
+
+        delta = json.load(open(output_path))
+        assert delta["base"].startswith("sha256:")
+        assert [node["id"] for node in delta["added"]] == [removed["id"]]
+        assert [node["info"]["description"] for node in delta["changed"]] == ["First step"]
+        assert delta["removed"] == []
+
     def test_execute_step(self, tmpdir):
         output_path = os.path.join(tmpdir, "steps.json")
         args = parse_args(["--evaluate", output_path, os.path.join(resources_dir, "good_dag")])
@@ -84,6 +125,154 @@ class TestCli:
         main(args)
 
 
+    def test_execute_multiple_steps(self, tmpdir, monkeypatch):
+        output_path = os.path.join(tmpdir, "steps.json")
+        main(parse_args(["--evaluate", output_path, os.path.join(resources_dir, "good_dag")]))
+        nodes = json.load(open(output_path))["nodes"]
+
+        ids_path = os.path.join(tmpdir, "ids.txt")
+        with open(ids_path, "w") as f:
+            f.write("\n".join(node["id"] for node in reversed(nodes)))
+
+        executed = []
+        execute = StepExecutor.execute
+        def recording_execute(self, context, inputs, output, func):
+            executed.append(func.__name__)
+            return execute(self, context, inputs, output, func)
+        monkeypatch.setattr(StepExecutor, "execute", recording_execute)
+
+        for execute_args in [["--execute", ",".join(node["id"] for node in nodes)], ["--execute-file", ids_path]]:
+            del executed[:]
+            main(parse_args(execute_args + [
+                "--namespace", "test",
+                "--api-token", "my-special-token",
+                os.path.join(resources_dir, "good_dag")]))
+            # In dependency order, whatever order they were given in
+            assert executed == ["step1", "step2"]
+
+
+    def test_execute_multiple_steps_records_failures_and_carries_on(self, tmpdir):
+        output_path = os.path.join(tmpdir, "steps.json")
+        main(parse_args(["--evaluate", output_path, os.path.join(resources_dir, "failing_dag")]))
+        ids = {node["info"]["name"]: node["id"] for node in json.load(open(output_path))["nodes"]}
+
+        args = parse_args([
+            "--execute", ",".join([ids["step2"], ids["step3"], ids["step1"]]),
+            "--namespace", "test",
+            "--api-token", "my-special-token",
+            os.path.join(resources_dir, "failing_dag")])
+        with pytest.raises(BatchExecutionException) as excinfo:
+            main(args)
+
+        failures = excinfo.value.failures
+        assert [(f["step_name"], f["status"]) for f in failures] == [("step1", "failed"), ("step2", "skipped")]
+        assert failures[0]["exception"]["exception_type"] == "ValueError"
+        assert failures[1]["failed_dependencies"] == [ids["step1"]]
+        json.dumps(failures)
+
+    def test_execute_multiple_steps_reports_raw_steps_as_not_runnable(self, tmpdir):
+        # pylint: disable=unused-variable
+        with DslContext() as context:
+            @raw
+            def ingest() -> "a":
+                return FromBucket("a.csv")
+
+            @step
+            def b(_: "a") -> "b":
+                return writer("B", "B").json({})
+
+        args = parse_args(["--execute", "x", "--namespace", "test", "--api-token", "my-special-token", "x"])
+        with pytest.raises(BatchExecutionException) as excinfo:
+            cli.execute_batch(context.nodes(), Quartic.local(str(tmpdir)), args, None)
+
+        assert [(f["step_name"], f["status"]) for f in excinfo.value.failures] == [("ingest", "not_runnable")]
+        assert Quartic.local(str(tmpdir))("test").dataset("b").reader().json() == {}
+
+    def test_execute_with_manifest_loads_only_defining_module(self, tmpdir, write_package):
+        package_dir = write_package("manifest_dag", {
+            "good.py": open(os.path.join(resources_dir, "good_dag", "good_dag.py")).read(),
+            "broken.py": "raise ImportError('Should not have been loaded')\n"
+        })
+        output_path = os.path.join(str(tmpdir), "steps.json")
+        with open(output_path, "w") as f:
+            json.dump({"nodes": [_manifest_node(package_dir, "good")]}, f)
+
+        main(parse_args([
+            "--execute", _step_id(package_dir),
+            "--manifest", output_path,
+            "--namespace", "test",
+            "--api-token", "my-special-token",
+            package_dir]))
+
+    @pytest.mark.parametrize("manifest_content", ["stale", "[]", "{nope", None])
+    def test_execute_with_bad_manifest_falls_back_to_loading_everything(self, tmpdir, monkeypatch, manifest_content):
+        output_path = os.path.join(str(tmpdir), "steps.json")
+        main(parse_args(["--evaluate", output_path, os.path.join(resources_dir, "good_dag")]))
+        manifest = json.load(open(output_path))
+        step_id = manifest["nodes"][0]["id"]
+        if manifest_content == "stale":
+            for node in manifest["nodes"]:
+                node["info"]["file"] = os.path.join(resources_dir, "good_dag", "moved.py")
+            manifest_content = json.dumps(manifest)
+        if manifest_content is None:
+            os.remove(output_path)
+        else:
+            with open(output_path, "w") as f:
+                f.write(manifest_content)
+
+        loaded = []
+        load_steps = cli.load_steps_from_manifest
+        def recording_load_steps(manifest_path, pipelines, step_ids):
+            loaded.append(load_steps(manifest_path, pipelines, step_ids))
+            return loaded[-1]
+        monkeypatch.setattr(cli, "load_steps_from_manifest", recording_load_steps)
+        executed = []
+        monkeypatch.setattr(StepExecutor, "execute", lambda self, context, inputs, output, func: executed.append(func))
+
+        main(parse_args([
+            "--execute", step_id,
+            "--manifest", output_path,
+            "--namespace", "test",
+            "--api-token", "my-special-token",
+            os.path.join(resources_dir, "good_dag")]))
+
+        assert loaded == [None]
+        assert [func.__name__ for func in executed] == [manifest["nodes"][0]["info"]["name"]]
+
+    def test_evaluate_rejects_steps_with_colliding_ids(self, tmpdir):
+        package_dir = _package_with_duplicate_steps(tmpdir)
+        with pytest.raises(StepIdCollisionException) as excinfo:
+            main(parse_args(["--evaluate", os.path.join(str(tmpdir), "steps.json"), package_dir]))
+        assert [node["info"]["name"] for node in excinfo.value.steps] == ["first", "second"]
+
+        with pytest.raises(MultipleMatchingStepsException):
+            main(parse_args([
+                "--execute", excinfo.value.step_id,
+                "--namespace", "test",
+                "--api-token", "my-special-token",
+                package_dir]))
+
+
+def _package_with_duplicate_steps(tmpdir):
+    package_dir = os.path.join(str(tmpdir), "duplicate_dag")
+    os.mkdir(package_dir)
+    open(os.path.join(package_dir, "__init__.py"), "w").close()
+    with open(os.path.join(package_dir, "steps.py"), "w") as f:
+        f.write("from quartic import step\n\n"
+                "@step\ndef first(a: 'input') -> 'output':\n    pass\n\n"
+                "@step\ndef second(a: 'input') -> 'output':\n    pass\n")
+    return package_dir
+
+
+def _step_id(package_dir):
+    from quartic.common.utils import get_pipeline_from_args
+    return get_pipeline_from_args([package_dir], {"good"})[0].get_id()
+
+
+def _manifest_node(package_dir, module):
+    return {"id": _step_id(package_dir), "info": {"file": os.path.join(package_dir, module + ".py")}}
+
+
 class TestDataset:
     def test_init(self):
         assert Dataset(42) == Dataset("42")
@@ -177,6 +366,13 @@ class TestWriter:
         dataset.writer.return_value.__enter__.return_value.json.assert_called_with(42)
 
 
+    def test_arrow_ipc(self):
+        dataset = MagicMock()
+        writer("foo", "bar").arrow_ipc(42).apply(dataset)
+
+        dataset.writer.return_value.__enter__.return_value.arrow_ipc.assert_called_with(42)
+
+
 
 class TestStep:
     def setup_method(self, method):
@@ -221,6 +417,37 @@ class TestStep:
         assert "No output" in str(excinfo.value)
 
 
+    def test_reads_annotations_in_signature_order(self):
+        import functools
+
+        def func(a: "a", *b: "b", c: "c", **d: "d") -> "out":
+            pass
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            pass
+
+        with DslContext():
+            for f in [func, wrapper]:
+                assert [str(ds) for ds in step(f).inputs()] == ["::a", "::b", "::c", "::d"]
+
+
+    def test_works_out_lexical_info_lazily(self):
+        import inspect
+        assert self.valid_step._lexical_info is None    # pylint: disable=protected-access
+
+        lines, start = inspect.getsourcelines(self.valid_step._func)    # pylint: disable=protected-access
+        info = self.valid_step.to_dict()["info"]
+        assert info["line_range"] == (start, start + len(lines) - 1)
+        assert info["file"] == os.path.relpath(__file__.replace(".pyc", ".py"))
+        assert not hasattr(self.valid_step, "__dict__")
+
+    def test_id_is_a_sha256_of_its_datasets_worked_out_once(self):
+        step_id = self.valid_step.get_id()
+        assert len(step_id) == 64 and int(step_id, 16) >= 0
+        assert self.valid_step.get_id() is step_id
+
+
     def test_yields_inputs_including_flattened_multi_inputs(self):
         assert list(self.valid_step.inputs()) == [Dataset("foo"), Dataset("bar"), Dataset("bear")]
 
@@ -245,4 +472,4 @@ class TestStep:
 
         assert self.x == "foo"
         assert self.y == {"a": "bar", "b": "bear"}
-        self.writer.apply.assert_called_with("baz")
+        self.writer.apply.assert_called_with("baz", {"fingerprint": None})
@@ -0,0 +1,248 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pytest
+from quartic import step
+from quartic.common.dataset import Dataset, writer
+from quartic.common.exceptions import QuarticException
+from quartic.common.local import LocalCatalogue
+from quartic.common.quartic import Quartic
+from quartic.dsl.context import DslContext
+from quartic.dsl.raw import raw, FromBucket
+from quartic.pipeline.runner import scheduler
+from quartic.pipeline.runner.journal import RunJournal
+
+
+def make_steps():
+    # pylint: disable=unused-variable
+    with DslContext() as context:
+        @raw
+        def ingest() -> "a":
+            return FromBucket("a.csv")
+
+        @step
+        def b(a: "a") -> "b":
+            return writer("B", "B").json({"from": a.metadata()["name"]})
+
+        @step
+        def c(a: "a") -> "c":
+            return writer("C", "C").json({})
+
+        @step
+        def d(b: "b", c: "c") -> "d":
+            return writer("D", "D").json({"b": b.reader().json(), "c": c.reader().json()})
+
+        return context.nodes()
+
+
+def ids(steps):
+    return {s.get_name(): s.get_id() for s in steps}
+
+
+class TestStepDependencies:
+    def test_maps_steps_to_producers_of_their_inputs_skipping_raw(self):
+        steps = make_steps()
+        i = ids(steps)
+
+        assert scheduler.step_dependencies(steps, "test") == {
+            i["b"]: set(),
+            i["c"]: set(),
+            i["d"]: {i["b"], i["c"]}
+        }
+
+    def test_rejects_cycles(self):
+        # pylint: disable=unused-variable
+        with DslContext() as context:
+            @step
+            def x(_: "y") -> "x":
+                pass
+
+            @step
+            def y(_: "x") -> "y":
+                pass
+
+        with pytest.raises(QuarticException):
+            scheduler.step_dependencies(context.objects(), "test")
+
+    @pytest.mark.parametrize("other_output", ["b", Dataset("b", "test")])
+    def test_rejects_outputs_defined_in_multiple_steps(self, other_output):
+        # pylint: disable=unused-variable
+        with DslContext() as context:
+            @step
+            def x() -> other_output:
+                pass
+
+            @step
+            def y(_: "a") -> "b":
+                pass
+
+        with pytest.raises(QuarticException) as excinfo:
+            scheduler.step_dependencies(context.objects(), "test")
+        assert "multiple steps: test::b" in str(excinfo.value)
+
+
+class TestRunSteps:
+    def test_runs_longest_chain_first(self):
+        # a -> b -> c, and d on its own
+        dependencies = {"a": set(), "b": {"a"}, "c": {"b"}, "d": set()}
+        order = []
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            results = scheduler.run_steps(dependencies, order.append, executor, 1)
+
+        assert order == ["a", "b", "c", "d"]
+        assert all(r.status == scheduler.SUCCEEDED for r in results)
+        assert scheduler.critical_path_lengths(dependencies) == {"a": 3, "b": 2, "c": 1, "d": 1}
+
+    def test_weights_critical_path_by_durations(self):
+        dependencies = {"a": set(), "b": {"a"}, "c": {"b"}, "d": set(), "e": set()}
+
+        # e is unknown, so weighted by the mean known duration
+        assert scheduler.critical_path_lengths(dependencies, {"a": 1, "b": 1, "c": 1, "d": 10, "gone": 100}) == {
+            "a": 3, "b": 2, "c": 1, "d": 10, "e": 3.25
+        }
+
+    def test_runs_independent_steps_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = scheduler.run_steps({"a": set(), "b": set()}, lambda _: barrier.wait(), executor, 2)
+
+        assert [r.status for r in results] == [scheduler.SUCCEEDED] * 2
+
+    def test_skips_steps_downstream_of_failure(self):
+        def run_step(step_id):
+            if step_id == "a":
+                raise ValueError("Oh dear")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = scheduler.run_steps(
+                {"a": set(), "b": {"a"}, "c": {"b"}, "d": set()}, run_step, executor, 2)
+
+        statuses = {r.step_id: r.status for r in results}
+        assert statuses == {"a": scheduler.FAILED, "b": scheduler.SKIPPED, "c": scheduler.SKIPPED,
+                            "d": scheduler.SUCCEEDED}
+        assert "Oh dear" in [r for r in results if r.step_id == "a"][0].error
+
+
+class TestRunInThreads:
+    def test_runs_pipeline_against_local_quartic(self, tmpdir):
+        quartic = Quartic.local(tmpdir.strpath)
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({})
+        client_factory = partial(Quartic.local, tmpdir.strpath)
+
+        results = scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4)
+
+        assert [r.status for r in results] == [scheduler.SUCCEEDED] * 3
+        assert quartic("test").dataset("d").reader().json() == {"b": {"from": "A"}, "c": {}}
+        assert "Ran 3 of 3 steps" in scheduler.format_report(results, 1.0)
+
+    def test_hands_intermediates_over_in_memory(self, tmpdir):
+        quartic = Quartic.local(tmpdir.strpath)
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({})
+        client_factory = partial(Quartic.local, tmpdir.strpath)
+
+        results = scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4, persist=[Dataset("c")])
+
+        assert [r.status for r in results] == [scheduler.SUCCEEDED] * 3
+        assert quartic("test").dataset("d").reader().json() == {"b": {"from": "A"}, "c": {}}
+        assert LocalCatalogue(tmpdir.strpath).get("test", "c")["metadata"]["name"] == "C"
+        assert LocalCatalogue(tmpdir.strpath).get("test", "b") is None
+
+    def test_incremental_run_skips_steps_whose_code_and_inputs_are_unchanged(self, tmpdir):
+        quartic = Quartic.local(tmpdir.strpath)
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({})
+        client_factory = partial(Quartic.local, tmpdir.strpath)
+        steps = make_steps()
+
+        def statuses():
+            results = scheduler.run_in_threads(steps, "test", client_factory, max_workers=4, incremental=True)
+            return {r.name: r.status for r in results}
+
+        assert statuses() == {"b": scheduler.SUCCEEDED, "c": scheduler.SUCCEEDED, "d": scheduler.SUCCEEDED}
+        assert statuses() == {"b": scheduler.UP_TO_DATE, "c": scheduler.UP_TO_DATE, "d": scheduler.UP_TO_DATE}
+
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({"changed": True})
+
+        # b and c produce the same content as before, so d is still up to date
+        assert statuses() == {"b": scheduler.SUCCEEDED, "c": scheduler.SUCCEEDED, "d": scheduler.UP_TO_DATE}
+
+    def test_incremental_run_records_no_fingerprint_for_outputs_of_in_memory_inputs(self, tmpdir):
+        quartic = Quartic.local(tmpdir.strpath)
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({})
+        client_factory = partial(Quartic.local, tmpdir.strpath)
+
+        scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4, incremental=True)
+        scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4, persist=[], incremental=True)
+
+        assert "fingerprint" not in LocalCatalogue(tmpdir.strpath).get("test", "d")["extensions"]
+
+    def test_non_incremental_run_clears_fingerprints(self, tmpdir):
+        quartic = Quartic.local(tmpdir.strpath)
+        with quartic("test").dataset("a").writer("A", "A") as w:
+            w.json({})
+        client_factory = partial(Quartic.local, tmpdir.strpath)
+
+        scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4, incremental=True)
+        assert "fingerprint" in LocalCatalogue(tmpdir.strpath).get("test", "d")["extensions"]
+        scheduler.run_in_threads(make_steps(), "test", client_factory, max_workers=4)
+
+        assert "fingerprint" not in LocalCatalogue(tmpdir.strpath).get("test", "d")["extensions"]
+
+
+class TestRunJournal:
+    DEPENDENCIES = {"a": set(), "b": {"a"}, "c": {"b"}, "d": set()}
+
+    def run(self, journal, fail=()):
+        ran = []
+
+        def run_step(step_id):
+            ran.append(step_id)
+            if step_id in fail:
+                raise ValueError("Oh dear")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = scheduler.run_steps(self.DEPENDENCIES, run_step, executor, 2, journal=journal)
+        return sorted(ran), {r.step_id: r.status for r in results}
+
+    def test_resume_runs_only_failed_and_unrun_steps(self, tmpdir):
+        versions = {"a": "v1", "b": "v1", "c": "v1", "d": "v1"}
+
+        with RunJournal(tmpdir.strpath, "run", versions.get) as journal:
+            ran, _ = self.run(journal, fail={"b"})
+        assert ran == ["a", "b", "d"]
+
+        with RunJournal(tmpdir.strpath, "run", versions.get, resume=True) as journal:
+            ran, statuses = self.run(journal)
+        assert ran == ["b", "c"]
+        assert statuses["a"] == statuses["d"] == scheduler.COMPLETED_EARLIER
+
+        # a's output has since changed, so it and everything downstream is rerun
+        versions["a"] = "v2"
+        with RunJournal(tmpdir.strpath, "run", versions.get, resume=True) as journal:
+            ran, _ = self.run(journal)
+        assert ran == ["a", "b", "c"]
+
+    def test_prioritises_steps_that_took_longest_in_earlier_runs(self, tmpdir):
+        with RunJournal(tmpdir.strpath, "run-1", lambda _: None) as journal:
+            self.run(journal)
+            for step_id, duration in [("a", 1), ("b", 1), ("c", 1), ("d", 10)]:
+                result = scheduler.StepResult(step_id, step_id)
+                result.status, result.start, result.end = scheduler.SUCCEEDED, 0, duration
+                journal.finished(result)
+
+        order = []
+        with RunJournal(tmpdir.strpath, "run-2", lambda _: None) as journal, \
+                ThreadPoolExecutor(max_workers=1) as executor:
+            scheduler.run_steps(self.DEPENDENCIES, order.append, executor, 1, journal=journal)
+
+        assert order == ["d", "a", "b", "c"]
+
+    def test_resume_of_unknown_run_fails(self, tmpdir):
+        with pytest.raises(QuarticException):
+            RunJournal(tmpdir.strpath, "nope", lambda _: None, resume=True)
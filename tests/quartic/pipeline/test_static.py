@@ -0,0 +1,85 @@
+import os.path
+import pytest
+from quartic.common import utils
+from quartic.common.exceptions import QuarticException
+from quartic.dsl.static import extract_nodes, get_pipeline
+
+resources_dir = "tests/resources"
+
+RAW = """
+from quartic.incubating import raw, FromBucket
+
+@raw
+def my_raw() -> "my_raw":
+    "Some raw data"
+    return FromBucket("/some/data", name="Raw")
+"""
+
+COMPUTED = """
+from quartic import step
+
+NAME = "computed"
+
+@step
+def computed(_: NAME) -> "computed_output":
+    pass
+"""
+
+MULTILINE = """
+from quartic import step
+
+@step
+def multiline(_: "a") -> "b":
+    return dict(
+        x=1,
+    )
+    # Not part of the block
+
+X = 1
+"""
+
+
+class TestStatic:
+    @pytest.mark.parametrize("dag", ["good_dag", "failing_dag", "disjoint_dag"])
+    def test_matches_imported_nodes(self, dag):
+        package_dir = os.path.join(resources_dir, dag)
+        imported = [node.to_dict() for node in utils.get_pipeline_from_args([package_dir])]
+        assert extract_nodes(os.path.join(package_dir, dag + ".py"), dag) is not None
+        assert [node.to_dict() for node in get_pipeline([package_dir])] == imported
+
+    def test_extracts_raw_nodes(self, write_package):
+        package_dir = write_package("static_raw", {"raw_data.py": RAW})
+        nodes = extract_nodes(os.path.join(package_dir, "raw_data.py"), "static_raw")
+        assert [node.to_dict() for node in nodes] == \
+            [node.to_dict() for node in utils.get_pipeline_from_args([package_dir])]
+        assert not nodes[0].runnable()
+
+    def test_line_range_matches_imported_nodes(self, write_package):
+        package_dir = write_package("static_multiline", {"multiline.py": MULTILINE})
+        nodes = extract_nodes(os.path.join(package_dir, "multiline.py"), "static_multiline")
+        assert [node.to_dict() for node in nodes] == \
+            [node.to_dict() for node in utils.get_pipeline_from_args([package_dir])]
+
+    @pytest.mark.parametrize("source", [
+        COMPUTED,
+        "from quartic import step\ndef f(_: 'a') -> 'b':\n    pass\nf = step(f)\n",
+        "from __future__ import annotations\nfrom quartic import step\n@step\ndef f(_: 'a') -> 'b':\n    pass\n",
+        "from static_dynamic.other import *\n",
+        "from quartic import step\n@step\ndef f(_) -> 'b':\n    pass\n",
+    ])
+    def test_dynamic_modules_need_importing(self, write_package, source):
+        package_dir = write_package("static_dynamic", {"m.py": source})
+        assert extract_nodes(os.path.join(package_dir, "m.py"), "static_dynamic") is None
+
+    def test_only_imports_dynamic_modules(self, write_package):
+        good_dag = open(os.path.join(resources_dir, "good_dag", "good_dag.py")).read()
+        package_dir = write_package("static_mixed", {
+            "a_static.py": "import module_that_does_not_exist\n" + good_dag,
+            "b_dynamic.py": COMPUTED
+        })
+        nodes = get_pipeline([package_dir])
+        assert [node.get_name() for node in nodes] == ["step1", "step2", "computed"]
+        assert nodes[2].to_dict()["inputs"] == [{"namespace": None, "dataset_id": "computed"}]
+
+        with pytest.raises(QuarticException):
+            nodes[0].execute(None, "test")
@@ -5,6 +5,8 @@ from mock import Mock, call
 # TODO - test reader
 # TODO - test delete
 
+EMPTY_CONTENT_HASH = "sha256:e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
 
 
 class TestBasics:
@@ -75,7 +77,8 @@ class TestWriter:
                 "type": "cloud",
                 "path": "/some-path",
                 "streaming": False,
-                "mime_type": "application/octet-stream"
+                "mime_type": "application/octet-stream",
+                "content_hash": EMPTY_CONTENT_HASH
             }
         }, False)]
 
@@ -0,0 +1,24 @@
+from quartic import step
+from quartic.common.dataset import Writer
+
+class DevNullWriter(Writer):
+    def apply(self, *args, **kwargs):
+        pass
+
+def writer(name, description):
+    return DevNullWriter(name, description)
+
+@step
+def step1(_: "my_input") -> "my_dataset":
+    "Fails"
+    raise ValueError("Oh dear")
+
+@step
+def step2(_: "my_dataset") -> "my_dataset2":
+    "Depends on a failure"
+    return writer("Stuff", "Further stuff").json({})
+
+@step
+def step3(_: "my_input") -> "my_dataset3":
+    "Independent"
+    return writer("Stuff", "Further stuff").json({})